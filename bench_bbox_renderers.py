@@ -0,0 +1,91 @@
+'''
+Бенчмарк способов отрисовки рамок BboxFrameTracker ('pil' и 'opencv') на синтетическом кадре 1080p
+с 10, 50 и 200 рамками. Работает без Qt, видео и весов YOLO.
+Замеряются:
+    new_frame - отрисовка нового кадра (все слои строятся заново, подписи уже в кэше);
+    drag - отрисовка при перетаскивании одной рамки (перерисовывается только интерактивный слой).
+
+Пример запуска:
+    python bench_bbox_renderers.py --sizes 10 50 200 --repeats 20 --output bench_renderers_output.txt
+'''
+import argparse
+import time
+import random
+
+import numpy as np
+import pandas as pd
+
+from new_opencv_frames import Bbox, BboxFrameTracker, BBOX_RENDERERS
+
+IMG_ROWS = 1080
+IMG_COLS = 1920
+
+def make_frame_with_boxes(rng, bboxes_num, renderer_backend):
+    img = (np.random.RandomState(rng.randint(0, 2**31 - 1)).rand(IMG_ROWS, IMG_COLS, 3)*255).astype(np.uint8)
+    registered_objects_db = pd.DataFrame(columns=['object_idx', 'class_name', 'object_description'])
+    frame_with_boxes = BboxFrameTracker(img, registered_objects_db, renderer_backend=renderer_backend)
+    for auto_idx in range(bboxes_num):
+        w = rng.randint(40, 300)
+        h = rng.randint(40, 300)
+        x0 = rng.randint(0, IMG_COLS - w)
+        y0 = rng.randint(0, IMG_ROWS - h)
+        bbox = Bbox(
+            x0, y0, x0+w, y0+h, IMG_ROWS, IMG_COLS, class_name='person', auto_idx=auto_idx,
+            registered_idx=-1, object_description='', color=(0, 0, 0))
+        frame_with_boxes.bboxes_container.update_bbox(bbox)
+    return frame_with_boxes, img
+
+def measure_new_frame(frame_with_boxes, img, repeats):
+    # прогрев кэша подписей
+    frame_with_boxes.render_boxes()
+    durations = []
+    for _ in range(repeats):
+        frame_with_boxes.update_img(img)
+        start = time.perf_counter()
+        frame_with_boxes.render_boxes()
+        durations.append(time.perf_counter() - start)
+    return np.median(durations)*1000
+
+def measure_drag(frame_with_boxes, repeats):
+    bbox = next(iter(frame_with_boxes.bboxes_container.iter_bboxes()))
+    x0, y0, x1, y1 = bbox.coords
+    frame_with_boxes.processing_box = bbox
+    bbox.box_drag(x0 + 1, y0 + 1)
+    frame_with_boxes.render_boxes()
+    durations = []
+    for i in range(repeats):
+        bbox.box_drag(x0 + 1 + i % 20, y0 + 1)
+        frame_with_boxes.bboxes_container.update_bbox(bbox)
+        start = time.perf_counter()
+        frame_with_boxes.render_boxes()
+        durations.append(time.perf_counter() - start)
+    bbox.stop_box_drag()
+    frame_with_boxes.processing_box = None
+    return np.median(durations)*1000
+
+def run_benchmarks(sizes, repeats, seed):
+    results = []
+    for bboxes_num in sizes:
+        for renderer_backend in BBOX_RENDERERS:
+            frame_with_boxes, img = make_frame_with_boxes(random.Random(seed), bboxes_num, renderer_backend)
+            results.append({
+                'renderer_backend': renderer_backend,
+                'bboxes': bboxes_num,
+                'new_frame_ms': round(measure_new_frame(frame_with_boxes, img, repeats), 2),
+                'drag_ms': round(measure_drag(frame_with_boxes, repeats), 2),
+                })
+    return pd.DataFrame(results)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Бенчмарк способов отрисовки рамок')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 50, 200], help='количество рамок на кадре')
+    parser.add_argument('--repeats', type=int, default=20, help='количество отрисовок на замер')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_renderers_output.txt', help='файл, куда записывается таблица результатов')
+    args = parser.parse_args()
+
+    results_df = run_benchmarks(args.sizes, args.repeats, args.seed)
+    results_str = results_df.to_string(index=False)
+    print(results_str)
+    with open(args.output, 'w', encoding='utf-8') as fd:
+        fd.write(results_str + '\n')
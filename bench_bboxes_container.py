@@ -0,0 +1,176 @@
+'''
+Бенчмарк операций BboxesContainer на синтетических рамках (10, 100 и 1000 рамок на кадр).
+Работает без Qt, видео и весов YOLO. Для каждой операции выводится среднее время одного вызова
+и пиковый объем памяти, выделенной за время прогона (tracemalloc).
+
+Пример запуска:
+    python bench_bboxes_container.py --sizes 10 100 1000 --frames 20 --output bench_output.txt
+'''
+import argparse
+import time
+import tracemalloc
+import random
+
+import numpy as np
+import pandas as pd
+
+from new_opencv_frames import Bbox, BboxesContainer
+
+IMG_ROWS = 1080
+IMG_COLS = 1920
+CLASS_NAMES = ['person', 'car', 'dog']
+
+def make_bbox(rng, class_name, auto_idx, registered_idx=-1, object_description=''):
+    '''
+    Синтетическая рамка случайного размера в пределах кадра
+    '''
+    w = rng.randint(20, 200)
+    h = rng.randint(20, 200)
+    x0 = rng.randint(0, IMG_COLS - w)
+    y0 = rng.randint(0, IMG_ROWS - h)
+    return Bbox(
+        x0, y0, x0+w, y0+h, IMG_ROWS, IMG_COLS, class_name=class_name, auto_idx=auto_idx,
+        registered_idx=registered_idx, object_description=object_description, color=(0, 0, 0))
+
+def make_frame_bboxes(rng, bboxes_num):
+    '''
+    Рамки одного кадра: auto_idx уникальны в пределах класса
+    '''
+    return [make_bbox(rng, CLASS_NAMES[i % len(CLASS_NAMES)], i // len(CLASS_NAMES)) for i in range(bboxes_num)]
+
+def make_container(rng, bboxes_num):
+    registered_objects_db = pd.DataFrame(columns=['object_idx', 'class_name', 'object_description'])
+    bboxes_container = BboxesContainer(registered_objects_db)
+    for bbox in make_frame_bboxes(rng, bboxes_num):
+        bboxes_container.update_bbox(bbox)
+    return bboxes_container
+
+# Каждый сценарий получает генератор случайных чисел и количество рамок, подготавливает данные
+# и возвращает (функция, количество вызовов операции внутри функции)
+
+def scenario_update_bbox(rng, bboxes_num):
+    bboxes_container = make_container(rng, bboxes_num)
+    frame_bboxes = make_frame_bboxes(rng, bboxes_num)
+    def run():
+        for bbox in frame_bboxes:
+            bboxes_container.update_bbox(bbox)
+    return run, bboxes_num
+
+def scenario_find_nearest_iou_bbox(rng, bboxes_num):
+    bboxes_container = make_container(rng, bboxes_num)
+    query_bboxes = list(bboxes_container.iter_bboxes())[:min(bboxes_num, 50)]
+    def run():
+        for bbox in query_bboxes:
+            bboxes_container.find_nearest_iou_bbox(bbox, 'all')
+    return run, len(query_bboxes)
+
+def scenario_check_updated_bboxes(rng, bboxes_num):
+    bboxes_container = make_container(rng, bboxes_num)
+    # переход к следующему кадру: рамки, добавленные make_container, становятся не обновленными
+    bboxes_container.check_updated_bboxes()
+    frame_bboxes = make_frame_bboxes(rng, bboxes_num)
+    # на каждом кадре пропадает примерно 10% рамок
+    updated_bboxes = [bbox for bbox in frame_bboxes if rng.random() > 0.1]
+    for bbox in updated_bboxes:
+        bboxes_container.update_bbox(bbox)
+    # рамки кадра отличаются по (class_name, auto_idx), поэтому пропадают все не обновленные рамки
+    dissapeared_bboxes_num = bboxes_num - len(updated_bboxes)
+    def run():
+        dissapeared_bboxes = bboxes_container.check_updated_bboxes()
+        # иначе замер сводится к проверке без удаления рамок
+        assert len(dissapeared_bboxes) == dissapeared_bboxes_num, \
+            f'{len(dissapeared_bboxes)} bboxes were removed instead of {dissapeared_bboxes_num}'
+    return run, 1
+
+def scenario_change_bboxes_displaying_type(rng, bboxes_num):
+    bboxes_container = make_container(rng, bboxes_num)
+    def run():
+        for displaying_type in ('auto', 'registered', 'full'):
+            bboxes_container.change_bboxes_displaying_type(displaying_type)
+    return run, 3
+
+def scenario_iter_bboxes(rng, bboxes_num):
+    bboxes_container = make_container(rng, bboxes_num)
+    def run():
+        for bbox in bboxes_container.iter_bboxes():
+            pass
+    return run, 1
+
+def scenario_assocoate_bbox_with_registered_object(rng, bboxes_num):
+    bboxes_container = make_container(rng, bboxes_num)
+    auto_bboxes = list(bboxes_container.iter_bboxes())
+    counter = [0]
+    def run():
+        # регистрируем рамки по очереди: каждый вызов связывает следующую рамку с новым объектом
+        bbox = auto_bboxes[counter[0] % len(auto_bboxes)]
+        registered_idx = counter[0]
+        counter[0] += 1
+        bboxes_container.assocoate_bbox_with_registered_object(
+            bbox.class_name, bbox.auto_idx, f'object_{registered_idx}', registered_idx)
+    return run, 1
+
+SCENARIOS = {
+    'update_bbox': scenario_update_bbox,
+    'find_nearest_iou_bbox': scenario_find_nearest_iou_bbox,
+    'check_updated_bboxes': scenario_check_updated_bboxes,
+    'change_bboxes_displaying_type': scenario_change_bboxes_displaying_type,
+    'iter_bboxes': scenario_iter_bboxes,
+    'assocoate_bbox_with_registered_object': scenario_assocoate_bbox_with_registered_object,
+}
+
+def measure_time(scenario, bboxes_num, frames_num, seed):
+    '''
+    Среднее время одного вызова операции в микросекундах.
+    Данные подготавливаются заново на каждом кадре, в замер попадает только сама операция
+    '''
+    rng = random.Random(seed)
+    durations = []
+    calls_num = 0
+    for _ in range(frames_num):
+        run, calls_per_run = scenario(rng, bboxes_num)
+        start = time.perf_counter()
+        run()
+        durations.append(time.perf_counter() - start)
+        calls_num += calls_per_run
+    return sum(durations) / calls_num * 1e6, np.median(durations) * 1e6
+
+def measure_peak_memory(scenario, bboxes_num, seed):
+    '''
+    Пиковый объем памяти (КиБ), выделенной при выполнении операции (без подготовки данных)
+    '''
+    rng = random.Random(seed)
+    run, _ = scenario(rng, bboxes_num)
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024
+
+def run_benchmarks(sizes, frames_num, seed):
+    results = []
+    for name, scenario in SCENARIOS.items():
+        for bboxes_num in sizes:
+            mean_call_us, median_run_us = measure_time(scenario, bboxes_num, frames_num, seed)
+            peak_kib = measure_peak_memory(scenario, bboxes_num, seed)
+            results.append({
+                'operation': name,
+                'bboxes': bboxes_num,
+                'mean_call_us': round(mean_call_us, 2),
+                'median_run_us': round(median_run_us, 2),
+                'peak_kib': round(peak_kib, 1),
+                })
+    return pd.DataFrame(results)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Бенчмарк операций BboxesContainer')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000], help='количество рамок на кадр')
+    parser.add_argument('--frames', type=int, default=20, help='количество кадров (повторов) на замер')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_output.txt', help='файл, куда записывается таблица результатов')
+    args = parser.parse_args()
+
+    results_df = run_benchmarks(args.sizes, args.frames, args.seed)
+    results_str = results_df.to_string(index=False)
+    print(results_str)
+    with open(args.output, 'w', encoding='utf-8') as fd:
+        fd.write(results_str + '\n')
@@ -0,0 +1,249 @@
+'''
+Предварительная детекция и трекинг объектов по всему видео без графического интерфейса.
+Детектор из settings.json ('detector_models') прогоняется по кадрам видео пакетами, результаты
+(рамки, индексы объектов, классы и уверенности) сохраняются в компактный файл рядом с папкой _labels.
+TrackerWindow при открытии видео загружает этот файл и берет рамки из него вместо запуска детектора на каждом кадре.
+
+Пример запуска:
+    python new_detection_cache.py path/to/video.mp4 --model yolov8n --batch-size 16
+'''
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from new_video_source import open_video_source
+
+def get_detection_cache_path(path_to_video, model_type):
+    '''
+    Путь до файла с результатами детекции: лежит рядом с папкой _labels, в имени указан детектор
+    '''
+    path_to_folder, name = os.path.split(path_to_video)
+    model_name = get_model_name(model_type)
+    return os.path.join(path_to_folder, '.'.join(name.split('.')[:-1]) + f'_detections_{model_name}.npz')
+
+def get_model_name(model_type):
+    '''
+    Имя детектора без расширения файла весов: 'yolov8n.pt' -> 'yolov8n'
+    '''
+    return os.path.basename(model_type).split('.')[0]
+
+def get_default_model_type(settings_dict, is_cuda_available):
+    '''
+    Детектор по умолчанию выбирается так же, как в TrackerWindow
+    '''
+    detectors_names_list = settings_dict['detector_models']
+    return detectors_names_list[-1] if is_cuda_available else detectors_names_list[-4]
+
+class DetectionCache:
+    '''
+    Результаты детекции и трекинга для всех кадров видео. Рамки всех кадров хранятся в общих массивах,
+    рамки кадра frame_idx занимают строки frame_offsets[frame_idx]:frame_offsets[frame_idx+1].
+    Если прогон детектора был прерван, результаты есть только для первых frames_done кадров
+    '''
+    def __init__(self, model_name, class_names, frame_number, frame_offsets, xyxy, ids, class_idx, confs):
+        self.model_name = model_name
+        # имена классов детектора: class_names[class_idx] - имя класса рамки
+        self.class_names = np.asarray(class_names, dtype=object)
+        self.frame_number = frame_number
+        self.frame_offsets = np.asarray(frame_offsets, dtype=np.int64)
+        self.frames_done = len(self.frame_offsets) - 1
+        self.xyxy = np.asarray(xyxy, dtype=np.uint16).reshape(-1, 4)
+        self.ids = np.asarray(ids, dtype=np.int32)
+        self.class_idx = np.asarray(class_idx, dtype=np.uint16)
+        self.confs = np.asarray(confs, dtype=np.float16)
+        # наибольший индекс объекта: индексы, которые выдает трекер при работе без кэша, сдвигаются за него,
+        # чтобы не совпасть с индексами из кэша
+        self.max_id = int(self.ids.max()) if len(self.ids) > 0 else -1
+
+    def __len__(self):
+        return self.frames_done
+
+    def has_frame(self, frame_idx):
+        return 0 <= frame_idx < self.frames_done
+
+    def get_frame_detections(self, frame_idx):
+        '''
+        Рамки кадра: (xyxy, ids, class_names, confs). Массивы - срезы общих массивов, без копирования
+        '''
+        start, stop = self.frame_offsets[frame_idx], self.frame_offsets[frame_idx + 1]
+        return self.xyxy[start:stop], self.ids[start:stop], self.class_names[self.class_idx[start:stop]], self.confs[start:stop]
+
+    def ingest_frame(self, bboxes_container, frame_idx, img_rows, img_cols):
+        '''
+        Обновление контейнера рамками кадра frame_idx, так же как это делает YoloTracker.track
+        '''
+        xyxy, ids, detected_classes, _ = self.get_frame_detections(frame_idx)
+        # этот параметр нужен, чтобы рамка строилась не впритык объекту, а захватывала еще некоторую дополнительную область
+        bbox_append_value = int(min(img_rows, img_cols)*0.025)
+        bboxes_container.ingest_detections(
+            xyxy, ids, detected_classes, img_rows, img_cols, bbox_append_value=bbox_append_value)
+        return bboxes_container
+
+    def save(self, path):
+        '''
+        Запись во временный файл и переименование: при сбое не остается недописанного файла
+        '''
+        tmp_path = path + '.tmp.npz'
+        np.savez_compressed(
+            tmp_path,
+            model_name=np.array(self.model_name),
+            class_names=self.class_names.astype(str),
+            frame_number=np.array(self.frame_number),
+            frame_offsets=self.frame_offsets,
+            xyxy=self.xyxy,
+            ids=self.ids,
+            class_idx=self.class_idx,
+            confs=self.confs)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                model_name=str(data['model_name']),
+                class_names=data['class_names'].tolist(),
+                frame_number=int(data['frame_number']),
+                frame_offsets=data['frame_offsets'],
+                xyxy=data['xyxy'],
+                ids=data['ids'],
+                class_idx=data['class_idx'],
+                confs=data['confs'])
+
+    @classmethod
+    def load_or_none(cls, path, path_to_video):
+        '''
+        Чтение сохраненных результатов детекции. Файл, который старше видео или не читается, не используется
+        '''
+        if not os.path.isfile(path) or os.path.getmtime(path) < os.path.getmtime(path_to_video):
+            return None
+        try:
+            detection_cache = cls.load(path)
+        except (OSError, ValueError, KeyError):
+            return None
+        return detection_cache if len(detection_cache) > 0 else None
+
+class DetectionCacheBuilder:
+    '''
+    Накопление результатов трекинга кадр за кадром
+    '''
+    def __init__(self, model_name, class_names, frame_number):
+        self.model_name = model_name
+        self.class_names = class_names
+        self.frame_number = frame_number
+        self.frame_offsets = [0]
+        self.xyxy_list = []
+        self.ids_list = []
+        self.class_idx_list = []
+        self.confs_list = []
+
+    def append_frame(self, xyxy, ids, class_idx, confs):
+        self.xyxy_list.append(np.asarray(xyxy).reshape(-1, 4))
+        self.ids_list.append(np.asarray(ids).reshape(-1))
+        self.class_idx_list.append(np.asarray(class_idx).reshape(-1))
+        self.confs_list.append(np.asarray(confs).reshape(-1))
+        self.frame_offsets.append(self.frame_offsets[-1] + len(self.ids_list[-1]))
+
+    def append_empty_frame(self):
+        self.append_frame(np.zeros((0, 4)), np.zeros(0), np.zeros(0), np.zeros(0))
+
+    def build(self):
+        concat = lambda arrays_list, shape: np.concatenate(arrays_list) if arrays_list else np.zeros(shape)
+        # координаты обрезаются, чтобы поместиться в uint16
+        xyxy = np.clip(concat(self.xyxy_list, (0, 4)), 0, np.iinfo(np.uint16).max)
+        return DetectionCache(
+            model_name=self.model_name,
+            class_names=self.class_names,
+            frame_number=self.frame_number,
+            frame_offsets=self.frame_offsets,
+            xyxy=xyxy,
+            ids=concat(self.ids_list, 0),
+            class_idx=concat(self.class_idx_list, 0),
+            confs=concat(self.confs_list, 0))
+
+def build_detection_cache(
+        path_to_video, model_type, batch_size=16, progress_callback=None, stop_event=None, **yolo_kwargs):
+    '''
+    Прогон детектора с трекингом по всему видео пакетами по batch_size кадров.
+    Кадры читаются последовательно, трекер (persist=True) обрабатывает кадры пакета по порядку,
+    поэтому индексы объектов согласованы на всем видео.
+    progress_callback(frames_done, frame_number) вызывается после каждого пакета.
+    Если установлен stop_event, прогон прерывается и возвращаются результаты для обработанных кадров
+    '''
+    # ultralytics и torch нужны только для прогона детектора, чтение результатов обходится без них
+    import torch
+    from ultralytics import YOLO
+
+    device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
+    model = YOLO(model_type).to(device)
+    class_names = [model.names[class_idx] for class_idx in sorted(model.names)]
+
+    video_source = open_video_source(path_to_video)
+    builder = DetectionCacheBuilder(get_model_name(model_type), class_names, video_source.frame_number)
+    try:
+        frame_idx = 0
+        while frame_idx < video_source.frame_number:
+            if stop_event is not None and stop_event.is_set():
+                break
+            frame_buffers = []
+            for idx in range(frame_idx, min(frame_idx + batch_size, video_source.frame_number)):
+                ret, frame_buffer = video_source.read_buffer(idx)
+                if not ret:
+                    break
+                frame_buffers.append(frame_buffer)
+            if len(frame_buffers) == 0:
+                break
+
+            results_list = model.track(
+                source=[frame_buffer.array for frame_buffer in frame_buffers], persist=True, verbose=False, **yolo_kwargs)
+            for frame_buffer in frame_buffers:
+                frame_buffer.release()
+
+            for results in results_list:
+                boxes = results.boxes
+                if boxes is None or boxes.id is None:
+                    # трекер не сопроводил ни одного объекта
+                    builder.append_empty_frame()
+                    continue
+                builder.append_frame(
+                    boxes.xyxy.long().cpu().numpy(),
+                    boxes.id.long().cpu().numpy(),
+                    boxes.cls.long().cpu().numpy(),
+                    boxes.conf.cpu().numpy())
+
+            frame_idx += len(frame_buffers)
+            if progress_callback is not None:
+                progress_callback(frame_idx, video_source.frame_number)
+    finally:
+        video_source.release()
+    return builder.build()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Предварительная детекция и трекинг объектов на видео')
+    parser.add_argument('videos', nargs='+', help='пути до видео')
+    parser.add_argument('--model', default=None, help='детектор; по умолчанию выбирается из settings.json, как в TrackerWindow')
+    parser.add_argument('--batch-size', type=int, default=16, help='количество кадров в пакете')
+    parser.add_argument('--settings', default='settings.json')
+    args = parser.parse_args()
+
+    model_type = args.model
+    if model_type is None:
+        import torch
+        with open(args.settings, 'r', encoding='utf-8') as fd:
+            settings_dict = json.load(fd)
+        model_type = get_default_model_type(settings_dict, torch.cuda.is_available())
+
+    def print_progress(frames_done, frame_number):
+        print(f'\r{frames_done}/{frame_number}', end='', flush=True)
+
+    for path_to_video in args.videos:
+        start = time.perf_counter()
+        print(f'{path_to_video}: {model_type}')
+        detection_cache = build_detection_cache(
+            path_to_video, model_type, batch_size=args.batch_size, progress_callback=print_progress)
+        path_to_cache = get_detection_cache_path(path_to_video, model_type)
+        detection_cache.save(path_to_cache)
+        print(f'\n{path_to_cache}: {len(detection_cache)} frames, {len(detection_cache.ids)} boxes, '
+              f'{time.perf_counter() - start:.1f} s')
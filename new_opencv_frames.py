@@ -8,7 +8,16 @@ import pandas as pd
 
 from PIL import Image, ImageFont, ImageDraw, ImageColor, ImageFont
 
-from copy import deepcopy
+from copy import deepcopy, copy
+
+import weakref
+import bisect
+import sys
+import csv
+import threading
+from functools import lru_cache
+
+from new_video_source import FrameBuffer
 
 def create_palette(classes_list):
     max_color = 0xFFFFFF
@@ -29,11 +38,23 @@ def check_cursor_in_bbox(x0, y0, x1, y1, cursor_x, cursor_y):
     return False
 
 def check_cursor_in_corner(corner_x, corner_y, cursor_x, cursor_y, target_radius):
-    radius = np.linalg.norm([cursor_x-corner_x, cursor_y-corner_y])
-    if radius <= target_radius:
+    # сравниваем квадраты расстояний, чтобы не вычислять корень (функция вызывается на каждое движение мыши)
+    dx = cursor_x - corner_x
+    dy = cursor_y - corner_y
+    if dx*dx + dy*dy <= target_radius*target_radius:
         return True
     return False
 
+def find_cursor_corner(x0, y0, x1, y1, cursor_x, cursor_y, target_radius):
+    '''
+    Поиск угла рамки, находящегося рядом с курсором. Углы проверяются в порядке
+    (x0,y0), (x1,y1), (x0,y1), (x1,y0). Если курсор не рядом с углами, возвращается None
+    '''
+    for corner_x, corner_y in ((x0, y0), (x1, y1), (x0, y1), (x1, y0)):
+        if check_cursor_in_corner(corner_x, corner_y, cursor_x, cursor_y, target_radius):
+            return corner_x, corner_y
+    return None
+
 def compute_bbox_area(x0,y0,x1,y1):
     return abs(x1-x0)*abs(y1-y0)
 
@@ -51,6 +72,17 @@ def process_box_coords(x0, y0, x1, y1, rows, cols):
 
     return x0, y0, x1, y1
 
+def process_boxes_coords_array(coords, rows, cols):
+    '''
+    Векторный аналог process_box_coords для массива рамок shape=(N, 4) в формате x0,y0,x1,y1
+    '''
+    coords = np.asarray(coords).reshape(-1, 4).astype(np.int64)
+    # фиксируем координаты рамок, чтобы они не выходили за пределы кадра
+    coords[:, [0, 2]] = np.clip(coords[:, [0, 2]], 0, cols)
+    coords[:, [1, 3]] = np.clip(coords[:, [1, 3]], 0, rows)
+    # переставляем местами нулевую и первую координаты, если первая больше нулевой
+    return np.concatenate([np.minimum(coords[:, :2], coords[:, 2:]), np.maximum(coords[:, :2], coords[:, 2:])], axis=1)
+
 def xyxy2xywh(x0, y0, x1, y1):
     x0, x1 = min(x0, x1), max(x0, x1)
     y0, y1 = min(y0, y1), max(y0, y1)
@@ -98,7 +130,39 @@ def compute_iou(coords1, coords2):
         s_intersection = (x1-x0)*(y1-y0)
 
     return s_intersection / (s0 + s1 - s_intersection + 1e-9)
-    
+
+def compute_iou_matrix(coords1, coords2):
+    '''
+    Векторное вычисление матрицы IoU между двумя наборами рамок за один проход NumPy
+    coords1 - массив координат рамок в формате x0,y0,x1,y1, shape=(N, 4)
+    coords2 - массив координат рамок в формате x0,y0,x1,y1, shape=(M, 4)
+    Return:
+        матрица IoU, shape=(N, M). Элемент [i, j] совпадает с compute_iou(coords1[i], coords2[j])
+    '''
+    coords1 = np.asarray(coords1, dtype=np.float64).reshape(-1, 4)
+    coords2 = np.asarray(coords2, dtype=np.float64).reshape(-1, 4)
+
+    # площади отдельных прямоугольников
+    s0 = np.abs(coords1[:, 2] - coords1[:, 0])*np.abs(coords1[:, 3] - coords1[:, 1])
+    s1 = np.abs(coords2[:, 2] - coords2[:, 0])*np.abs(coords2[:, 3] - coords2[:, 1])
+
+    # координаты пересечений всех пар рамок
+    x0 = np.maximum(coords1[:, None, 0], coords2[None, :, 0])
+    y0 = np.maximum(coords1[:, None, 1], coords2[None, :, 1])
+    x1 = np.minimum(coords1[:, None, 2], coords2[None, :, 2])
+    y1 = np.minimum(coords1[:, None, 3], coords2[None, :, 3])
+
+    # если хотя бы одна из сторон оказалась меньше нуля, значит пересечения нет
+    s_intersection = np.clip(x1 - x0, 0, None)*np.clip(y1 - y0, 0, None)
+
+    return s_intersection / (s0[:, None] + s1[None, :] - s_intersection + 1e-9)
+
+def bboxes_to_coords_array(bboxes):
+    '''
+    Перевод последовательности объектов Bbox в массив координат shape=(N, 4)
+    '''
+    return np.array([bbox.coords for bbox in bboxes], dtype=np.float64).reshape(-1, 4)
+
 def draw_bbox_with_text(
     image:np.array,
     bbox_coords:tuple,
@@ -115,47 +179,291 @@ def draw_bbox_with_text(
     color:tuple|list, - цвет рамки
     font:ImageFont.FreeTypeFont, - шрифт текста
     '''
-
-    x0, y0, x1, y1 = bbox_coords
     image =  Image.fromarray(image)
-    cols, rows = image.size
-    #x0, y0, x1, y1 = process_box_coords(x0, y0, x1, y1, rows, cols)
+    draw_bbox_with_text_on_canvas(image, bbox_coords, bbox_width, class_name, color, font)
+    return np.array(image)
 
-    draw = ImageDraw.Draw(image)
+def draw_bbox_with_text_on_canvas(
+    canvas:Image.Image,
+    bbox_coords:tuple,
+    bbox_width:int,
+    class_name:str,
+    color:tuple,
+    font:ImageFont.FreeTypeFont,
+    ):
+    '''
+    Рисование рамки с подписью на уже созданном холсте PIL (без перевода изображения в массив и обратно)
+    canvas:Image.Image - холст
+    остальные аргументы совпадают с draw_bbox_with_text
+    '''
+    x0, y0, x1, y1 = bbox_coords
 
     # рисуем прямоугольник для общей рамки...
-    draw.rectangle(bbox_coords, outline=color, width=bbox_width)
+    ImageDraw.Draw(canvas).rectangle(bbox_coords, outline=color, width=bbox_width)
    
 
+    # вычисляем координаты текста - посередине рамки
+    text_coords = ((x1+x0)//2, (y1+y0)//2)
+
+    # подпись (прямоугольник с текстом) берется из кэша и накладывается на холст по альфа-каналу
+    sprite, (offset_x, offset_y) = render_caption_sprite(class_name, tuple(color), font.size, int(bbox_width), font.path)
+    canvas.paste(sprite, (int(text_coords[0]) + offset_x, int(text_coords[1]) + offset_y), sprite)
+
+@lru_cache(maxsize=None)
+def get_font(font_size:int, font_path:str="FiraCode-SemiBold.ttf"):
+    '''
+    Шрифт заданного размера. Файл шрифта читается с диска только один раз для каждого размера
+    '''
+    return ImageFont.truetype(font_path, font_size)
+
+@lru_cache(maxsize=1024)
+def render_caption_sprite(text:str, color:tuple, font_size:int, bbox_width:int, font_path:str="FiraCode-SemiBold.ttf"):
+    '''
+    Подпись рамки (прямоугольник, залитый цветом рамки, с текстом посередине), нарисованная на прозрачном
+    изображении RGBA. Результаты кэшируются (LRU), поэтому каждая подпись рисуется только при первом появлении.
+    Return:
+        sprite:Image.Image - изображение подписи
+        offset:tuple - смещение левого верхнего угла изображения относительно центра текста
+    '''
+    font = get_font(font_size, font_path)
+
     # определяем цвет шрифта исходя из яркости ЧБ эквивалента цвета класса
     r, g, b = color
     grayscale = int(0.299*r + 0.587*g + 0.114*b)
     # пороговая фильтрация работает на удивление хорошо...
     font_color = 255 if grayscale < 128 else 0
 
-    # вычисляем координаты текста - посередине рамки
-    text_coords = ((x1+x0)//2, (y1+y0)//2)
-
-    font_size = font.size
-
     # квадратный корень почему-то работает очень хорошо для вычисления ширины рамки текста...
     text_bbow_width = np.round(np.sqrt(font_size)).astype(int)
     # вычисляем зазор между рамкой текста и текстом
     text_bbox_spacing = text_bbow_width//3 if text_bbow_width//3 > 1 else 1
 
-    # определяем координаты обрамляющего текст прямоугольника
-    text_bbox = draw.textbbox(text_coords, class_name, font=font, anchor='mm') # anchor='mm' означает расположение текста посередине относительно координат
+    # определяем координаты обрамляющего текст прямоугольника относительно центра текста
+    text_bbox = ImageDraw.Draw(Image.new('RGBA', (1, 1))).textbbox((0, 0), text, font=font, anchor='mm') # anchor='mm' означает расположение текста посередине относительно координат
     # расширяем рамку на 3 пикселя в каждом направлении
-    text_bbox = tuple(np.add(text_bbox, (-text_bbow_width, -text_bbow_width, text_bbow_width, text_bbow_width)))
+    x0, y0, x1, y1 = (int(v) for v in np.add(text_bbox, (-text_bbow_width, -text_bbow_width, text_bbow_width, text_bbow_width)))
 
+    sprite = Image.new('RGBA', (x1 - x0 + 1, y1 - y0 + 1), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(sprite)
     # рисуем прямоугольник для текста
-    draw.rectangle(text_bbox, outline=(font_color, font_color, font_color), fill=color, width=bbox_width-text_bbox_spacing)
+    draw.rectangle((0, 0, x1 - x0, y1 - y0), outline=(font_color, font_color, font_color), fill=color, width=bbox_width-text_bbox_spacing)
     # пишем текст
-    draw.text(text_coords, class_name, font=font, anchor='mm', fill=(font_color, font_color, font_color))
+    draw.text((-x0, -y0), text, font=font, anchor='mm', fill=(font_color, font_color, font_color))
+    return sprite, (x0, y0)
 
-    return np.array(image)
+def draw_cv2_on_canvas(canvas:Image.Image, region:tuple, draw_function):
+    '''
+    Рисование примитива OpenCV на холсте PIL. В массив и обратно переводится только область region=(x0,y0,x1,y1),
+    которую занимает примитив, поэтому результат совпадает с рисованием по всему кадру.
+    draw_function(patch, offset_x, offset_y) - функция, рисующая примитив на массиве patch,
+        координаты примитива надо сдвинуть на (-offset_x, -offset_y)
+    '''
+    cols, rows = canvas.size
+    x0, y0, x1, y1 = region
+    x0, x1 = max(int(min(x0, x1)), 0), min(int(max(x0, x1)) + 1, cols)
+    y0, y1 = max(int(min(y0, y1)), 0), min(int(max(y0, y1)) + 1, rows)
+    if x0 >= x1 or y0 >= y1:
+        return
+    patch = np.array(canvas.crop((x0, y0, x1, y1)))
+    draw_function(patch, x0, y0)
+    canvas.paste(Image.fromarray(patch), (x0, y0))
+
+def draw_circle_on_canvas(canvas:Image.Image, center:tuple, radius:int, color:tuple):
+    '''
+    Аналог cv2.circle(image, center, radius, color, -1) для холста PIL
+    '''
+    x, y = int(center[0]), int(center[1])
+    draw_cv2_on_canvas(
+        canvas, (x-radius, y-radius, x+radius, y+radius),
+        lambda patch, offset_x, offset_y: cv2.circle(patch, (x-offset_x, y-offset_y), radius, color, -1))
+
+def draw_filled_rectangle_on_canvas(canvas:Image.Image, pt0:tuple, pt1:tuple, color:tuple):
+    '''
+    Аналог cv2.rectangle(image, pt0, pt1, color, -1) для холста PIL
+    '''
+    x0, y0 = int(pt0[0]), int(pt0[1])
+    x1, y1 = int(pt1[0]), int(pt1[1])
+    draw_cv2_on_canvas(
+        canvas, (x0, y0, x1, y1),
+        lambda patch, offset_x, offset_y: cv2.rectangle(
+            patch, (x0-offset_x, y0-offset_y), (x1-offset_x, y1-offset_y), color, -1))
+
+@lru_cache(maxsize=1024)
+def render_caption_sprite_array(text:str, color:tuple, font_size:int, bbox_width:int, font_path:str="FiraCode-SemiBold.ttf"):
+    '''
+    Подпись рамки в виде массивов NumPy для отрисовки средствами OpenCV (см. render_caption_sprite)
+    Return:
+        sprite_rgb:np.array, shape=(rows, cols, 3) - пиксели подписи
+        sprite_alpha:np.array, shape=(rows, cols, 1) - альфа-канал в диапазоне [0, 1]
+            или None, если подпись полностью непрозрачна
+        offset:tuple - смещение левого верхнего угла подписи относительно центра текста
+    '''
+    sprite, offset = render_caption_sprite(text, color, font_size, bbox_width, font_path)
+    sprite_array = np.array(sprite)
+    sprite_rgb = np.ascontiguousarray(sprite_array[..., :3])
+    if (sprite_array[..., 3] == 255).all():
+        # подпись залита цветом рамки целиком, поэтому ее можно просто копировать
+        return sprite_rgb, None, offset
+    return sprite_rgb, sprite_array[..., 3:].astype(np.float32)/255, offset
+
+def paste_sprite_on_array(image:np.array, sprite_rgb:np.array, sprite_alpha:np.array, x:int, y:int):
+    '''
+    Наложение подписи на массив пикселей по альфа-каналу (с отсечением по границам изображения)
+    x, y - координаты левого верхнего угла подписи
+    '''
+    rows, cols = image.shape[:2]
+    sprite_rows, sprite_cols = sprite_rgb.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + sprite_cols, cols), min(y + sprite_rows, rows)
+    if x0 >= x1 or y0 >= y1:
+        return
+    sprite_rgb = sprite_rgb[y0-y:y1-y, x0-x:x1-x]
+    if sprite_alpha is None:
+        image[y0:y1, x0:x1] = sprite_rgb
+        return
+    sprite_alpha = sprite_alpha[y0-y:y1-y, x0-x:x1-x]
+    region = image[y0:y1, x0:x1]
+    region[:] = (sprite_rgb*sprite_alpha + region*(1 - sprite_alpha)).round().astype(np.uint8)
+
+class PilBboxRenderer:
+    '''
+    Отрисовка рамок средствами PIL: холст - изображение PIL
+    '''
+    @staticmethod
+    def new_canvas(image:np.array):
+        return Image.fromarray(image)
+
+    @staticmethod
+    def copy_canvas(canvas):
+        return canvas.copy()
+
+    @staticmethod
+    def to_array(canvas):
+        return np.array(canvas)
+
+    draw_bbox_with_text = staticmethod(draw_bbox_with_text_on_canvas)
+    draw_circle = staticmethod(draw_circle_on_canvas)
+    draw_filled_rectangle = staticmethod(draw_filled_rectangle_on_canvas)
+
+class OpencvBboxRenderer:
+    '''
+    Отрисовка рамок средствами OpenCV прямо на массиве NumPy, без перевода кадра в PIL.
+    Подписи берутся из кэша заранее отрисованных подписей и накладываются по альфа-каналу
+    '''
+    @staticmethod
+    def new_canvas(image:np.array):
+        # холст базового слоя не изменяется (на его копиях рисуются остальные слои), поэтому кадр не копируется
+        return image
+
+    @staticmethod
+    def copy_canvas(canvas):
+        return canvas.copy()
+
+    @staticmethod
+    def to_array(canvas):
+        # холст интерактивного слоя создается заново при каждой отрисовке, поэтому его можно отдавать без копирования
+        return canvas
+
+    @staticmethod
+    def draw_bbox_with_text(canvas, bbox_coords, bbox_width, class_name, color, font):
+        x0, y0, x1, y1 = (int(value) for value in bbox_coords)
+        bbox_width = int(bbox_width)
+        # PIL рисует контур рамки внутрь прямоугольника, а толстые линии OpenCV симметричны и со скругленными углами,
+        # поэтому контур рисуется четырьмя залитыми полосами - так же, как в PIL
+        for pt0, pt1 in (
+                ((x0, y0), (x1, y0 + bbox_width - 1)),
+                ((x0, y1 - bbox_width + 1), (x1, y1)),
+                ((x0, y0), (x0 + bbox_width - 1, y1)),
+                ((x1 - bbox_width + 1, y0), (x1, y1))):
+            cv2.rectangle(canvas, pt0, pt1, color, -1)
+
+        # вычисляем координаты текста - посередине рамки
+        text_x, text_y = (x1+x0)//2, (y1+y0)//2
+        sprite_rgb, sprite_alpha, (offset_x, offset_y) = render_caption_sprite_array(
+            class_name, tuple(color), font.size, bbox_width, font.path)
+        paste_sprite_on_array(canvas, sprite_rgb, sprite_alpha, text_x + offset_x, text_y + offset_y)
+
+    @staticmethod
+    def draw_circle(canvas, center, radius, color):
+        cv2.circle(canvas, (int(center[0]), int(center[1])), radius, color, -1)
+
+    @staticmethod
+    def draw_filled_rectangle(canvas, pt0, pt1, color):
+        cv2.rectangle(canvas, (int(pt0[0]), int(pt0[1])), (int(pt1[0]), int(pt1[1])), color, -1)
+
+# доступные способы отрисовки рамок (выбираются в settings.json по ключу renderer_backend)
+BBOX_RENDERERS = {
+    'pil': PilBboxRenderer,
+    'opencv': OpencvBboxRenderer,
+}
+
+def intern_string(value):
+    '''
+    Интернирование строк (имен классов и описаний объектов): одинаковые строки у разных рамок
+    ссылаются на один и тот же объект
+    '''
+    if type(value) is str:
+        return sys.intern(value)
+    return value
+
+class BboxDragState:
+    '''
+    Состояние создания/перетаскивания рамки мышью. Хранится отдельно от рамки и создается
+    только на время взаимодействия с ней, поэтому у остальных рамок этих атрибутов нет
+    '''
+    __slots__ = ('ix', 'iy', 'dx0', 'dy0', 'dx1', 'dy1', 'is_bbox_creation', 'is_corner_dragging', 'is_bbox_dragging')
+
+    def __init__(self):
+        # координаты начального угла рамки
+        self.ix = None
+        self.iy = None
+
+        # координаты смещений углов рамки при создании и изменении
+        self.dx0 = None
+        self.dy0 = None
+        self.dx1 = None
+        self.dy1 = None
+
+        # флаг, сигнализирующий, что данная рамка создается
+        self.is_bbox_creation = False
+        # флаг, сигнализирующий, что координаты какого-либо угла рамки изменяются
+        self.is_corner_dragging = False
+        # Флаг, сигнализирующий, что рамка перемещается по кадру0
+        self.is_bbox_dragging = False
+
+    def is_idle(self):
+        return not (self.is_bbox_creation or self.is_corner_dragging or self.is_bbox_dragging) and \
+            self.ix is None and self.iy is None and self.dx0 is None and self.dy0 is None and self.dx1 is None and self.dy1 is None
+
+def _drag_state_property(name):
+    '''
+    Атрибут рамки, который хранится в ее состоянии перетаскивания (BboxDragState)
+    '''
+    default = getattr(BboxDragState(), name)
+
+    def getter(self):
+        if self._drag_state is None:
+            return default
+        return getattr(self._drag_state, name)
+
+    def setter(self, value):
+        if self._drag_state is None:
+            if value == default:
+                return
+            self._drag_state = BboxDragState()
+        setattr(self._drag_state, name, value)
+        # освобождаем состояние, когда взаимодействие с рамкой закончено
+        if self._drag_state.is_idle():
+            self._drag_state = None
+
+    return property(getter, setter)
 
 class Bbox:
+    # рамки создаются на каждую детекцию каждого кадра, поэтому храним атрибуты в слотах, а не в __dict__
+    __slots__ = (
+        'coords', 'class_name', 'auto_idx', 'registered_idx', 'color', 'object_description',
+        'img_rows', 'img_cols', 'displaying_type', 'tracker_type', '_drag_state', 'id')
+
     def __init__(
             self,
             x0,
@@ -185,11 +493,10 @@ class Bbox:
             'alternative' - альтернативный трекер из набора OpenCV
             'no' - запрет изменения координат
         '''
-
         # координаты левого верхнего и правого нижнего углов рамки
         self.coords = (x0, y0, x1, y1)
-        # имя класса
-        self.class_name = class_name
+        # имя класса (имена классов и описания объектов интернируются: одинаковые строки у разных рамок - один объект)
+        self.class_name = intern_string(class_name)
         # индекс объекта какого-то определенного класса, полученный из автоматического трекера
         self.auto_idx = auto_idx
         # индекс отслеживаемого объекта
@@ -197,24 +504,11 @@ class Bbox:
         # цвет рамки
         self.color = color
         # описание объекта
-        self.object_description = object_description
-
-        # координаты начального угла рамки
-        self.ix = None
-        self.iy = None
+        self.object_description = intern_string(object_description)
 
-        # координаты смещений углов рамки при создании и изменении
-        self.dx0 = None
-        self.dy0 = None
-        self.dx1 = None
-        self.dy1 = None
-
-        # флаг, сигнализирующий, что данная рамка создается
-        self.is_bbox_creation = False
-        # флаг, сигнализирующий, что координаты какого-либо угла рамки изменяются
-        self.is_corner_dragging = False
-        # Флаг, сигнализирующий, что рамка перемещается по кадру0
-        self.is_bbox_dragging = False
+        # состояние создания/перетаскивания рамки (координаты начального угла, смещения углов и флаги).
+        # Создается только на время взаимодействия с рамкой
+        self._drag_state = None
 
         # размер карда
         self.img_rows = img_rows
@@ -225,7 +519,34 @@ class Bbox:
 
         # тип трекинга. неодходимо для записи в лог
         self.tracker_type = tracker_type
+
+    ix = _drag_state_property('ix')
+    iy = _drag_state_property('iy')
+    dx0 = _drag_state_property('dx0')
+    dy0 = _drag_state_property('dy0')
+    dx1 = _drag_state_property('dx1')
+    dy1 = _drag_state_property('dy1')
+    is_bbox_creation = _drag_state_property('is_bbox_creation')
+    is_corner_dragging = _drag_state_property('is_corner_dragging')
+    is_bbox_dragging = _drag_state_property('is_bbox_dragging')
     
+    def __copy__(self):
+        bbox_copy = Bbox.__new__(Bbox)
+        for name in Bbox.__slots__:
+            if hasattr(self, name):
+                setattr(bbox_copy, name, getattr(self, name))
+        # состояние перетаскивания изменяемое, поэтому у копии оно свое
+        if self._drag_state is not None:
+            bbox_copy._drag_state = copy(self._drag_state)
+        return bbox_copy
+
+    def __deepcopy__(self, memo):
+        bbox_copy = self.__copy__()
+        memo[id(self)] = bbox_copy
+        for name in ('coords', 'color', 'auto_idx', 'registered_idx', 'img_rows', 'img_cols'):
+            setattr(bbox_copy, name, deepcopy(getattr(self, name), memo))
+        return bbox_copy
+
     def update_tracker_type(self, new_tracker_type):
         self.tracker_type = new_tracker_type
     
@@ -344,7 +665,10 @@ class Bbox:
         self.coords = (x0, y0, x1, y1)
         
     def update_class_name(self, class_name):
-        self.class_name = class_name
+        self.class_name = intern_string(class_name)
+
+    def update_object_description(self, object_description):
+        self.object_description = intern_string(object_description)
         
     def make_x0y0_lesser_x1y1(self):
         # превращаем строки в числа и фиксируем координаты рамки, чтобы они не выходили за пределы кадра
@@ -378,15 +702,51 @@ class Bbox:
         return repr_str
 
 class BboxFrameTracker:
-    def __init__(self, img, registered_objects_db):
+    # атрибуты, изменение которых меняет отрисованный кадр
+    _RENDER_ATTRIBUTES = frozenset([
+        'img', 'bboxes_container', 'displayed_corner', 'displayed_box', 'delete_box_flag', 'display_scale', 'renderer_backend'])
+    # радиус захвата угла рамки и маркера угла в пикселях экрана
+    CORNER_RADIUS = 6
+
+    def __init__(self, img, registered_objects_db, renderer_backend='pil'):
         '''
         Класс служит для создания, изменения и рендеринга множества рамок, локализующих различные объекты в кадре
         Используется в программе Video-Label-Tracker
         Input:
-            img: numpy.ndarray, shape=(rows, cols, channels) - кадр видео
+            img: numpy.ndarray, shape=(rows, cols, channels) или FrameBuffer - кадр видео (не копируется)
+            renderer_backend: str - способ отрисовки рамок из BBOX_RENDERERS ('pil' или 'opencv')
         '''
-        # на всякий случай копируем кадр
-        self.img = img.copy()
+        # счетчик изменений кадра, контейнера и подсветки под курсором (см. render_version)
+        self._render_version = 0
+        # счетчик смен кадра
+        self._img_version = 0
+
+        # масштаб отображения: кадр отрисовывается в разрешении экрана (масштаб <= 1), а координаты мыши
+        # переводятся обратно в пиксели исходного кадра. Координаты рамок всегда хранятся в пикселях исходного кадра
+        self.display_scale = 1.0
+        # максимальный размер отображаемого кадра (None - без ограничений)
+        self.max_display_size = None
+
+        # способ отрисовки рамок
+        if renderer_backend not in BBOX_RENDERERS:
+            raise ValueError(f'renderer_backend should be one of {list(BBOX_RENDERERS.keys())}')
+        self.renderer_backend = renderer_backend
+
+        # кэшированные слои отрисовки (см. render_boxes)
+        self._base_layer = None
+        self._base_layer_buffer = None
+        self._base_layer_img_version = -1
+        self._static_layer = None
+        self._static_layer_key = None
+
+        # кадр хранится без копирования как буфер со счетчиком ссылок, доступный только для чтения.
+        # Блокировка защищает смену кадра от потока отображения, который в это время может строить базовый слой
+        self._img_lock = threading.Lock()
+        self._img_buffer = self._as_frame_buffer(img)
+        # размер исходного кадра видео (строки, столбцы). Координаты рамок всегда задаются в пикселях исходного кадра,
+        # даже если отображается уменьшенный кадр прокси-видео
+        self.source_shape = self._img_buffer.array.shape[:2]
+        self.img = self._img_buffer.array
 
         # словарь, где мы храним все рамки
         #self.bboxes_container = {}
@@ -427,7 +787,7 @@ class BboxFrameTracker:
         '''
         Создание новой рамки вручную
         '''
-        rows, cols, channels = self.img.shape
+        rows, cols = self.source_shape
         
         if event == cv2.EVENT_LBUTTONDOWN and not flags & cv2.EVENT_FLAG_CTRLKEY:
             if self.processing_box is None:
@@ -476,13 +836,15 @@ class BboxFrameTracker:
             self.is_bbox_created = False
 
     def correct_rectangle(self, event, flags, bbox, x, y):
-        rows, cols, channels = self.img.shape
+        rows, cols = self.source_shape
         if flags & cv2.EVENT_FLAG_CTRLKEY:
             if event == cv2.EVENT_LBUTTONDOWN:
             
                 if self.processing_box is None:
                     # здесь self.processing_box должен быть проинициализирован, иначе возвращаемся из функции
                     # извлечение из словаря по заданному имени
+                    # прежнее состояние рамки сохраняется в снимки контейнера (нужно для логгирования)
+                    self.bboxes_container.preserve_bbox(bbox)
                     self.processing_box = bbox
                     self.processing_box.corner_drag(x, y)
                     # изменение по корректируемой рамке
@@ -528,6 +890,8 @@ class BboxFrameTracker:
             if flags & cv2.EVENT_FLAG_CTRLKEY:
                 if self.processing_box is None:
                     # извлекаем корректируемую рамку из списка по заданному имени
+                    # прежнее состояние рамки сохраняется в снимки контейнера (нужно для логгирования)
+                    self.bboxes_container.preserve_bbox(bbox)
                     self.processing_box = bbox
                     self.processing_box.box_drag(x, y)
                     # изменение по корректируемой рамке
@@ -578,10 +942,11 @@ class BboxFrameTracker:
                 if self.processing_box is None:
                     if self.current_class_name is not None:
                         # извлечение из словаря по заданному имени!
+                        self.bboxes_container.preserve_bbox(bbox)
                         self.processing_box = bbox
                         current_color = (0,255,0)
                         class_name, id = self.current_class_name.split(',')
-                        self.processing_box.class_name = class_name
+                        self.processing_box.update_class_name(class_name)
                         self.processing_box.id = int(id)
                         self.processing_box.color = current_color
                         # изменение по информации извне - по заданному имени класса
@@ -603,11 +968,92 @@ class BboxFrameTracker:
         else:
             self.is_bboxes_changed = False
 
-    def update_img(self, img):
-        self.img = img.copy()
+    def __setattr__(self, name, value):
+        # при изменении отображаемых атрибутов увеличиваем счетчик, чтобы кадр был отрисован заново
+        if name in BboxFrameTracker._RENDER_ATTRIBUTES:
+            previous_value = self.__dict__.get(name)
+            if name == 'img' or not (previous_value is value or (previous_value is not None and value is not None and previous_value == value)):
+                object.__setattr__(self, '_render_version', self._render_version + 1)
+            if name == 'img':
+                object.__setattr__(self, '_img_version', self._img_version + 1)
+        object.__setattr__(self, name, value)
+
+    @property
+    def render_version(self):
+        '''
+        Версия отображаемого состояния: меняется при обновлении кадра, изменении контейнера рамок
+        (методы контейнера, меняющие рамки, увеличивают его версию), изменении рамки мышью
+        и при изменении подсветки под курсором. Если версия не изменилась, то заново отрисовывать кадр не нужно
+        '''
+        return (self._render_version, self.bboxes_container._version)
+
+    def set_max_display_size(self, max_display_width, max_display_height):
+        '''
+        Включение режима отображения в разрешении экрана: кадры, которые больше заданного размера,
+        уменьшаются так, чтобы поместиться в него. None - отображение в исходном разрешении
+        '''
+        if max_display_width is None or max_display_height is None:
+            self.max_display_size = None
+        else:
+            self.max_display_size = (int(max_display_width), int(max_display_height))
+        self.update_display_scale()
+
+    def update_display_scale(self):
+        if self.max_display_size is None or self.img is None:
+            self.display_scale = 1.0
+            return
+        rows, cols = self.source_shape
+        max_display_width, max_display_height = self.max_display_size
+        self.display_scale = min(1.0, max_display_width/cols, max_display_height/rows)
+
+    def source_to_display(self, value):
+        '''
+        Перевод координаты из пикселей исходного кадра в пиксели отображаемого кадра
+        '''
+        if self.display_scale == 1.0:
+            return value
+        return int(round(value*self.display_scale))
+
+    def display_to_source(self, value):
+        '''
+        Перевод координаты из пикселей отображаемого кадра (например, от мыши) в пиксели исходного кадра
+        '''
+        if self.display_scale == 1.0:
+            return value
+        return int(round(value/self.display_scale))
+
+    @staticmethod
+    def _as_frame_buffer(img):
+        '''
+        Кадр принимается без копирования: FrameBuffer - вместе с его ссылкой, массив - как представление только для чтения
+        '''
+        if isinstance(img, FrameBuffer):
+            return img
+        return FrameBuffer.wrap(img)
+
+    def _replace_img_buffer(self, img_buffer, source_shape=None):
+        with self._img_lock:
+            previous_img_buffer = self._img_buffer
+            self._img_buffer = img_buffer
+            if img_buffer is None:
+                self.img = None
+            else:
+                self.source_shape = img_buffer.array.shape[:2] if source_shape is None else tuple(source_shape)
+                self.img = img_buffer.array
+        if previous_img_buffer is not None:
+            previous_img_buffer.release()
+
+    def update_img(self, img, source_shape=None):
+        '''
+        Обновление кадра. img - массив или FrameBuffer, ссылку на который BboxFrameTracker забирает себе.
+        source_shape - размер исходного кадра видео (строки, столбцы), если img - уменьшенный
+        кадр прокси-видео; None - img и есть исходный кадр
+        '''
+        self._replace_img_buffer(self._as_frame_buffer(img), source_shape)
+        self.update_display_scale()
 
     def delete_img(self):
-        self.img = None
+        self._replace_img_buffer(None)
 
     def update_current_class_name(self, current_class_name):
         self.current_class_name = current_class_name
@@ -616,6 +1062,10 @@ class BboxFrameTracker:
         '''
         Обработка коллбэков opencv. Сигнатура метода совпадает с сигнатурой обработчика коллбэков opencv.
         '''
+        # координаты мыши приходят в пикселях отображаемого кадра
+        x = self.display_to_source(x)
+        y = self.display_to_source(y)
+        previous_processing_box = self.processing_box
         
         # при зажатом Ctl мы изменяем (перетаскиваем или меняем размер) рамку
         if (flags & cv2.EVENT_FLAG_CTRLKEY)==cv2.EVENT_FLAG_CTRLKEY and not (flags & cv2.EVENT_FLAG_ALTKEY)==cv2.EVENT_FLAG_ALTKEY:
@@ -627,145 +1077,793 @@ class BboxFrameTracker:
                 elif self.processing_box.is_bbox_dragging:
                     self.drag_box(event, flags, self.displayed_box, x, y)  
             else:
-                # итерирование с извлечением имени и рамки
-                for bbox in self.bboxes_container.iter_bboxes():
-                    x0, y0, x1, y1 = bbox.coords
-                    if check_cursor_in_corner(x0,y0,x,y,6):
-                        self.displayed_corner = (x0, y0)
-                        self.displayed_box = None
-                        self.correct_rectangle(event, flags, bbox, x, y)
-                        break
-                    elif check_cursor_in_corner(x1,y1,x,y,6):
-                        self.displayed_corner = (x1, y1)
-                        self.displayed_box = None
-                        self.correct_rectangle(event, flags, bbox, x, y)
-                        break
-                    elif check_cursor_in_corner(x0,y1,x,y,6):
-                        self.displayed_corner = (x0, y1)
-                        self.displayed_box = None    
-                        self.correct_rectangle(event, flags, bbox, x, y)
-                        break
-                    elif check_cursor_in_corner(x1,y0,x,y,6):
-                        self.displayed_corner = (x1, y0)
-                        self.displayed_box = None
-                        self.correct_rectangle(event, flags, bbox, x, y)
-                        break
-                    elif check_cursor_in_bbox(x0, y0, x1, y1, x, y):
-                        self.displayed_box = (x0, y0, x1, y1)
-                        self.displayed_corner = None
-                        self.drag_box(event, flags, bbox, x, y)
-                        self.change_class_name(event, flags, bbox)
-                        break
-                    else:
-                        self.displayed_corner = None
-                        self.displayed_box = None
-                        #self.is_bboxes_changed = False
-        # При зажатом Alt мы удаляем рамку
-        elif (flags & cv2.EVENT_FLAG_ALTKEY)==cv2.EVENT_FLAG_ALTKEY and not (flags & cv2.EVENT_FLAG_CTRLKEY)==cv2.EVENT_FLAG_CTRLKEY:
-            # итерирование с извлечением имени и рамки
-            for bbox in list(self.bboxes_container.iter_bboxes()):
-                x0, y0, x1, y1 = bbox.coords
-                if check_cursor_in_bbox(x0, y0, x1, y1, x, y):
-                    self.displayed_box = (x0, y0, x1, y1)
+                # поиск самой верхней рамки, рядом с углом которой или внутри которой находится курсор
+                bbox, corner = self.bboxes_container.find_bbox_under_cursor(
+                    x, y, corner_radius=self.CORNER_RADIUS/self.display_scale)
+                if bbox is None:
                     self.displayed_corner = None
-                    self.delete_box_flag = True
-                    self.delete_box(event, flags, bbox)
-                else:
                     self.displayed_box = None
-                    self.delete_box_flag = False
-                    #self.is_bboxes_changed = False
+                elif corner is not None:
+                    self.displayed_corner = corner
+                    self.displayed_box = None
+                    self.correct_rectangle(event, flags, bbox, x, y)
+                else:
+                    self.displayed_box = tuple(bbox.coords)
+                    self.displayed_corner = None
+                    self.drag_box(event, flags, bbox, x, y)
+                    self.change_class_name(event, flags, bbox)
+        # При зажатом Alt мы удаляем рамку
+        elif (flags & cv2.EVENT_FLAG_ALTKEY)==cv2.EVENT_FLAG_ALTKEY and not (flags & cv2.EVENT_FLAG_CTRLKEY)==cv2.EVENT_FLAG_CTRLKEY:
+            # поиск самой верхней рамки под курсором
+            bbox, _ = self.bboxes_container.find_bbox_under_cursor(x, y)
+            if bbox is not None:
+                self.displayed_box = tuple(bbox.coords)
+                self.displayed_corner = None
+                self.delete_box_flag = True
+                self.delete_box(event, flags, bbox)
+            else:
+                self.displayed_box = None
+                self.delete_box_flag = False
         else:
             self.delete_box_flag = False
             # фактически, мы вызываем всегда функцию draw_one_box, а уже внутри нее обрабатываем нажатия кнопок
             self.draw_one_box(event, flags, x, y)
 
+        if previous_processing_box is not None or self.processing_box is not None:
+            # рамка создается или изменяется мышью (в т.ч. в обход контейнера), поэтому кадр надо отрисовать заново
+            self._render_version += 1
+
     def update_bboxes_container(self, new_bboxes_container):
         # обновление контейнера
         self.bboxes_container = new_bboxes_container
 
-    def render_boxes(self):
+    @staticmethod
+    def _bbox_render_key(bbox):
         '''
-        Метод для отображения рамок на экране
+        Все, от чего зависит изображение рамки на кадре
         '''
+        return (
+            id(bbox), bbox.coords, bbox.displaying_type, bbox.class_name, bbox.auto_idx, bbox.registered_idx,
+            bbox.is_bbox_creation, bbox.is_corner_dragging, bbox.ix, bbox.iy)
 
-        #drawing_img = self.img.copy()
-        drawing_img = deepcopy(self.img)
-        rows, cols, channels = drawing_img.shape
+    def _is_interactive_bbox(self, bbox):
+        '''
+        Рамка, которая в данный момент создается или изменяется мышью
+        '''
+        return bbox is self.processing_box or bbox.is_bbox_creation or bbox.is_corner_dragging or bbox.is_bbox_dragging
+
+    def _draw_bbox(self, canvas, bbox, line_width, font):
+        '''
+        Отрисовка одной рамки с подписью и маркерами перетаскиваемого угла
+        '''
+        x0, y0, x1, y1 = bbox.coords
+        class_name = bbox.class_name
+        # точки отрисовки в пикселях отображаемого кадра
+        dx0, dy0, dx1, dy1 = (self.source_to_display(value) for value in (x0, y0, x1, y1))
+
+        if bbox.displaying_type == 'auto':
+            color = (0, 0, 0)
+            displaying_name = f'{class_name}(AG),{bbox.auto_idx}'
+        elif bbox.displaying_type == 'registered':
+            color = (0, 255, 0)
+            displaying_name = f'{class_name}(T),{bbox.registered_idx}'
+        else:
+            raise ValueError('Bbox.displaying_type shold be either "registered" or "auto" or "no"')
+        
+        renderer = BBOX_RENDERERS[self.renderer_backend]
+        renderer.draw_bbox_with_text(canvas, (dx0,dy0,dx1,dy1), line_width, displaying_name, color, font)
+        
+        if bbox.is_bbox_creation:
+            renderer.draw_circle(canvas, (dx1, dy1), self.CORNER_RADIUS, (0, 0, 255))
+        elif bbox.is_corner_dragging:
+            if (bbox.ix, bbox.iy) == (x0, y0):
+                # кружок, обозначающий угол рамки
+                renderer.draw_circle(canvas, (dx1, dy1), self.CORNER_RADIUS, (0, 0, 255))
+            elif (bbox.ix, bbox.iy) == (x1, y1):
+                # кружок, обозначающий угол рамки
+                renderer.draw_circle(canvas, (dx0, dy0), self.CORNER_RADIUS, (0, 0, 255))
+
+    def render_boxes(self):
+        '''
+        Метод для отображения рамок на экране.
+        Кадр собирается из трех слоев:
+            базовый - кадр видео, переведенный в изображение PIL (кэшируется до смены кадра);
+            статический - базовый слой со всеми рамками, кроме изменяемой (кэшируется, пока эти рамки не изменились);
+            интерактивный - изменяемая рамка и подсветка под курсором, рисуется на копии статического слоя
+        Поэтому при перетаскивании рамки заново рисуется только она сама, а не все рамки кадра.
+        Отрисовка выполняется в масштабе отображения display_scale способом renderer_backend
+        '''
+        renderer = BBOX_RENDERERS[self.renderer_backend]
+        rows, cols = self.source_to_display(self.source_shape[0]), self.source_to_display(self.source_shape[1])
         # определяем размер шрифта исходя из размера изображения
         font_size = min(rows,cols)//30
-        # устанавливаем шрифт для указания размечаемых людей
-        font = ImageFont.truetype("FiraCode-SemiBold.ttf", font_size)
+        # устанавливаем шрифт для указания размечаемых людей (шрифты кэшируются по размеру)
+        font = get_font(font_size)
         # вычисляем ширину рамки. Квадратный корень почему-то работает хорошо...
         line_width = np.round(np.sqrt(font_size).astype(int))
+
         # итерирование по рамкам в обратном порядке (чтобы те рамки, которые были добавлены последними, рендерились поверх остальных)
+        static_bboxes = []
+        interactive_bboxes = []
         for bbox in list(self.bboxes_container.iter_bboxes())[::-1]:
             if bbox.displaying_type != 'no':
-                x0, y0, x1, y1 = bbox.coords
-                class_name = bbox.class_name
-
-                if bbox.displaying_type == 'auto':
-                    color = (0, 0, 0)
-                    displaying_name = f'{class_name}(AG),{bbox.auto_idx}'
-                elif bbox.displaying_type == 'registered':
-                    color = (0, 255, 0)
-                    displaying_name = f'{class_name}(T),{bbox.registered_idx}'
+                if self._is_interactive_bbox(bbox):
+                    interactive_bboxes.append(bbox)
                 else:
-                    raise ValueError('Bbox.displaying_type shold be either "registered" or "auto" or "no"')
-                
-                drawing_img = draw_bbox_with_text(drawing_img, (x0,y0,x1,y1), line_width, displaying_name, color, font)
-                
-                if bbox.is_bbox_creation:
-                    drawing_img = cv2.circle(drawing_img, (x1, y1), 6, (0, 0, 255), -1)
-                elif bbox.is_corner_dragging:
-                    if (bbox.ix, bbox.iy) == (x0, y0):
-                        # кружок, обозначающий угол рамки
-                        drawing_img = cv2.circle(drawing_img, (x1, y1), 6, (0, 0, 255), -1)
-                    elif (bbox.ix, bbox.iy) == (x1, y1):
-                        # кружок, обозначающий угол рамки
-                        drawing_img = cv2.circle(drawing_img, (x0, y0), 6, (0, 0, 255), -1)
-                else:
-                    pass
+                    static_bboxes.append(bbox)
+
+        # базовый слой. Кадр не копируется: поток отображения берет ссылку на буфер кадра,
+        # а единственные доступные для записи копии - холсты статического и интерактивного слоев
+        with self._img_lock:
+            base_layer_version = (self._img_version, self.display_scale, self.renderer_backend)
+            img_buffer = None
+            if self._base_layer_img_version != base_layer_version and self._img_buffer is not None:
+                img_buffer = self._img_buffer.acquire()
+        if img_buffer is not None:
+            img = img_buffer.array
+            if img.shape[:2] == (rows, cols):
+                # кадр уже в разрешении отображения (исходный кадр меньше экрана или кадр прокси-видео)
+                base_layer = renderer.new_canvas(img)
+            else:
+                # кадр масштабируется один раз при смене кадра
+                interpolation = cv2.INTER_AREA if img.shape[0] > rows else cv2.INTER_LINEAR
+                base_layer = renderer.new_canvas(cv2.resize(img, (cols, rows), interpolation=interpolation))
+            # базовый слой может ссылаться на массив кадра, поэтому ссылка на буфер кадра хранится вместе со слоем
+            previous_base_layer_buffer = self._base_layer_buffer
+            self._base_layer = base_layer
+            self._base_layer_buffer = img_buffer
+            self._base_layer_img_version = base_layer_version
+            if previous_base_layer_buffer is not None:
+                previous_base_layer_buffer.release()
+
+        # статический слой
+        static_layer_key = (base_layer_version, tuple(self._bbox_render_key(bbox) for bbox in static_bboxes))
+        if self._static_layer_key != static_layer_key:
+            static_layer = renderer.copy_canvas(self._base_layer)
+            for bbox in static_bboxes:
+                self._draw_bbox(static_layer, bbox, line_width, font)
+            self._static_layer = static_layer
+            self._static_layer_key = static_layer_key
+
+        # интерактивный слой
+        canvas = renderer.copy_canvas(self._static_layer)
+        for bbox in interactive_bboxes:
+            self._draw_bbox(canvas, bbox, line_width, font)
+
+        visible_bboxes = static_bboxes + interactive_bboxes
+        if self.displayed_corner is not None and any(not bbox.is_corner_dragging for bbox in visible_bboxes):
+            corner_x, corner_y = (self.source_to_display(value) for value in self.displayed_corner)
+            renderer.draw_circle(canvas, (corner_x, corner_y), self.CORNER_RADIUS, (0, 0, 255))
+
+        if self.displayed_box is not None and self.delete_box_flag and len(visible_bboxes) > 0:
+            x0,y0,x1,y1 = (self.source_to_display(value) for value in self.displayed_box)
+            renderer.draw_filled_rectangle(canvas, (x0, y0), (x1, y1), (0, 0, 255))
+        return renderer.to_array(canvas)
+
+class RegisteredObjectsDB:
+    '''
+    База данных отслеживаемых (зарегистрированных) объектов с колонками object_idx, class_name, object_description.
+    Поиск выполняется через хэш-индексы по (class_name, object_description) и (class_name, object_idx).
+    Изменения дописываются в журнал <путь до БД>.journal, а сам csv файл перезаписывается только
+    при закрытии (compact). Если программа завершилась без закрытия БД, журнал применяется при следующем чтении
+    '''
+    COLUMNS = ['object_idx', 'class_name', 'object_description']
+    JOURNAL_SUFFIX = '.journal'
+
+    def __init__(self, database=None, path_to_db=None) -> None:
+        '''
+        database - таблица pandas с колонками COLUMNS
+        path_to_db - путь до csv файла БД
+        '''
+        self.path_to_db = path_to_db
+        # строки БД: номер строки -> (object_idx, class_name, object_description)
+        self._rows = {}
+        self._next_row_id = 0
+        # хэш-индексы: ключ -> упорядоченное множество номеров строк (dict без значений)
+        self._description_index = {}
+        self._idx_index = {}
+        # количество объектов с данным описанием (любого класса) и количество объектов данного класса
+        self._description_counts = {}
+        self._class_counts = {}
+
+        # счетчик изменений и закэшированная таблица pandas
+        self._version = 0
+        self._df_cache = None
+        self._df_cache_version = -1
+
+        if database is not None:
+            for object_idx, class_name, object_description in database[self.COLUMNS].itertuples(index=False):
+                self._add_row(object_idx, class_name, object_description)
+
+    @classmethod
+    def read_csv(cls, path_to_db):
+        '''
+        Чтение БД из csv файла. Если файла нет, то создается пустая БД.
+        Если остался журнал незакрытой БД, то он применяется и БД сразу уплотняется
+        '''
+        if os.path.isfile(path_to_db):
+            database = pd.read_csv(path_to_db)
+            database = database.fillna(value='')
+            registered_objects_db = cls(database, path_to_db)
+        else:
+            registered_objects_db = cls(None, path_to_db)
+            registered_objects_db.to_dataframe().to_csv(path_to_db, index=False)
+
+        if os.path.isfile(registered_objects_db.journal_path):
+            registered_objects_db._replay_journal()
+            registered_objects_db.compact()
+        return registered_objects_db
+
+    @property
+    def journal_path(self):
+        return self.path_to_db + self.JOURNAL_SUFFIX
+
+    @staticmethod
+    def _counter_add(counter, key, value):
+        counter[key] = counter.get(key, 0) + value
+        if counter[key] == 0:
+            del counter[key]
+
+    def _add_row(self, object_idx, class_name, object_description):
+        object_idx = int(object_idx)
+        class_name = intern_string(class_name)
+        object_description = intern_string(object_description)
+        row_id = self._next_row_id
+        self._next_row_id += 1
+        self._rows[row_id] = (object_idx, class_name, object_description)
+        self._description_index.setdefault((class_name, object_description), {})[row_id] = None
+        self._idx_index.setdefault((class_name, object_idx), {})[row_id] = None
+        self._counter_add(self._description_counts, object_description, 1)
+        self._counter_add(self._class_counts, class_name, 1)
+        self._version += 1
+
+    def _remove_row(self, row_id):
+        object_idx, class_name, object_description = self._rows.pop(row_id)
+        for index, key in ((self._description_index, (class_name, object_description)), (self._idx_index, (class_name, object_idx))):
+            index[key].pop(row_id)
+            if len(index[key]) == 0:
+                del index[key]
+        self._counter_add(self._description_counts, object_description, -1)
+        self._counter_add(self._class_counts, class_name, -1)
+        self._version += 1
+
+    def _write_journal(self, operation, object_idx, class_name, object_description):
+        if self.path_to_db is None:
+            return
+        with open(self.journal_path, 'a', encoding='utf-8', newline='') as fd:
+            csv.writer(fd).writerow([operation, object_idx, class_name, object_description])
+
+    def _replay_journal(self):
+        with open(self.journal_path, 'r', encoding='utf-8', newline='') as fd:
+            for record in csv.reader(fd):
+                # неполная последняя строка (например, при аварийном завершении программы) пропускается
+                if len(record) != 4:
+                    continue
+                operation, object_idx, class_name, object_description = record
+                if operation == 'append':
+                    self._add_row(object_idx, class_name, object_description)
+                elif operation == 'delete':
+                    self._delete(class_name, int(object_idx), object_description)
+
+    def _delete(self, class_name, object_idx, object_description):
+        row_ids = [
+            row_id for row_id in self._idx_index.get((class_name, int(object_idx)), {})
+            if self._rows[row_id][2] == object_description]
+        for row_id in row_ids:
+            self._remove_row(row_id)
+        return len(row_ids)
+
+    def append(self, class_name, object_description):
+        '''
+        Добавление нового объекта. Индекс объекта равен количеству уже зарегистрированных объектов этого класса.
+        Возвращает -1, если объект с таким непустым описанием уже есть в БД, иначе 0
+        '''
+        if object_description != '' and object_description in self._description_counts:
+            return -1
+        object_idx = self._class_counts.get(class_name, 0)
+        self._add_row(object_idx, class_name, object_description)
+        self._write_journal('append', object_idx, class_name, object_description)
+        return 0
+
+    def delete(self, class_name, object_idx, object_description):
+        if self._delete(class_name, object_idx, object_description) > 0:
+            self._write_journal('delete', int(object_idx), class_name, object_description)
+
+    def find(self, class_name, object_description):
+        '''
+        Поиск объектов по имени класса и описанию объекта
+        '''
+        row_ids = self._description_index.get((class_name, object_description), {})
+        return self._rows_to_df(list(row_ids))
+
+    def find_by_idx(self, class_name, object_idx):
+        row_ids = self._idx_index.get((class_name, int(object_idx)), {})
+        return self._rows_to_df(list(row_ids))
+
+    def _rows_to_df(self, row_ids):
+        rows = [self._rows[row_id] for row_id in row_ids]
+        database = pd.DataFrame(rows, columns=self.COLUMNS, index=row_ids)
+        database['object_idx'] = database['object_idx'].astype(np.int64)
+        return database
+
+    def to_dataframe(self):
+        '''
+        Представление БД в виде таблицы pandas (кэшируется до следующего изменения, изменять ее нельзя)
+        '''
+        if self._df_cache_version != self._version:
+            self._df_cache = self._rows_to_df(list(self._rows)).reset_index(drop=True)
+            self._df_cache_version = self._version
+        return self._df_cache
+
+    def compact(self):
+        '''
+        Перезапись csv файла текущим состоянием БД и удаление журнала
+        '''
+        if self.path_to_db is None:
+            return
+        self.to_dataframe().to_csv(self.path_to_db, index=False)
+        if os.path.isfile(self.journal_path):
+            os.remove(self.journal_path)
 
-                if self.displayed_corner is not None and not bbox.is_corner_dragging:
-                    drawing_img = cv2.circle(drawing_img, self.displayed_corner, 6, (0, 0, 255), -1)
+    def close(self):
+        self.compact()
 
-                if self.displayed_box is not None:
-                    x0,y0,x1,y1 = self.displayed_box
-                    if self.delete_box_flag:
-                        thickness = -1
-                        drawing_img = cv2.rectangle(drawing_img, (x0, y0), (x1, y1), (0, 0, 255), thickness)
-                    else:
-                        thickness = 4
-        return drawing_img
+    def __len__(self):
+        return len(self._rows)
+
+    def __repr__(self):
+        return f'{self.to_dataframe()}'
 
 class BboxesContainer:
     '''
-    ВСКРЫЛАСЬ НЕОБХОДИМОСТЬ КАК-ТО ХРАНИТЬ БД СО ВСЕМИ ЗАРЕГИСТРИРОВАННЫМИ ОБЪЕКТАМИ!!!!
+    Контейнер рамок текущего кадра.
+    Рамки хранятся по слотам в колоночном виде: координаты - в массиве NumPy, атрибуты - в отдельных
+    массивах, а поиск выполняется через хэш-индексы по (class_name, auto_idx, registered_idx),
+    (class_name, auto_idx) и (class_name, registered_idx), поэтому поиск и обновление одной рамки стоят O(1)
+    и не требуют копирования таблиц.
     '''
+    # колонки таблицы, которую возвращают методы поиска (сохранены для совместимости с остальным кодом)
+    TABLE_COLUMNS = ['class_name', 'object_description', 'auto_idx', 'registered_idx', 'bbox', 'is_updated']
+    # начальная емкость массивов
+    INITIAL_CAPACITY = 64
+    # минимальный размер ячейки сетки для поиска рамок под курсором
+    HIT_GRID_MIN_CELL_SIZE = 32
+
     def __init__(self, registered_objects_db) -> None:
         '''
         registered_objects_db - база данных, где хранится информация об отслеживаемых объектах:
-        '''      
-        # основная таблица с рамками
-        # !!!!! не вполне понятно,зачем теперь нужно поле id, раз я решил осуществлять поиск посредством фильтрации значений полей
-        # Колонки у таблицы:
+        '''
+        # снимки контейнера (BboxesSnapshot), в которые перед изменением рамок сохраняется их прежнее состояние
+        self._snapshots = weakref.WeakSet()
+        # счетчик изменений контейнера. Не обнуляется при очистке контейнера, иначе версия отображаемого
+        # состояния (BboxFrameTracker.render_version) могла бы повториться и кадр не был бы отрисован заново
+        self._version = 0
+        # Колонки хранилища (индекс в массивах - номер слота):
         #   class_name - имя класса
         #   object_description - описание объекта
         #   auto_idx - индекс, присвоенный автоматическим трекером
         #   registered_idx - индекс отслеживаемого объекта
         #   bbox - сам объект рамки
-        #   is_updated - флаг, сигнализирующий о том, что рамка обновилась на очередном кадре
-        self.bboxes_df = pd.DataFrame(columns=['class_name', 'object_description', 'auto_idx', 'registered_idx', 'bbox', 'is_updated'])
+        #   updated_generation - номер поколения (кадра), на котором рамка последний раз обновлялась.
+        #       Рамка считается обновленной (is_updated), если он совпадает с текущим поколением
+        #   coords - координаты рамки x0, y0, x1, y1
+        self.reset_tracking_objects_table()
         self.registered_objects_db = registered_objects_db
 
+    @property
+    def registered_objects_db(self):
+        '''
+        Таблица pandas отслеживаемых объектов (только для чтения)
+        '''
+        return self.registered_objects_store.to_dataframe()
+
+    @registered_objects_db.setter
+    def registered_objects_db(self, registered_objects_db):
+        '''
+        БД отслеживаемых объектов можно задать как объектом RegisteredObjectsDB (тогда он разделяется
+        с другими контейнерами), так и таблицей pandas
+        '''
+        if not isinstance(registered_objects_db, RegisteredObjectsDB):
+            registered_objects_db = RegisteredObjectsDB(registered_objects_db)
+        self.registered_objects_store = registered_objects_db
+
+    def reset_tracking_objects_table(self):
+        capacity = self.INITIAL_CAPACITY
+        self._class_names = np.empty(capacity, dtype=object)
+        self._descriptions = np.empty(capacity, dtype=object)
+        self._auto_idx = np.full(capacity, -1, dtype=np.int64)
+        self._registered_idx = np.full(capacity, -1, dtype=np.int64)
+        self._bboxes = np.empty(capacity, dtype=object)
+        self._updated_generation = np.full(capacity, -1, dtype=np.int64)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._coords = np.zeros((capacity, 4), dtype=np.float64)
+        # количество занятых слотов (включая удаленные)
+        self._size = 0
+        # количество живых рамок
+        self._live_num = 0
+
+        # текущее поколение (увеличивается при каждой проверке обновленных рамок, т.е. на каждом кадре)
+        self._frame_generation = 0
+        # слоты, обновленные в текущем поколении, и слоты, которые в текущем поколении еще не обновлялись.
+        # Их объединение - все живые слоты
+        self._updated_slots = set()
+        self._stale_slots = set()
+
+        # порядок отрисовки: отсортированный список пар (-registered_idx, слот), т.е. рамки с большим
+        # registered_idx идут первыми, а незарегистрированные (registered_idx=-1) - в конце.
+        # Поддерживается при вставке, удалении и изменении регистрации рамки. None - надо перестроить
+        self._render_order = []
+
+        # равномерная сетка для поиска рамок под курсором: (столбец, строка) ячейки -> список слотов.
+        # Перестраивается при первом запросе после изменения контейнера
+        self._hit_grid = None
+        self._hit_grid_version = -1
+        self._hit_grid_margin = 0
+        self._hit_grid_cell_size = self.HIT_GRID_MIN_CELL_SIZE
+
+        # хэш-индексы: ключ -> упорядоченное множество слотов (dict без значений)
+        self._key_index = {}
+        self._auto_index = {}
+        self._registered_index = {}
+
+        # флаг, сигнализирующий о том, что колонки разделяются со снимком и перед изменением их надо скопировать
+        self._columns_shared = False
+
+        # закэшированная таблица для bboxes_df
+        self._touch()
+        self._df_cache = None
+        self._df_cache_version = -1
+
+    # ------------------------------------------------------------------
+    # Низкоуровневые операции над слотами
+    # ------------------------------------------------------------------
+    def _touch(self):
+        self._version += 1
+
+    def preserve_bbox(self, bbox):
+        '''
+        Сохранение текущего состояния рамки в живые снимки контейнера перед ее изменением на месте (copy-on-write).
+        Рамка копируется не больше одного раза на снимок. Методы контейнера вызывают его сами,
+        а код, изменяющий рамки контейнера напрямую, должен вызвать его перед изменением
+        '''
+        if len(self._snapshots) == 0:
+            return
+        bbox_copy = None
+        for snapshot in list(self._snapshots):
+            if id(bbox) not in snapshot._preserved_bboxes:
+                if bbox_copy is None:
+                    bbox_copy = copy(bbox)
+                snapshot._preserved_bboxes[id(bbox)] = bbox_copy
+
+    def _own_columns(self):
+        '''
+        Копирование колонок перед изменением, если они разделяются со снимком (copy-on-write)
+        '''
+        if not self._columns_shared:
+            return
+        self._class_names = self._class_names.copy()
+        self._descriptions = self._descriptions.copy()
+        self._auto_idx = self._auto_idx.copy()
+        self._registered_idx = self._registered_idx.copy()
+        self._bboxes = self._bboxes.copy()
+        self._updated_generation = self._updated_generation.copy()
+        self._alive = self._alive.copy()
+        self._coords = self._coords.copy()
+        self._columns_shared = False
+
+    def _bbox_at(self, slot):
+        return self._bboxes[slot]
+
+    def _ensure_capacity(self):
+        capacity = len(self._alive)
+        if self._size < capacity:
+            return
+        new_capacity = capacity * 2
+
+        def grow(arr, fill):
+            new_arr = np.empty((new_capacity,) + arr.shape[1:], dtype=arr.dtype)
+            new_arr[:capacity] = arr
+            new_arr[capacity:] = fill
+            return new_arr
+
+        self._class_names = grow(self._class_names, None)
+        self._descriptions = grow(self._descriptions, None)
+        self._auto_idx = grow(self._auto_idx, -1)
+        self._registered_idx = grow(self._registered_idx, -1)
+        self._bboxes = grow(self._bboxes, None)
+        self._updated_generation = grow(self._updated_generation, -1)
+        self._alive = grow(self._alive, False)
+        self._coords = grow(self._coords, 0)
+
+    @staticmethod
+    def _index_add(index, key, slot):
+        index.setdefault(key, {})[slot] = None
+
+    @staticmethod
+    def _index_remove(index, key, slot):
+        slots = index.get(key)
+        if slots is None:
+            return
+        slots.pop(slot, None)
+        if len(slots) == 0:
+            del index[key]
+
+    def _index_slot(self, slot):
+        class_name = self._class_names[slot]
+        auto_idx = int(self._auto_idx[slot])
+        registered_idx = int(self._registered_idx[slot])
+        self._index_add(self._key_index, (class_name, auto_idx, registered_idx), slot)
+        self._index_add(self._auto_index, (class_name, auto_idx), slot)
+        self._index_add(self._registered_index, (class_name, registered_idx), slot)
+
+    def _unindex_slot(self, slot):
+        class_name = self._class_names[slot]
+        auto_idx = int(self._auto_idx[slot])
+        registered_idx = int(self._registered_idx[slot])
+        self._index_remove(self._key_index, (class_name, auto_idx, registered_idx), slot)
+        self._index_remove(self._auto_index, (class_name, auto_idx), slot)
+        self._index_remove(self._registered_index, (class_name, registered_idx), slot)
+
+    def _insert_row(self, bbox, class_name, object_description, auto_idx, registered_idx, is_updated=True):
+        self._own_columns()
+        self._ensure_capacity()
+        slot = self._size
+        self._size += 1
+        self._live_num += 1
+
+        self._class_names[slot] = class_name
+        self._descriptions[slot] = object_description
+        self._auto_idx[slot] = int(auto_idx)
+        self._registered_idx[slot] = int(registered_idx)
+        self._bboxes[slot] = bbox
+        self._alive[slot] = True
+        self._coords[slot] = bbox.coords
+        if is_updated:
+            self._mark_updated(slot)
+        else:
+            self._updated_generation[slot] = -1
+            self._stale_slots.add(slot)
+        self._index_slot(slot)
+        self._render_order_add(slot)
+        self._touch()
+        return slot
+
+    def _mark_updated(self, slot):
+        '''
+        Пометка рамки как обновленной в текущем поколении
+        '''
+        self._updated_generation[slot] = self._frame_generation
+        self._stale_slots.discard(slot)
+        self._updated_slots.add(slot)
+
+    def _is_slot_updated(self, slot):
+        return self._updated_generation[slot] == self._frame_generation
+
+    def _remove_row(self, slot):
+        self._own_columns()
+        self._unindex_slot(slot)
+        self._render_order_remove(slot)
+        self._alive[slot] = False
+        self._bboxes[slot] = None
+        self._updated_generation[slot] = -1
+        self._stale_slots.discard(slot)
+        self._updated_slots.discard(slot)
+        self._live_num -= 1
+        self._touch()
+
+    def _set_row_attrs(self, slot, auto_idx=None, registered_idx=None, object_description=None):
+        '''
+        Изменение атрибутов строки с поддержкой индексов в актуальном состоянии
+        '''
+        self._own_columns()
+        self._unindex_slot(slot)
+        if auto_idx is not None:
+            self._auto_idx[slot] = int(auto_idx)
+        if registered_idx is not None and registered_idx != self._registered_idx[slot]:
+            self._render_order_remove(slot)
+            self._registered_idx[slot] = int(registered_idx)
+            self._render_order_add(slot)
+        if object_description is not None:
+            self._descriptions[slot] = object_description
+        self._index_slot(slot)
+        self._touch()
+
+    # Список порядка отрисовки не изменяется на месте, а заменяется новым: по нему может итерироваться
+    # поток отрисовки, пока поток GUI изменяет контейнер
+    def _render_order_add(self, slot):
+        if self._render_order is None:
+            return
+        render_order = self._render_order.copy()
+        bisect.insort(render_order, (-int(self._registered_idx[slot]), slot))
+        self._render_order = render_order
+
+    def _render_order_remove(self, slot):
+        if self._render_order is None:
+            return
+        item = (-int(self._registered_idx[slot]), slot)
+        position = bisect.bisect_left(self._render_order, item)
+        if position < len(self._render_order) and self._render_order[position] == item:
+            self._render_order = self._render_order[:position] + self._render_order[position+1:]
+
+    def _rebuild_render_order(self):
+        live_slots = self._live_slots().tolist()
+        self._render_order = sorted(zip((-self._registered_idx[live_slots]).tolist(), live_slots))
+
+    def _rebuild_hit_grid(self, margin):
+        '''
+        Построение сетки для поиска рамок под курсором. Каждая рамка, расширенная на margin
+        (радиус захвата угла), заносится во все ячейки, которые она пересекает
+        '''
+        live_slots = self._live_slots()
+        coords = self._coords[live_slots]
+        x_min = np.minimum(coords[:, 0], coords[:, 2]) - margin
+        y_min = np.minimum(coords[:, 1], coords[:, 3]) - margin
+        x_max = np.maximum(coords[:, 0], coords[:, 2]) + margin
+        y_max = np.maximum(coords[:, 1], coords[:, 3]) + margin
+
+        # размер ячейки выбираем по типичному размеру рамки, чтобы рамка попадала в небольшое число ячеек
+        cell_size = self.HIT_GRID_MIN_CELL_SIZE
+        if len(live_slots) > 0:
+            cell_size = max(cell_size, int(np.median(np.maximum(x_max - x_min, y_max - y_min))))
+
+        grid = {}
+        cells = np.floor_divide(np.stack([x_min, y_min, x_max, y_max], axis=1), cell_size).astype(np.int64)
+        for slot, (col0, row0, col1, row1) in zip(live_slots.tolist(), cells.tolist()):
+            for col in range(col0, col1+1):
+                for row in range(row0, row1+1):
+                    grid.setdefault((col, row), []).append(slot)
+
+        self._hit_grid = grid
+        self._hit_grid_cell_size = cell_size
+        self._hit_grid_margin = margin
+        self._hit_grid_version = self._version
+
+    def _sync_coords(self, slot):
+        self._own_columns()
+        self._coords[slot] = self._bboxes[slot].coords
+        self._touch()
+
+    def _live_slots(self):
+        return np.flatnonzero(self._alive[:self._size])
+
+    def _compact(self):
+        '''
+        Удаление "дыр", оставшихся от удаленных рамок. Номера слотов при этом меняются
+        '''
+        live_slots = self._live_slots()
+        if len(live_slots) == self._size:
+            return
+        self._own_columns()
+        self._class_names[:len(live_slots)] = self._class_names[live_slots]
+        self._descriptions[:len(live_slots)] = self._descriptions[live_slots]
+        self._auto_idx[:len(live_slots)] = self._auto_idx[live_slots]
+        self._registered_idx[:len(live_slots)] = self._registered_idx[live_slots]
+        self._bboxes[:len(live_slots)] = self._bboxes[live_slots]
+        self._updated_generation[:len(live_slots)] = self._updated_generation[live_slots]
+        self._coords[:len(live_slots)] = self._coords[live_slots]
+        self._alive[:len(live_slots)] = True
+
+        self._class_names[len(live_slots):self._size] = None
+        self._descriptions[len(live_slots):self._size] = None
+        self._bboxes[len(live_slots):self._size] = None
+        self._updated_generation[len(live_slots):self._size] = -1
+        self._alive[len(live_slots):self._size] = False
+        self._size = len(live_slots)
+
+        # переводим номера слотов в множествах обновленных и не обновленных рамок
+        new_slots = np.full(len(self._alive), -1, dtype=np.int64)
+        new_slots[live_slots] = np.arange(len(live_slots))
+        self._updated_slots = set(new_slots[list(self._updated_slots)].tolist())
+        self._stale_slots = set(new_slots[list(self._stale_slots)].tolist())
+
+        self._rebuild_indexes()
+        self._render_order = None
+        self._touch()
+
+    def _rebuild_indexes(self):
+        self._key_index = {}
+        self._auto_index = {}
+        self._registered_index = {}
+        for slot in self._live_slots().tolist():
+            self._index_slot(slot)
+
+    def _find_slots(self, class_name=None, auto_idx=None, registered_idx=None, object_description=None, tracker_type=None):
+        '''
+        Поиск слотов по атрибутам. Если заданы имя класса и один из индексов, то поиск выполняется по хэш-индексу,
+        иначе - векторной фильтрацией по колонкам
+        '''
+        if class_name is not None and auto_idx is not None and registered_idx is not None:
+            candidates = self._key_index.get((class_name, int(auto_idx), int(registered_idx)), {})
+            auto_idx = registered_idx = None
+        elif class_name is not None and auto_idx is not None:
+            candidates = self._auto_index.get((class_name, int(auto_idx)), {})
+            auto_idx = None
+        elif class_name is not None and registered_idx is not None:
+            candidates = self._registered_index.get((class_name, int(registered_idx)), {})
+            registered_idx = None
+        else:
+            filter_condition = self._alive[:self._size].copy()
+            if class_name is not None:
+                filter_condition &= self._class_names[:self._size] == class_name
+            if auto_idx is not None:
+                filter_condition &= self._auto_idx[:self._size] == auto_idx
+            if registered_idx is not None:
+                filter_condition &= self._registered_idx[:self._size] == registered_idx
+            if object_description is not None:
+                filter_condition &= self._descriptions[:self._size] == object_description
+            slots = np.flatnonzero(filter_condition).tolist()
+            if tracker_type is not None:
+                slots = [slot for slot in slots if self._bbox_at(slot).tracker_type == tracker_type]
+            return slots
+
+        slots = []
+        for slot in candidates:
+            if auto_idx is not None and self._auto_idx[slot] != auto_idx:
+                continue
+            if registered_idx is not None and self._registered_idx[slot] != registered_idx:
+                continue
+            if object_description is not None and self._descriptions[slot] != object_description:
+                continue
+            if tracker_type is not None and self._bbox_at(slot).tracker_type != tracker_type:
+                continue
+            slots.append(slot)
+        return slots
+
+    def _rows_to_df(self, slots):
+        '''
+        Формирование таблицы pandas из заданных слотов. Индекс таблицы совпадает с номерами слотов
+        '''
+        slots = list(slots)
+        return pd.DataFrame(
+            {
+                'class_name': [self._class_names[slot] for slot in slots],
+                'object_description': [self._descriptions[slot] for slot in slots],
+                'auto_idx': [int(self._auto_idx[slot]) for slot in slots],
+                'registered_idx': [int(self._registered_idx[slot]) for slot in slots],
+                'bbox': [self._bbox_at(slot) for slot in slots],
+                'is_updated': [bool(self._is_slot_updated(slot)) for slot in slots],
+            },
+            index=slots,
+            columns=self.TABLE_COLUMNS)
+
+    @property
+    def bboxes_df(self):
+        '''
+        Представление содержимого контейнера в виде таблицы pandas (только для чтения).
+        Таблица строится лениво и кэшируется до следующего изменения контейнера
+        '''
+        if self._df_cache_version != self._version:
+            self._df_cache = self._rows_to_df(self._live_slots())
+            self._df_cache_version = self._version
+        return self._df_cache
+
+    @bboxes_df.setter
+    def bboxes_df(self, df):
+        '''
+        Заполнение контейнера из таблицы pandas с колонками TABLE_COLUMNS
+        '''
+        registered_objects_store = self.registered_objects_store
+        self.reset_tracking_objects_table()
+        self.registered_objects_store = registered_objects_store
+        for _, row in df.iterrows():
+            self._insert_row(
+                row['bbox'],
+                row['class_name'],
+                row['object_description'],
+                row['auto_idx'],
+                row['registered_idx'],
+                is_updated=bool(row['is_updated']))
+
+    # ------------------------------------------------------------------
+    # Публичный интерфейс
+    # ------------------------------------------------------------------
     def change_all_bboxes_alternative_tracker_type(self, new_tracker_type):
         # ищем все рамки, которые отслеживаются альтернативным трекером, включая те, 
         # для которых запрещено менять координаты
-        alternative_tracked_bboxes_df = self.get_all_alternative_tracked_registered_bboxes()
-        for _, row in alternative_tracked_bboxes_df.iterrows():
-            bbox = row['bbox']
-            bbox.update_tracker_type(new_tracker_type)
-            row['bbox'] = bbox
+        for slot in self._find_alternative_tracked_registered_slots():
+            self.preserve_bbox(self._bboxes[slot])
+            self._bboxes[slot].update_tracker_type(new_tracker_type)
+        self._touch()
 
     def change_bbox_tracker_type(self, bbox, new_tracker_type):
         '''
@@ -773,20 +1871,24 @@ class BboxesContainer:
         '''
 
         # сначала ищем конкретную рамку
-        found_bboxes_df = self.find_bbox_by_attributes(
+        found_slots = self._find_slots(
             class_name=bbox.class_name,
             auto_idx=bbox.auto_idx,
             registered_idx=bbox.registered_idx
             )
-        if len(found_bboxes_df) == 1:
+        if len(found_slots) == 1:
             # если рамка найдена, то изменяем тип трекера
+            self.preserve_bbox(bbox)
             bbox.update_tracker_type(new_tracker_type)
             self.update_bbox(bbox)
 
-    def reset_tracking_objects_table(self):
-        self.bboxes_df = pd.DataFrame(columns=['class_name', 'object_description', 'auto_idx', 'registered_idx', 'bbox', 'is_updated'])
-
-    #def get_
+    def change_bbox_displaying_type(self, bbox, displaying_type):
+        '''
+        Изменение типа отображения одной рамки контейнера ('auto', 'registered' или 'no' - рамка скрыта)
+        '''
+        self.preserve_bbox(bbox)
+        bbox.displaying_type = displaying_type
+        self._touch()
 
     def find_nearest_iou_bbox(self, bbox, tracking_type):
         '''
@@ -798,90 +1900,76 @@ class BboxesContainer:
         auto_idx = bbox.auto_idx
         registered_idx = bbox.registered_idx
 
-        class_filter = (self.bboxes_df['class_name'] == class_name)
-        if tracking_type == 'all':
-            filter_condition = class_filter
-        elif tracking_type == 'auto':
-            filter_condition = class_filter & (self.bboxes_df['auto_idx'] != -1)
+        candidate_slots = self._find_slots(class_name=class_name)
+        if tracking_type == 'auto':
+            candidate_slots = [slot for slot in candidate_slots if self._auto_idx[slot] != -1]
         elif tracking_type == 'alternative':
-            filter_condition = class_filter & (self.bboxes_df['registered_idx'] != -1)
+            candidate_slots = [slot for slot in candidate_slots if self._registered_idx[slot] != -1]
         elif tracking_type == 'no':
             # пока что так...
-            filter_condition = class_filter & (self.bboxes_df['bbox'].apply(lambda bbox: bbox.tracker_type=='no',))
+            candidate_slots = [slot for slot in candidate_slots if self._bbox_at(slot).tracker_type == 'no']
+
+        # исключаем саму рамку, чтобы не сравнивать ее с самой собой
+        own_slots = set(self._find_slots(class_name=class_name, auto_idx=auto_idx, registered_idx=registered_idx))
+        candidate_slots = [slot for slot in candidate_slots if slot not in own_slots]
+
+        if len(candidate_slots) == 0:
+            return {'nearest_bbox_iou': 0.0, 'nearest_bbox': None}
+
+        iou_array = compute_iou_matrix(self._coords[candidate_slots], bbox.coords)[:, 0]
 
-        filtered_df = self.bboxes_df[filter_condition]
-        
-        # ищем в таблице саму рамку, чтобы не сравнивать ее с самой собой
-        found_bbox_df = self.find_bbox_by_attributes(class_name=class_name, auto_idx=auto_idx, registered_idx=registered_idx)
-        
-        if len(found_bbox_df) != 0:
-            for idx in found_bbox_df.index:
-                if idx in filtered_df.index:
-                    filtered_df = filtered_df.drop(index=idx)
-        
-        iou_array = filtered_df['bbox'].apply(lambda x:compute_iou(x.coords, bbox.coords))
-        
         nearest_iou = iou_array.max()
-        nearest_idx = filtered_df.index[iou_array.argmax()]
+        nearest_slot = candidate_slots[iou_array.argmax()]
         
         if nearest_iou < 0.1:
             return {'nearest_bbox_iou':nearest_iou, 'nearest_bbox': None}
-        return {'nearest_bbox_iou':nearest_iou, 'nearest_bbox': filtered_df.loc[nearest_idx, 'bbox']}
+        return {'nearest_bbox_iou':nearest_iou, 'nearest_bbox': self._bbox_at(nearest_slot)}
 
     def find_bbox_by_attributes(self, class_name=None, auto_idx=None, registered_idx=None, object_description=None, tracker_type=None):
         '''
         Поиск рамок по атрибутам: имени класса, автоматическому индексу, индексу, присвоенному вручную и текстовому описанию объектов
         '''
-        filter_condition = ~self.bboxes_df['bbox'].isna()
-        
-        if class_name is not None:
-            filter_condition = filter_condition & (self.bboxes_df['class_name']==class_name)
-        if auto_idx is not None:
-            filter_condition = filter_condition & (self.bboxes_df['auto_idx']==auto_idx)
-        if registered_idx is not None:
-            filter_condition = filter_condition & (self.bboxes_df['registered_idx']==registered_idx)
-        if object_description is not None:
-            filter_condition = filter_condition & (self.bboxes_df['object_description']==object_description)
-        if tracker_type is not None:
-            filter_condition = filter_condition & (self.bboxes_df['bbox'].apply(lambda bbox: bbox.tracker_type==tracker_type))
-
-        return self.bboxes_df[filter_condition]
+        found_slots = self._find_slots(
+            class_name=class_name,
+            auto_idx=auto_idx,
+            registered_idx=registered_idx,
+            object_description=object_description,
+            tracker_type=tracker_type)
+        return self._rows_to_df(found_slots)
 
     def get_all_bboxes_coordinates(self):
-        all_coordinates_df = pd.DataFrame()
-        all_coordinates_df = self.bboxes_df['bbox'].apply(lambda x: pd.Series([*x.coords], index=['x0', 'y0', 'x1', 'y1']))
-        #np.array(coords.to_list())
-        all_coordinates_df['class_name'] = self.bboxes_df['class_name']
-        all_coordinates_df['auto_idx'] = self.bboxes_df['auto_idx']
-        all_coordinates_df['registered_idx'] = self.bboxes_df['registered_idx']
-        return all_coordinates_df.reset_index(drop=True)
+        live_slots = self._live_slots()
+        all_coordinates_df = pd.DataFrame(self._coords[live_slots], columns=['x0', 'y0', 'x1', 'y1'])
+        all_coordinates_df['class_name'] = self._class_names[live_slots]
+        all_coordinates_df['auto_idx'] = self._auto_idx[live_slots]
+        all_coordinates_df['registered_idx'] = self._registered_idx[live_slots]
+        return all_coordinates_df
 
     def add_new_bbox_to_table(self, updating_bbox):
-        self.bboxes_df = self.bboxes_df.reset_index(drop=True)
-        self.bboxes_df.loc[len(self.bboxes_df)] = {
-                    'class_name': updating_bbox.class_name,
-                    'object_description': updating_bbox.object_description,
-                    'auto_idx': updating_bbox.auto_idx,
-                    'registered_idx': updating_bbox.registered_idx,
-                    'bbox': updating_bbox,
-                    'is_updated':True
-                    }
+        self._insert_row(
+            updating_bbox,
+            updating_bbox.class_name,
+            updating_bbox.object_description,
+            updating_bbox.auto_idx,
+            updating_bbox.registered_idx,
+            is_updated=True)
     
     def update_existing_bbox_coords(self, index, updating_bbox):
-        found_bbox = self.bboxes_df.loc[index]['bbox']
+        self._own_columns()
+        found_bbox = self._bboxes[index]
+        self.preserve_bbox(found_bbox)
         found_bbox.coords = updating_bbox.coords
-        self.bboxes_df.loc[index, 'is_updated'] = True
-        self.bboxes_df.loc[index, 'bbox'] = found_bbox
+        self._mark_updated(index)
+        self._sync_coords(index)
     
     def unregister_all_bboxes(self):
-        for _, row in self.bboxes_df.iterrows():
-            bbox = row['bbox']
+        for slot in self._live_slots():
+            bbox = self._bboxes[slot]
+            self.preserve_bbox(bbox)
             bbox.object_description = ''
             bbox.color = (0, 0, 0)
             bbox.registered_idx = -1
-            row['registered_idx'] = -1
-            row['object_description'] = ''
-            row['bbox'] = bbox
+            self._set_row_attrs(slot, registered_idx=-1, object_description='')
 
     def unregister_bbox(self, bbox):
         '''
@@ -890,6 +1978,7 @@ class BboxesContainer:
         
         self.pop(bbox)
         
+        self.preserve_bbox(bbox)
         bbox.registered_idx = -1
         bbox.object_description = ''
         bbox.color = (0, 0, 0)
@@ -897,39 +1986,34 @@ class BboxesContainer:
         self.update_bbox(bbox)      
     
     def unregister_bbox_by_table_index(self, index, registered_autobbox):
+        self.preserve_bbox(registered_autobbox)
         registered_autobbox.object_description = ''
         registered_autobbox.color = (0, 0, 0)
         registered_autobbox.registered_idx = -1
         registered_autobbox.displaying_type = 'auto'
         #registered_autobbox.tracker_type = 'auto'
 
-        self.bboxes_df.loc[index, 'is_updated'] = True
-        self.bboxes_df.loc[index, 'registered_idx'] = -1
-        self.bboxes_df.loc[index, 'object_description'] = ''
-        self.bboxes_df.loc[index, 'bbox'] = registered_autobbox
+        self._own_columns()
+        self._mark_updated(index)
+        self._bboxes[index] = registered_autobbox
+        self._set_row_attrs(index, registered_idx=-1, object_description='')
 
     def update_same_bbox(self, updating_bbox):
         '''
         Поиск и обновление той же самой рамки
         '''
-        updating_class_name = updating_bbox.class_name
-        updating_auto_idx = updating_bbox.auto_idx
-        updating_registered_idx = updating_bbox.registered_idx
-
-        filter_condition = (self.bboxes_df['class_name']==updating_class_name)\
-            & (self.bboxes_df['auto_idx']==updating_auto_idx)\
-            & (self.bboxes_df['registered_idx']==updating_registered_idx)
-        # ищем рамку в таблице
-        filtered_bboxes_df = self.bboxes_df[filter_condition]
-        if len(filtered_bboxes_df) < 1:
+        # ищем рамку по хэш-индексу
+        found_slots = self._key_index.get(
+            (updating_bbox.class_name, int(updating_bbox.auto_idx), int(updating_bbox.registered_idx)), {})
+        if len(found_slots) < 1:
             # если рамка не найдена, добавляем ее в таблицу
             self.add_new_bbox_to_table(updating_bbox)
         # если рамка есть в БД, и она единственная, обновляем координаты
-        elif len(filtered_bboxes_df) == 1:
-            index = filtered_bboxes_df.index[0]
+        elif len(found_slots) == 1:
+            index = next(iter(found_slots))
             self.update_existing_bbox_coords(index, updating_bbox)
         else:
-            error_str = f'More than one unique bboxes found in the table bboxes_df\n{filtered_bboxes_df}'
+            error_str = f'More than one unique bboxes found in the table bboxes_df\n{self._rows_to_df(found_slots)}'
             raise ValueError(error_str)
 
     def update_bbox(self, updating_bbox):
@@ -953,15 +2037,13 @@ class BboxesContainer:
             # (случай, дополнительного трекинга и/или сохранения координат рамки для созданных вручную рамок)
 
             # Сначала ищем рамку, зарегистрированную автоматическую рамку и снимаем регистрацию
-            registered_autobbox_filter_condition = (self.bboxes_df['class_name']==updating_class_name)\
-                & (self.bboxes_df['auto_idx']!=-1)\
-                & (self.bboxes_df['registered_idx']==updating_registered_idx)
-            
-            registered_autobbox_df = self.bboxes_df[registered_autobbox_filter_condition]
+            registered_autobbox_slots = [
+                slot for slot in self._registered_index.get((updating_class_name, int(updating_registered_idx)), {})
+                if self._auto_idx[slot] != -1]
             # если найдена автоматическая рамка, которая уже отслеживается, снимаем с нее статус отслеживаемой
-            if len(registered_autobbox_df) == 1:
-                index = registered_autobbox_df.index[0]
-                registered_autobbox = registered_autobbox_df.loc[index]['bbox']
+            if len(registered_autobbox_slots) == 1:
+                index = registered_autobbox_slots[0]
+                registered_autobbox = self._bboxes[index]
                 self.unregister_bbox_by_table_index(index, registered_autobbox)
             # после этого ищем ту же самую рамку manual_created+tracked
             self.update_same_bbox(updating_bbox)
@@ -969,14 +2051,13 @@ class BboxesContainer:
             # если рамка создана автоматически и не отслеживается
             
             # Сначала ищем, есть уже ли в таблице зарегистрированнаая рамка
-            registered_autobbox_filter_condition = (self.bboxes_df['class_name']==updating_class_name)\
-                & (self.bboxes_df['auto_idx']==updating_auto_idx)\
-                & (self.bboxes_df['registered_idx']!=-1)
-            
-            registered_autobbox_df = self.bboxes_df[registered_autobbox_filter_condition]
+            registered_autobbox_slots = [
+                slot for slot in self._auto_index.get((updating_class_name, int(updating_auto_idx)), {})
+                if self._registered_idx[slot] != -1]
             # если в таблице найдена такая же отслеживаемая рамка, то делаем updating_bbox отслеживаемой
-            if len(registered_autobbox_df) == 1:
-                registered_bbox = registered_autobbox_df['bbox'].values[0]
+            if len(registered_autobbox_slots) == 1:
+                registered_bbox = self._bboxes[registered_autobbox_slots[0]]
+                self.preserve_bbox(updating_bbox)
                 updating_bbox.object_description = registered_bbox.object_description
                 updating_bbox.registered_idx = registered_bbox.registered_idx
             # обновляем рамку
@@ -984,36 +2065,148 @@ class BboxesContainer:
         elif updating_auto_idx != -1 and updating_registered_idx != -1:
             # если рамка создана автоматически и отслеживается, то обновляем только ее координаты
             self.update_same_bbox(updating_bbox) #????
-        
+
+    @staticmethod
+    def _match_keys(row_keys, row_slots, query_keys):
+        '''
+        Сопоставление ключей запросов с ключами строк посредством бинарного поиска.
+        Возвращает для каждого запроса номер первого совпавшего слота (-1, если совпадений нет) и количество совпадений
+        '''
+        matched_slots = np.full(len(query_keys), -1, dtype=np.int64)
+        matched_counts = np.zeros(len(query_keys), dtype=np.int64)
+        if len(row_keys) == 0 or len(query_keys) == 0:
+            return matched_slots, matched_counts
+        order = np.argsort(row_keys, kind='stable')
+        sorted_keys = row_keys[order]
+        left = np.searchsorted(sorted_keys, query_keys, side='left')
+        right = np.searchsorted(sorted_keys, query_keys, side='right')
+        matched_counts = right - left
+        found = matched_counts > 0
+        matched_slots[found] = row_slots[order[left[found]]]
+        return matched_slots, matched_counts
+
+    def ingest_detections(self, xyxy, ids, class_names, img_rows, img_cols, bbox_append_value=0):
+        '''
+        Пакетное обновление контейнера результатами автоматического трекера для одного кадра.
+        Результат совпадает с последовательным вызовом update_bbox для каждой автоматической рамки,
+        но расширение, обрезка, сопоставление с зарегистрированными рамками и пометка обновленных рамок
+        выполняются операциями над массивами
+        xyxy - координаты рамок в формате x0,y0,x1,y1, shape=(N, 4)
+        ids - индексы объектов, присвоенные автоматическим трекером, shape=(N,)
+        class_names - имена классов детектированных объектов, длина N
+        img_rows, img_cols - размер кадра
+        bbox_append_value - количество пикселей, на которое рамка расширяется в каждую сторону
+        '''
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        class_names = np.asarray(class_names, dtype=object).reshape(-1)
+        if len(ids) == 0:
+            return
+
+        # добавляем несколько пикселей, чтобы рамка строилась не впритык к объекту
+        coords = np.asarray(xyxy).reshape(-1, 4).astype(np.int64)\
+            + np.array([-bbox_append_value, -bbox_append_value, bbox_append_value, bbox_append_value], dtype=np.int64)
+        # делаем так, чтобы рамка не выходила за пределы кадра
+        coords = process_boxes_coords_array(coords, img_rows, img_cols)
+
+        # слот, соответствующий каждой рамке: -1 - рамки нет в таблице, -2 - рамка дублирует другую рамку того же кадра
+        det_slots = np.full(len(ids), -2, dtype=np.int64)
+
+        live_slots = self._live_slots()
+        live_auto_slots = live_slots[self._auto_idx[live_slots] != -1]
+        live_auto_class_names = self._class_names[live_auto_slots]
+        for class_name in set(class_names.tolist()):
+            det_positions = np.flatnonzero(class_names == class_name)
+            # если один и тот же объект пришел несколько раз, остается последняя рамка (как при последовательных вызовах update_bbox)
+            _, last_reversed = np.unique(ids[det_positions][::-1], return_index=True)
+            det_positions = det_positions[np.sort(len(det_positions) - 1 - last_reversed)]
+            det_ids = ids[det_positions]
+
+            class_slots = live_auto_slots[live_auto_class_names == class_name]
+            class_auto_idx = self._auto_idx[class_slots]
+            is_registered = self._registered_idx[class_slots] != -1
+
+            # Сначала ищем, есть уже ли в таблице зарегистрированнаая рамка с тем же auto_idx
+            registered_slots, registered_counts = self._match_keys(
+                class_auto_idx[is_registered], class_slots[is_registered], det_ids)
+            # потом ищем ту же самую незарегистрированную рамку
+            unregistered_slots, unregistered_counts = self._match_keys(
+                class_auto_idx[~is_registered], class_slots[~is_registered], det_ids)
+
+            use_registered = registered_counts == 1
+            if np.any(~use_registered & (unregistered_counts > 1)):
+                duplicated_slots = unregistered_slots[~use_registered & (unregistered_counts > 1)]
+                error_str = f'More than one unique bboxes found in the table bboxes_df\n{self._rows_to_df(duplicated_slots)}'
+                raise ValueError(error_str)
+            det_slots[det_positions] = np.where(use_registered, registered_slots, unregistered_slots)
+
+        # обновляем координаты найденных рамок
+        self._own_columns()
+        is_found = det_slots >= 0
+        found_slots = det_slots[is_found]
+        self._coords[found_slots] = coords[is_found]
+        self._updated_generation[found_slots] = self._frame_generation
+        self._stale_slots.difference_update(found_slots.tolist())
+        self._updated_slots.update(found_slots.tolist())
+        for slot, new_coords in zip(found_slots.tolist(), coords[is_found].tolist()):
+            self.preserve_bbox(self._bboxes[slot])
+            self._bboxes[slot].coords = tuple(new_coords)
+
+        # добавляем новые рамки в порядке их следования в результатах трекера
+        for position in np.flatnonzero(det_slots == -1).tolist():
+            x0, y0, x1, y1 = coords[position].tolist()
+            class_name = class_names[position]
+            auto_idx = int(ids[position])
+            # пока что оставляем всего лишь один цвет - черный
+            bbox = Bbox(
+                x0, y0, x1, y1,
+                img_rows, img_cols,
+                class_name=class_name,
+                auto_idx=auto_idx,
+                registered_idx=-1,
+                object_description='',
+                color=(0, 0, 0),
+                displaying_type='auto',
+                tracker_type='auto'
+                )
+            self._insert_row(bbox, class_name, '', auto_idx, -1, is_updated=True)
+        self._touch()
+
     def get_all_autogenerated_bboxes(self):
-        filter_condition = self.bboxes_df['auto_idx'] != -1
-        return self.bboxes_df[filter_condition]
+        live_slots = self._live_slots()
+        return self._rows_to_df(live_slots[self._auto_idx[live_slots] != -1])
 
     def get_registered_objects_db(self):
         return self.registered_objects_db
 
     def get_all_registered_bboxes_list(self):
-        registered_bboxes_filter_condition = self.bboxes_df['registered_idx'] != -1
-        registered_bboxes_df = self.bboxes_df[registered_bboxes_filter_condition]
-        return registered_bboxes_df['bbox'].to_list()
+        live_slots = self._live_slots()
+        return [self._bbox_at(slot) for slot in live_slots[self._registered_idx[live_slots] != -1].tolist()]
 
     def check_updated_bboxes(self):
         '''
-        Проверка и сохранения только тех рамок, которые были обновлены
+        Проверка и сохранения только тех рамок, которые были обновлены.
+        Пропавшие рамки берутся из множества не обновленных в текущем поколении слотов, а сброс
+        признака обновления сводится к переходу к следующему поколению, поэтому время работы
+        пропорционально количеству изменившихся рамок, а не размеру таблицы
         '''
-        are_updated_bboxes = self.bboxes_df['is_updated'] == True
-        are_registered_bboxes = self.bboxes_df['registered_idx'] != -1
-        registered_and_not_updated = ~are_updated_bboxes & are_registered_bboxes
-        not_registered_and_not_updated = ~are_updated_bboxes & ~are_registered_bboxes
-        for idx, row in self.bboxes_df[registered_and_not_updated].iterrows():
-            bbox = row['bbox']
-            bbox.displaying_type = 'no'
-            row['bbox'] = bbox
+        self._own_columns()
+        dissapeared_slots = sorted(self._stale_slots)
+        for slot in dissapeared_slots:
+            if self._registered_idx[slot] != -1:
+                self.preserve_bbox(self._bboxes[slot])
+                self._bboxes[slot].displaying_type = 'no'
         
-        dissapeared_bboxes = self.bboxes_df[~are_updated_bboxes]
-        self.bboxes_df = self.bboxes_df[are_updated_bboxes]
-        # выставляем все рамки как не обновляемые
-        self.bboxes_df = self.bboxes_df.assign(is_updated=False)
+        dissapeared_bboxes = self._rows_to_df(dissapeared_slots)
+        for slot in dissapeared_slots:
+            self._remove_row(slot)
+        # выставляем все рамки как не обновляемые: все оставшиеся рамки были обновлены в текущем поколении,
+        # поэтому они становятся не обновленными в следующем
+        self._stale_slots, self._updated_slots = self._updated_slots, set()
+        self._frame_generation += 1
+        # удаляем "дыры" от удаленных рамок, только если их накопилось много
+        if self._size - self._live_num > max(self._live_num, self.INITIAL_CAPACITY):
+            self._compact()
+        self._touch()
         return dissapeared_bboxes
     
     def change_bboxes_displaying_type(self, displaying_type):
@@ -1024,24 +2217,25 @@ class BboxesContainer:
             'registered' - только зарегистрированные
             'full' - полные
         '''       
-        for i, row in self.bboxes_df.iterrows():
-            bbox = row['bbox']
+        for slot in self._live_slots():
+            bbox = self._bboxes[slot]
+            self.preserve_bbox(bbox)
             if displaying_type == 'full':
-                if row['registered_idx'] != -1:
+                if self._registered_idx[slot] != -1:
                     bbox.displaying_type = 'registered'
                     bbox.color = (0, 255, 0)
                 else:
                     bbox.displaying_type = 'auto'
                     bbox.color = (0, 0, 0)
             elif displaying_type == 'auto':
-                if row['auto_idx'] == -1:
+                if self._auto_idx[slot] == -1:
                     bbox.displaying_type = 'no'
                     bbox.color = (0, 0, 0)
                 else:
                     bbox.displaying_type = 'auto'
                     bbox.color = (0, 0, 0)
             elif displaying_type == 'registered':
-                if row['registered_idx'] != -1:
+                if self._registered_idx[slot] != -1:
                     bbox.displaying_type = 'registered'
                     bbox.color = (0, 255, 0)
                 else:
@@ -1049,159 +2243,231 @@ class BboxesContainer:
                     bbox.color = (0, 0, 0)
             else:
                 raise ValueError('displaying_type should be either "auto" either "registered" or "full"')
-
-            row['bbox'] = bbox
+        self._touch()
             
     def pop(self, bbox):
         '''
         Извлечение рамки из контейнера 
         '''
-        class_name = bbox.class_name
-        auto_idx = bbox.auto_idx
-        registered_idx = bbox.registered_idx
-        object_description = bbox.object_description
-
-        filter_condition = (self.bboxes_df['class_name']==class_name)\
-                & (self.bboxes_df['auto_idx']==auto_idx)\
-                & (self.bboxes_df['registered_idx']==registered_idx)\
-                & (self.bboxes_df['object_description']==object_description)
-        filtered_bboxes_df = self.bboxes_df[filter_condition]
+        found_slots = self._find_slots(
+            class_name=bbox.class_name,
+            auto_idx=bbox.auto_idx,
+            registered_idx=bbox.registered_idx,
+            object_description=bbox.object_description)
+        if len(found_slots) == 0:
+            raise IndexError(f'Bbox {bbox} is not found in the container')
 
-        index = filtered_bboxes_df.index[0]
-        self.bboxes_df = self.bboxes_df.drop(index=index)
+        filtered_bboxes_df = self._rows_to_df(found_slots)
+        self._remove_row(found_slots[0])
         
         return filtered_bboxes_df
-        
+
+    def _find_alternative_tracked_registered_slots(self):
+        # признак объектов, отслеживаемых альтернативным трекером, - объект зарегистрирован (registered_idx != 1) И автоматичекая рамка отсутствует (auto_idx == -1)
+        live_slots = self._live_slots()
+        filter_condition = (self._registered_idx[live_slots] != -1) & (self._auto_idx[live_slots] == -1)
+        return live_slots[filter_condition]
+
     def get_all_alternative_tracked_registered_bboxes(self):
         '''
         Поиск всех объектов, отслеживаемых альтернативным трекером, включая те, координаты которых не меняются
         '''
-        # признак объектов, отслеживаемых альтернативным трекером, - объект зарегистрирован (registered_idx != 1) И автоматичекая рамка отсутствует (auto_idx == -1)
-        alternative_tracked_and_registered_filter_condition = (self.bboxes_df['registered_idx']!=-1)\
-                & (self.bboxes_df['auto_idx']==-1)
-        
-        return self.bboxes_df[alternative_tracked_and_registered_filter_condition]
+        return self._rows_to_df(self._find_alternative_tracked_registered_slots())
 
     def get_auto_bbox_from_registered(self, class_name, registered_idx, object_descr):
-        filter_condition = (self.bboxes_df['class_name']==class_name)\
-                & (self.bboxes_df['registered_idx']==registered_idx)\
-                & (self.bboxes_df['object_description']==object_descr)
-        
-        return self.bboxes_df[filter_condition]
+        found_slots = self._find_slots(
+            class_name=class_name, registered_idx=registered_idx, object_description=object_descr)
+        return self._rows_to_df(found_slots)
+
+    def _attach_tracking_objects_db(self, path_to_db):
+        # если БД создана из таблицы, то журнал изменений будет вестись рядом с переданным csv файлом
+        if self.registered_objects_store.path_to_db is None:
+            self.registered_objects_store.path_to_db = path_to_db
 
     def append_to_tracking_objects_db(self, class_name, object_description, path_to_db):
         '''
         Добавляем новый объект в базу данных отслеживаемых объектов
         '''
-
-        if object_description != '' and object_description in self.registered_objects_db['object_description'].values:
-            return -1
-        
-        self.registered_objects_db = self.registered_objects_db.sort_values(by=['class_name', 'object_idx']).reset_index(drop=True)
-        # выясняем индекс класса добавляемого объекта
-        
-        idx_of_appending_obj = len(self.registered_objects_db[self.registered_objects_db['class_name']==class_name])
-        appending_row = {
-            'object_idx':idx_of_appending_obj,
-            'class_name':class_name,
-            'object_description':object_description
-            }
-        # добавляем строку в таблицу
-        self.registered_objects_db = self.registered_objects_db.reset_index(drop=True)
-        self.registered_objects_db.loc[len(self.registered_objects_db)] = appending_row
-
-        # сохраняем результат на диск
-        self.registered_objects_db.to_csv(path_to_db, index=False)
-
-        return 0
+        self._attach_tracking_objects_db(path_to_db)
+        return self.registered_objects_store.append(class_name, object_description)
 
     def delete_from_tracking_objects_db(self, class_name, object_idx, object_description, path_to_db):
-        filter_condition = (self.registered_objects_db['object_idx']==object_idx)\
-                & (self.registered_objects_db['class_name']==class_name)\
-                & (self.registered_objects_db['object_description']==object_description)
-        
-
-        index = self.registered_objects_db[filter_condition].index        
-        self.registered_objects_db = self.registered_objects_db.drop(index=index)
-
-        # сохраняем результат на диск
-        self.registered_objects_db.to_csv(path_to_db, index=False)
+        self._attach_tracking_objects_db(path_to_db)
+        self.registered_objects_store.delete(class_name, object_idx, object_description)
 
     def find_in_tracking_objects_db(self, class_name, object_description):
         '''
         Поиск в БД отслеживемых объектов по имени класса и описанию объектов
         '''
-        filter_condition = (self.registered_objects_db['class_name']==class_name)\
-                & (self.registered_objects_db['object_description']==object_description)
-        return self.registered_objects_db[filter_condition]
+        return self.registered_objects_store.find(class_name, object_description)
 
     def get_tracking_obj_idx(self, class_name, object_description):
-        filter_condition = (self.registered_objects_db['class_name']==class_name)\
-                & (self.registered_objects_db['object_description']==object_description)
-        return self.registered_objects_db[filter_condition]['object_idx']
+        return self.registered_objects_store.find(class_name, object_description)['object_idx']
 
     def assocoate_bbox_with_registered_object(self, class_name, auto_idx, object_description, registered_idx):
         '''
         Выполняется изменение registered_idx и добавление описания объекта
         '''
         # ищем автоматически сгенерированную рамку
-        auto_bbox_filter_condition = (self.bboxes_df['class_name']==class_name)\
-                & (self.bboxes_df['auto_idx']==auto_idx)
-        filtered_df = self.bboxes_df[auto_bbox_filter_condition]
-        if len(filtered_df) > 1:
+        found_slots = self._find_slots(class_name=class_name, auto_idx=auto_idx)
+        if len(found_slots) > 1:
             raise ValueError('Only bboxes with unique pair <class_name, autogenerated_idx> ought to be in self.bboxes_df')
-        elif len(filtered_df) == 0:
+        elif len(found_slots) == 0:
             raise ValueError('Bbox did not found')
         
         # ищем, есть ли уже в таблице зарегистрированный объект по имени класса, зарегистрированному индексу и описанию объекта
-        previous_registered_bbox_filter_condition = (self.bboxes_df['class_name']==class_name)\
-            & (self.bboxes_df['registered_idx']==registered_idx)\
-            & (self.bboxes_df['object_description']==object_description)
-        previous_registered_df = self.bboxes_df[previous_registered_bbox_filter_condition]
+        previous_registered_slots = self._find_slots(
+            class_name=class_name, registered_idx=registered_idx, object_description=object_description)
         
-        if len(previous_registered_df) != 0:
-            index = previous_registered_df.index
-            # почему-то иначе объект не изменяется
-            bbox = previous_registered_df['bbox'].iloc[0]
+        self._own_columns()
+        if len(previous_registered_slots) != 0:
+            bbox = self._bboxes[previous_registered_slots[0]]
+            self.preserve_bbox(bbox)
             bbox.registered_idx = -1
             bbox.displaying_type = 'auto'
             bbox.object_description = ''
             bbox.color = (0, 0, 0)
             bbox.tracker_type = 'auto'
 
-            self.bboxes_df.loc[index, 'bbox'] = bbox
-            
-            self.bboxes_df.loc[index, 'registered_idx'] = -1
-            self.bboxes_df.loc[index, 'object_description'] = ''
+            for slot in previous_registered_slots:
+                self._bboxes[slot] = bbox
+                self._set_row_attrs(slot, registered_idx=-1, object_description='')
         
         # обновляем на актуальную информацию
-        index = filtered_df.index
-        # почему-то иначе объъект не изменяется
-        bbox = filtered_df['bbox'].iloc[0]
+        slot = found_slots[0]
+        bbox = self._bboxes[slot]
+        self.preserve_bbox(bbox)
         bbox.registered_idx = registered_idx
         bbox.displaying_type = 'registered'
         bbox.color = (0, 255, 0)
-        bbox.object_description = object_description
+        bbox.update_object_description(object_description)
+        object_description = bbox.object_description
         bbox.tracker_type = 'auto'
-        self.bboxes_df.loc[index, 'bbox'] = bbox
-        
-        self.bboxes_df.loc[index, 'registered_idx'] = registered_idx
-        self.bboxes_df.loc[index, 'object_description'] = object_description
+        self._set_row_attrs(slot, registered_idx=registered_idx, object_description=object_description)
        
     def iter_bboxes(self):
         '''
         реализация итерирования по рамкам
         '''
-        # рамки д.б. отсортированы в убывающем порядке, чтобы рамки с registered_idx=-1 были внизу
-        # М.б. надо переместить сортировку в какое-то другое место
-        for idx, row in self.bboxes_df.sort_values(by='registered_idx', ascending=False).iterrows():
-            yield row['bbox']
+        # рамки д.б. отсортированы в убывающем порядке, чтобы рамки с registered_idx=-1 были внизу.
+        # Порядок поддерживается контейнером, поэтому здесь только проход по готовому списку
+        if self._render_order is None:
+            self._rebuild_render_order()
+        render_order = self._render_order
+        for _, slot in render_order:
+            yield self._bbox_at(slot)
+
+    def find_bbox_under_cursor(self, x, y, corner_radius=None):
+        '''
+        Поиск самой верхней (т.е. первой в порядке iter_bboxes) рамки под курсором.
+        Если задан corner_radius, то рамка также считается найденной, если курсор находится рядом с ее углом.
+        Возвращает кортеж (рамка, угол), где угол - координаты угла рядом с курсором или None,
+        если курсор внутри рамки. Если рамки под курсором нет, возвращается (None, None)
+        '''
+        margin = 0 if corner_radius is None else corner_radius
+        if self._hit_grid is None or self._hit_grid_version != self._version or self._hit_grid_margin < margin:
+            self._rebuild_hit_grid(margin)
+        cell_size = self._hit_grid_cell_size
+        candidates = self._hit_grid.get((int(x // cell_size), int(y // cell_size)), ())
+
+        found_key = None
+        found = (None, None)
+        for slot in candidates:
+            # ключ порядка отрисовки: чем он меньше, тем выше рамка
+            key = (-int(self._registered_idx[slot]), slot)
+            if found_key is not None and key > found_key:
+                continue
+            bbox = self._bbox_at(slot)
+            x0, y0, x1, y1 = bbox.coords
+            corner = None
+            if corner_radius is not None:
+                corner = find_cursor_corner(x0, y0, x1, y1, x, y, corner_radius)
+            if corner is not None or check_cursor_in_bbox(x0, y0, x1, y1, x, y):
+                found_key = key
+                found = (bbox, corner)
+        return found
+
+    def snapshot(self):
+        '''
+        Снимок текущего состояния контейнера (только для чтения).
+        Снимок создается за O(1): колонки разделяются с контейнером и копируются только при его изменении,
+        а рамки копируются только перед первым изменением после создания снимка (см. preserve_bbox)
+        '''
+        return BboxesSnapshot(self)
 
     def __repr__(self):
         return f'{self.bboxes_df}'
         
     def __len__(self):
-        return len(self.bboxes_df)
+        return self._live_num
+
+class BboxesSnapshot(BboxesContainer):
+    '''
+    Версионированный снимок BboxesContainer с копированием при записи.
+    Используется для хранения состояния рамок до коррекций (нужно для логгирования)
+    '''
+    def __init__(self, container) -> None:
+        # версия контейнера, с которой снят снимок
+        self.version = container._version
+
+        self.registered_objects_store = container.registered_objects_store
+
+        # колонки разделяются с контейнером
+        container._columns_shared = True
+        self._columns_shared = True
+        self._class_names = container._class_names
+        self._descriptions = container._descriptions
+        self._auto_idx = container._auto_idx
+        self._registered_idx = container._registered_idx
+        self._bboxes = container._bboxes
+        self._updated_generation = container._updated_generation
+        self._alive = container._alive
+        self._coords = container._coords
+        self._size = container._size
+        self._live_num = container._live_num
+        self._frame_generation = container._frame_generation
+
+        # индексы, порядок отрисовки и сетка поиска рамок строятся при первом обращении
+        self._render_order = None
+        self._hit_grid = None
+        self._hit_grid_version = -1
+        self._hit_grid_margin = 0
+        self._hit_grid_cell_size = self.HIT_GRID_MIN_CELL_SIZE
+        self._key_index = None
+        self._auto_index = None
+        self._registered_index = None
+
+        self._version = container._version
+        self._df_cache = None
+        self._df_cache_version = -1
+
+        # копии рамок, измененных после создания снимка: id(рамки) -> копия.
+        # Заполняется контейнером (BboxesContainer.preserve_bbox) перед изменением рамки
+        self._preserved_bboxes = {}
+        # снимок неизменяем, поэтому его собственных снимков нет
+        self._snapshots = weakref.WeakSet()
+        container._snapshots.add(self)
+
+    def snapshot(self):
+        return self
+
+    def preserve_bbox(self, bbox):
+        pass
+
+    def _own_columns(self):
+        raise TypeError('BboxesSnapshot is read-only')
+
+    def reset_tracking_objects_table(self):
+        raise TypeError('BboxesSnapshot is read-only')
+
+    def _bbox_at(self, slot):
+        bbox = self._bboxes[slot]
+        return self._preserved_bboxes.get(id(bbox), bbox)
+
+    def _find_slots(self, *args, **kwargs):
+        if self._key_index is None:
+            self._rebuild_indexes()
+        return super()._find_slots(*args, **kwargs)
 
 if __name__ == '__main__':
     # Первая итерация новые рамки, полученные от "нейронки"
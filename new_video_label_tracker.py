@@ -11,10 +11,6 @@ import os
 import glob
 import json
 
-import pandas as pd
-
-from copy import deepcopy
-
 import numpy as np
 
 import shutil
@@ -22,7 +18,9 @@ import shutil
 import time
 import torch
 
-from new_opencv_frames import BboxFrameTracker, Bbox, BboxesContainer, process_box_coords, xywh2xyxy, compute_bbox_area, compute_iou
+from new_opencv_frames import BboxFrameTracker, BboxesContainer, RegisteredObjectsDB, process_box_coords, xywh2xyxy, compute_bbox_area, compute_iou, compute_iou_matrix, bboxes_to_coords_array
+from new_video_source import open_video_source
+from new_detection_cache import DetectionCache, get_detection_cache_path
 
 from ultralytics import YOLO
 
@@ -934,12 +932,16 @@ class TrackerWindow(QMainWindow):
         self.bboxes_container_after_corrections = None
 
     def set_all_params_to_default(self):
-        # объект для перехода между кадрами видео и чтения кадров
-        self.video_capture = None
+        # источник кадров видео (VideoFrameSource), отвечающий за переходы между кадрами и их чтение
+        self.video_source = None
         # путь до папки, где хранится видео и папка, куда записываются рамки
         self.path_to_labelling_folder = None
         self.paths_to_labels_list = []
         self.path_to_video = None
+        # результаты предварительного прогона детектора по всему видео (DetectionCache), если они есть
+        self.detection_cache = None
+        # взяты ли рамки последнего прочитанного кадра из detection_cache (None - кадр еще не читался)
+        self.is_last_frame_from_detection_cache = None
         self.window_name = None
         self.frame_with_boxes = None
         self.img_rows = None
@@ -967,7 +969,7 @@ class TrackerWindow(QMainWindow):
                 return
             self.alternative_tracker_type = select_alt_tracker_dialog.current_item
             self.current_alternative_tracker_label.setText(f'Текущий доп. трэкер: {self.alternative_tracker_type}')
-            if self.video_capture is None:
+            if self.video_source is None:
                 return
             else:
                 ret = show_info_message_box(
@@ -997,7 +999,7 @@ class TrackerWindow(QMainWindow):
                 return
             self.tracker_type = f'{select_detector_dialog.current_item}.pt'
             self.current_detector_label.setText(f'Текущий НС детектор: {self.tracker_type.split(".")[0]}')
-            if self.video_capture is None:
+            if self.video_source is None:
                 return
             else:
                 ret = show_info_message_box(
@@ -1012,6 +1014,7 @@ class TrackerWindow(QMainWindow):
                     self.unselect_all_table_items()
                     self.set_tracking_params_to_default()
                     self.reset_tracker()
+                    self.load_detection_cache()
                     #!!!!!
                     self.frame_with_boxes.bboxes_container.unregister_all_bboxes() 
                     self.update_objects_descr_table()
@@ -1022,7 +1025,7 @@ class TrackerWindow(QMainWindow):
         # Вызов диалогового окна, куда передается self.frame_number
         #self.frame_number
         #self.
-        if self.video_capture is None:
+        if self.video_source is None:
             return
         ret = show_info_message_box(
             'Внимание!',
@@ -1040,6 +1043,8 @@ class TrackerWindow(QMainWindow):
             return
         
         self.current_frame_idx = set_frame_dialog.frame_idx
+        # прочитанные заранее кадры больше не нужны, упреждающее чтение начинается с нового кадра
+        self.video_source.invalidate(self.current_frame_idx)
 
         self.unselect_all_table_items()
         self.set_tracking_params_to_default()
@@ -1066,7 +1071,7 @@ class TrackerWindow(QMainWindow):
         self.frame_with_boxes.bboxes_container.change_bboxes_displaying_type(displaying_type='registered')
 
     def cancell_register_objects_button_handling(self):
-        if self.video_capture is None:
+        if self.video_source is None:
             return
         
         ret = show_info_message_box(
@@ -1109,7 +1114,7 @@ class TrackerWindow(QMainWindow):
         Обработчик кнопки ассоциирования автоматически сгененрированных рамок и 
         '''
         self.is_autoplay = False
-        if self.video_capture is None:
+        if self.video_source is None:
             return
         
         associate_auto_bboxes_dialog = AssociateRegisteredAndAutoBboxesDialog(
@@ -1160,7 +1165,7 @@ class TrackerWindow(QMainWindow):
         Обработчик кнопки удаления нового объекта
         '''
         self.is_autoplay = False
-        if self.video_capture is None:
+        if self.video_source is None:
             return
         
         delete_registered_dialog = DeleteTrackingObjectsDialog(
@@ -1187,7 +1192,7 @@ class TrackerWindow(QMainWindow):
         Обработчик кнопки регистрации нового объекта
         '''
         self.is_autoplay = False
-        if self.video_capture is None:
+        if self.video_source is None:
             return
 
         # вызов диалогового окна позволяет изменить имя класса всего для одной рамки
@@ -1301,9 +1306,9 @@ class TrackerWindow(QMainWindow):
             # если имя класса не выбрано, то надо рисовать заново
             return
         
-        manually_created_bbox.class_name = current_class_name
+        manually_created_bbox.update_class_name(current_class_name)
         manually_created_bbox.registered_idx = current_registered_idx
-        manually_created_bbox.object_description = current_object_descr
+        manually_created_bbox.update_object_description(current_object_descr)
         manually_created_bbox.color = (0, 255, 0)
         manually_created_bbox.displaying_type = 'registered'
         if self.disable_alt_tracking.isChecked():
@@ -1374,6 +1379,9 @@ class TrackerWindow(QMainWindow):
 
         # закрываем поток, который отображает кадры видео
         self.close_imshow_thread()
+        # сохраняем БД отслеживаемых объектов
+        self.close_tracking_objects_db()
+        self.close_video_source()
         # обнуляем все праметры
         self.set_all_params_to_default()
         # обновляем трекер
@@ -1416,17 +1424,42 @@ class TrackerWindow(QMainWindow):
         '''
         name = '.'.join(name.split('.')[:-1])
         path_to_db = os.path.join(path_to_dir, f'{name}.csv')
-        if os.path.isfile(path_to_db):
-            database = pd.read_csv(path_to_db)
-            database = database.fillna(value='')
-        else:
-            database = pd.DataFrame(columns=['object_idx', 'class_name', 'object_description'])
-            database.to_csv(path_to_db, index=False)
-        return database
+        return RegisteredObjectsDB.read_csv(path_to_db)
+
+    def close_tracking_objects_db(self):
+        '''
+        Закрытие БД отслеживаемых объектов: журнал изменений переносится в csv файл
+        '''
+        if self.frame_with_boxes is not None:
+            self.frame_with_boxes.bboxes_container.registered_objects_store.close()
+
+    def close_video_source(self):
+        '''
+        Закрытие источника кадров видео и остановка потока упреждающего чтения
+        '''
+        if self.video_source is not None:
+            self.video_source.release()
+
+    def load_detection_cache(self):
+        '''
+        Загрузка результатов предварительного прогона текущего детектора (см. new_detection_cache.py).
+        Файл лежит рядом с папкой _labels; если его нет, детектор запускается на каждом кадре
+        '''
+        self.detection_cache = None
+        self.is_last_frame_from_detection_cache = None
+        if self.path_to_video is None or not self.settings_dict.get('use_detection_cache', False):
+            return
+        path_to_detection_cache = get_detection_cache_path(self.path_to_video, self.tracker_type)
+        self.detection_cache = DetectionCache.load_or_none(path_to_detection_cache, self.path_to_video)
+        if self.detection_cache is not None:
+            print(f'Detections for {len(self.detection_cache)} frames are loaded from {path_to_detection_cache}')
         
     def open_file_handling(self):
         # закрываем поток, который отображает кадры видео
         self.close_imshow_thread()
+        # сохраняем БД отслеживаемых объектов
+        self.close_tracking_objects_db()
+        self.close_video_source()
         # обнуляем все праметры
         self.set_all_params_to_default()
         # обновляем трекер
@@ -1463,6 +1496,8 @@ class TrackerWindow(QMainWindow):
         # читаем базу данных с объектами, которые надо отслеживать
         registered_objects_db = self.read_tracking_objects_db(path_to_folder, name)
 
+        self.path_to_video = path
+
         # формируем путь до папки, куда будут сохраняться рамки
         label_folder_name = '.'.join(name.split('.')[:-1]) + '_labels'
         self.path_to_labelling_folder = os.path.join(path_to_folder, label_folder_name)
@@ -1475,14 +1510,23 @@ class TrackerWindow(QMainWindow):
             # содаем папку, куда будем сохранять рамки
             os.mkdir(self.path_to_labelling_folder)
 
-        # создаем объект opencv для чтения видео
-        self.video_capture = cv2.VideoCapture(path)
-        ret, frame = self.video_capture.read()
+        # создаем источник кадров видео. Глубина упреждающего чтения кадров, объем кэша
+        # недавно показанных кадров и использование индекса ключевых кадров задаются в settings.json.
+        # Индекс кадров строится в фоне при первом открытии видео и сохраняется рядом с папкой _labels.
+        # Хранилище декодированных кадров для трекинга всегда хранит кадры в исходном разрешении
+        self.video_source = open_video_source(
+            path,
+            prefetch_depth=self.settings_dict.get('prefetch_depth', 0),
+            history_cache_mb=self.settings_dict.get('history_cache_mb', 0),
+            use_frame_index=self.settings_dict.get('use_frame_index', False),
+            frame_store_mb=self.settings_dict.get('frame_store_mb', 0))
+        ret, frame_buffer = self.video_source.read_buffer(0)
         if not ret:
             raise RuntimeError(f'Can not read {path} video')
+        frame = frame_buffer.array
         
         # выясняем количество кадров
-        self.frame_number = int(self.video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.frame_number = self.video_source.frame_number
 
         # отображаем общее количество кадров на специальном индикаторе
         self.all_frames_display.display(self.frame_number)
@@ -1490,6 +1534,9 @@ class TrackerWindow(QMainWindow):
         # выясняем размер (кол-во строк и столбцов) кадра
         self.img_rows, self.img_cols = frame.shape[:2]
 
+        # результаты предварительного прогона детектора, если он выполнялся для этого видео
+        self.load_detection_cache()
+
         # выставляем счетчик кадров: если уже были сформированы рамки, то счетчик кадров делаем равным номеру последнего кадра 
         if len(self.paths_to_labels_list) > 0:
             self.current_frame_idx = len(self.paths_to_labels_list) - 1
@@ -1500,14 +1547,20 @@ class TrackerWindow(QMainWindow):
         self.window_name = name
         
         # создаем объект BboxFrameTracker, позволяющий отображать и изменять локализационные рамки на кадре видео
-        self.frame_with_boxes = BboxFrameTracker(img=frame, registered_objects_db=registered_objects_db)
+        # способ отрисовки рамок задается в settings.json ('pil' или 'opencv')
+        renderer_backend = self.settings_dict.get('renderer_backend', 'pil')
+        # кадр передается без копирования, ссылку на его буфер забирает BboxFrameTracker
+        self.frame_with_boxes = BboxFrameTracker(
+            img=frame_buffer, registered_objects_db=registered_objects_db, renderer_backend=renderer_backend)
+        # кадры, которые больше экрана, отображаются в разрешении экрана
+        self.frame_with_boxes.set_max_display_size(self.screen_width, self.screen_height)
 
         # обновляем таблицу, где отображены все отслеживаемые объекты
         self.update_objects_descr_table()
 
         # Параметры для логгирования изменений рамок
-        self.bboxes_container_berfore_corrections = deepcopy(self.frame_with_boxes.bboxes_container)
-        self.bboxes_container_after_corrections = deepcopy(self.frame_with_boxes.bboxes_container)
+        self.bboxes_container_berfore_corrections = self.frame_with_boxes.bboxes_container.snapshot()
+        self.bboxes_container_after_corrections = BboxesContainer(registered_objects_db)
         
         # Подготавливаем и запускаем отдельный поток, в котором будет отображаться кадр с рамками
         # и будут изменяться рамки
@@ -1538,6 +1591,21 @@ class TrackerWindow(QMainWindow):
 
 
 
+    def get_auto_bboxes_sorted_by_iou(self, auto_bboxes_df, iou_row, class_name, registered_idx):
+        '''
+        Выбор автоматических рамок того же класса, отсортированных по убыванию IoU
+        auto_bboxes_df - таблица автоматических рамок до коррекций
+        iou_row - строка матрицы IoU текущей рамки со всеми рамками auto_bboxes_df
+        '''
+        # на всякий случай исключим также рамки с тем же зарегистрированным индексом
+        filter_condition = (auto_bboxes_df['class_name'] == class_name).values\
+            & (auto_bboxes_df['registered_idx'] != registered_idx).values
+        same_class_df = auto_bboxes_df[filter_condition].copy()
+        # добавляем колонку с IoU
+        same_class_df['iou'] = iou_row[filter_condition]
+        # сортируем по убыванию IoU
+        return same_class_df.sort_values(by='iou', ascending=False)
+
     def analyze_labelling_result(self):
         logging_dict = {}
 
@@ -1548,8 +1616,14 @@ class TrackerWindow(QMainWindow):
         # Ищем только зарегистрированные рамки 
         filter_condition = (updated_bboxes_container.bboxes_df['registered_idx'] != -1) #& updated_bboxes_container.bboxes_df['bbox'].apply(lambda bbox: bbox.tracker_type != 'no')
         registered_objects_df = updated_bboxes_container.bboxes_df[filter_condition]
+
+        # Вычисляем сразу всю матрицу IoU между зарегистрированными рамками и автоматическими рамками до правок
+        auto_bboxes_before_corrections_df = self.bboxes_container_berfore_corrections.find_bbox_by_attributes(tracker_type='auto')
+        iou_matrix = compute_iou_matrix(
+            bboxes_to_coords_array(registered_objects_df['bbox']),
+            bboxes_to_coords_array(auto_bboxes_before_corrections_df['bbox']))
         
-        for index, row in registered_objects_df.iterrows():
+        for row_position, (index, row) in enumerate(registered_objects_df.iterrows()):
             bbox = row['bbox']
             class_name = row['class_name']
             auto_idx = row['auto_idx']
@@ -1620,17 +1694,9 @@ class TrackerWindow(QMainWindow):
                         continue
                         
                 # Ищем автоматические рамки по IoU
-                all_auto_bboxes_same_class_df = self.bboxes_container_berfore_corrections.find_bbox_by_attributes(
-                    class_name=class_name, tracker_type='auto')
-                
-                # на всякий случай исключим также рамки с тем же зарегистрированным индексом
-                all_auto_bboxes_same_class_df = all_auto_bboxes_same_class_df[
-                    all_auto_bboxes_same_class_df['registered_idx']!=registered_idx]
+                all_auto_bboxes_same_class_df = self.get_auto_bboxes_sorted_by_iou(
+                    auto_bboxes_before_corrections_df, iou_matrix[row_position], class_name, registered_idx)
                 if len(all_auto_bboxes_same_class_df) != 0:
-                    # добавляем колонку с IoU
-                    all_auto_bboxes_same_class_df.loc[:, 'iou'] = all_auto_bboxes_same_class_df['bbox'].apply(lambda x:compute_iou(x.coords, bbox.coords))
-                    # сортируем по убыванию IoU
-                    all_auto_bboxes_same_class_df = all_auto_bboxes_same_class_df.sort_values(by='iou', ascending=False)
 
                     # запускаем диалоговое окно, чтобы подтвердить ближайшее IoU
                     nearest_bbox = all_auto_bboxes_same_class_df.iloc[0]['bbox']
@@ -1706,17 +1772,9 @@ class TrackerWindow(QMainWindow):
                     self.append_bbox_to_logging_dict(logging_dict, bbox, prev_bbox)
                 
                 # Ищем автоматические рамки по IoU
-                all_auto_bboxes_same_class_df = self.bboxes_container_berfore_corrections.find_bbox_by_attributes(
-                    class_name=class_name, tracker_type='auto')
-                
-                # на всякий случай исключим также рамки с тем же зарегистрированным индексом
-                all_auto_bboxes_same_class_df = all_auto_bboxes_same_class_df[
-                    all_auto_bboxes_same_class_df['registered_idx']!=registered_idx]
+                all_auto_bboxes_same_class_df = self.get_auto_bboxes_sorted_by_iou(
+                    auto_bboxes_before_corrections_df, iou_matrix[row_position], class_name, registered_idx)
                 if len(all_auto_bboxes_same_class_df) != 0:
-                    # добавляем колонку с IoU
-                    all_auto_bboxes_same_class_df.loc[:, 'iou'] = all_auto_bboxes_same_class_df['bbox'].apply(lambda x:compute_iou(x.coords, bbox.coords))
-                    # сортируем по убыванию IoU
-                    all_auto_bboxes_same_class_df = all_auto_bboxes_same_class_df.sort_values(by='iou', ascending=False)
 
                     # запускаем диалоговое окно, чтобы подтвердить ближайшее IoU
                     nearest_bbox = all_auto_bboxes_same_class_df.iloc[0]['bbox']
@@ -1829,7 +1887,7 @@ class TrackerWindow(QMainWindow):
 
 
     def next_frame_button_handling(self):
-        if self.video_capture is None or self.frame_with_boxes is None:
+        if self.video_source is None or self.frame_with_boxes is None:
             self.is_autoplay = False    
             if self.imshow_thread.isRunning():
                 self.stop_imshow_thread()
@@ -1860,7 +1918,7 @@ class TrackerWindow(QMainWindow):
         return
 
     def previous_frame_button_handling(self):
-        if self.video_capture is None or self.frame_with_boxes is None:
+        if self.video_source is None or self.frame_with_boxes is None:
             self.is_autoplay = False
             if self.imshow_thread.isRunning():
                 self.stop_imshow_thread()
@@ -1928,6 +1986,7 @@ class TrackerWindow(QMainWindow):
                 # если с рамкой произошла какая-то беда, то оставляем предыдущие координаты
                 new_coords = xywh2xyxy(*bbox_coords)
 
+            self.frame_with_boxes.bboxes_container.preserve_bbox(bbox)
             bbox.coords = new_coords
             self.frame_with_boxes.bboxes_container.update_existing_bbox_coords(index, bbox)
     
@@ -1946,7 +2005,7 @@ class TrackerWindow(QMainWindow):
     def read_frame(self):
         # проверка условий возможности чтения кадра: отсутствие объекта, отвечающего за чтение кадров видео
         # или номер текущего кадра превышает количество кадров в видео
-        if self.video_capture is None or self.current_frame_idx >= self.frame_number:
+        if self.video_source is None or self.current_frame_idx >= self.frame_number:
             return
         
         if self.current_frame_idx < 0:
@@ -1955,32 +2014,52 @@ class TrackerWindow(QMainWindow):
         
         if self.is_logging_checkbox.isChecked():
             # Очищаем bboxes_container_before_corrections и bboxes_container_after_corrections
-            registered_objects_db = self.frame_with_boxes.bboxes_container.registered_objects_db
+            registered_objects_db = self.frame_with_boxes.bboxes_container.registered_objects_store
             self.bboxes_container_berfore_corrections = BboxesContainer(registered_objects_db)
             self.bboxes_container_after_corrections = BboxesContainer(registered_objects_db)
 
         # устанавливаем значение дисплея, отображающего счетчик кадров
         self.set_display_value(self.current_frame_idx)
         
-        # выставляем в объекте чтения кадров позицию текущего кадра, чтобы иметь возможность двигаться не только вперед, но и назад
-        self.video_capture.set(cv2.CAP_PROP_POS_FRAMES, self.current_frame_idx)
-        # читаем текущий кадр
-        ret, frame = self.video_capture.read()
+        # читаем текущий кадр: следующий по порядку кадр декодируется последовательно,
+        # перемотка выполняется только при переходе назад или через несколько кадров
+        ret, frame_buffer = self.video_source.read_buffer(self.current_frame_idx)
 
         if ret:
+            # кадр доступен только для чтения и передается трекерам и потоку отображения без копирования:
+            # ссылку на его буфер забирает BboxFrameTracker, массив кадра действителен до следующей смены кадра
+            frame = frame_buffer.array
             # обновляем отображаемые на видео рамки
-            self.frame_with_boxes.update_img(frame)
+            self.frame_with_boxes.update_img(frame_buffer)
             
-            # выполняем трекинг
-            try:
-                yolo_predicted_bboxes_container = self.tracker.track(
-                    bboxes_container=self.frame_with_boxes.bboxes_container,
-                    source=frame,
-                    persist=True,
-                    verbose=True
-                    )
-            except:
-                yolo_predicted_bboxes_container = self.frame_with_boxes.bboxes_container            
+            # выполняем трекинг: если детектор уже прогонялся по видео, рамки берутся из сохраненных результатов
+            is_frame_from_detection_cache = \
+                self.detection_cache is not None and self.detection_cache.has_frame(self.current_frame_idx)
+            if self.is_last_frame_from_detection_cache is not None and \
+                    is_frame_from_detection_cache != self.is_last_frame_from_detection_cache:
+                # трекер не видел кадров, рамки которых взяты из кэша, поэтому при переходе
+                # между кэшем и трекером он начинает заново. Рамки, которые не найдены на новом кадре,
+                # как обычно пропадают в check_updated_bboxes
+                self.reset_tracker()
+            self.is_last_frame_from_detection_cache = is_frame_from_detection_cache
+
+            if is_frame_from_detection_cache:
+                yolo_predicted_bboxes_container = self.detection_cache.ingest_frame(
+                    self.frame_with_boxes.bboxes_container, self.current_frame_idx, self.img_rows, self.img_cols)
+            else:
+                # индексы объектов трекера сдвигаются за индексы из кэша: иначе рамка зарегистрированного объекта
+                # могла бы перейти на другой объект с тем же индексом
+                id_offset = 0 if self.detection_cache is None else self.detection_cache.max_id + 1
+                try:
+                    yolo_predicted_bboxes_container = self.tracker.track(
+                        bboxes_container=self.frame_with_boxes.bboxes_container,
+                        source=frame,
+                        persist=True,
+                        verbose=True,
+                        id_offset=id_offset
+                        )
+                except:
+                    yolo_predicted_bboxes_container = self.frame_with_boxes.bboxes_container            
    
             # присваиваем объекту, обрабатывающему кадр с рамками, полученный из yolo bboxes_container
             self.frame_with_boxes.bboxes_container = yolo_predicted_bboxes_container
@@ -1994,21 +2073,9 @@ class TrackerWindow(QMainWindow):
             if self.is_logging_checkbox.isChecked():
                 if len(self.bboxes_container_berfore_corrections) == 0:
                     # если до этого момента в bboxes_container_berfore_corrections,
-                    # то сохраняем текущее состояние рамок как состояние до коррекций
-                    
-                    # КОСТЫЛЬ!!!!111111
-                    # Приходится копировать каждую рамку, иначе сслыки на объекты класса Bbox,
-                    # хранящиеся в DataFrame при deepcopy не отвязываются(((
-                    lst = []
-                    for _, row in self.frame_with_boxes.bboxes_container.bboxes_df.iterrows():
-                        new_row = row.copy(deep=True)
-                        bbox = row['bbox']
-                        #new_row['bbox'] = None
-                        new_row['bbox'] = deepcopy(bbox)
-                        lst.append(new_row)
-
-                    self.bboxes_container_berfore_corrections.bboxes_df = pd.DataFrame(lst)
-                    ########################################################
+                    # то сохраняем текущее состояние рамок как состояние до коррекций.
+                    # Снимок копирует рамки только при их последующем изменении
+                    self.bboxes_container_berfore_corrections = self.frame_with_boxes.bboxes_container.snapshot()
             
     def check_registered_in_disappeared_bboxes(self, disappeared_bboxes):
         '''
@@ -2030,19 +2097,7 @@ class TrackerWindow(QMainWindow):
         
         if self.is_logging_checkbox.isChecked():
             # Если в пропавших рамках есть зарегистрированные, то надо сохранить состояние до коррекций
-            #self.bboxes_container_berfore_corrections.bboxes_df = self.frame_with_boxes.bboxes_container.bboxes_df.copy(deep=True)
-            # КОСТЫЛЬ!!!!111111
-            # Приходится копировать каждую рамку, иначе сслыки на объекты класса Bbox,
-            # хранящиеся в DataFrame при deepcopy не отвязываются(((
-            lst = []
-            for _, row in self.frame_with_boxes.bboxes_container.bboxes_df.iterrows():
-                new_row = row.copy(deep=True)
-                bbox = row['bbox']
-                #new_row['bbox'] = None
-                new_row['bbox'] = deepcopy(bbox)
-                lst.append(new_row)
-            self.bboxes_container_berfore_corrections.bboxes_df = pd.DataFrame(lst)
-            ########################################################
+            self.bboxes_container_berfore_corrections = self.frame_with_boxes.bboxes_container.snapshot()
 
         for _, row in registered_bboxes_df.iterrows():
             bbox = row['bbox']
@@ -2100,12 +2155,14 @@ class TrackerWindow(QMainWindow):
 
                 self.frame_with_boxes.bboxes_container.update_bbox(disappeared_bbox)
                 
-                # читаем предыдущий кадр, т.к. рамка есть только для объекта на предыдущем кадре, а его положение могло измениться
-                self.video_capture.set(cv2.CAP_PROP_POS_FRAMES, self.current_frame_idx-1)
-                _, prev_frame = self.video_capture.read()
-                self.video_capture.set(cv2.CAP_PROP_POS_FRAMES, self.current_frame_idx)
+                # читаем предыдущий кадр, т.к. рамка есть только для объекта на предыдущем кадре, а его положение могло измениться.
+                # Предыдущий кадр обычно берется из кэша недавно показанных кадров без декодирования
+                ret, prev_frame_buffer = self.video_source.read_buffer(self.current_frame_idx-1)
+                prev_frame = prev_frame_buffer.array if ret else None
                 # инициализируем трекер
                 self.reinit_alternative_tracker_for_bbox(prev_frame, disappeared_bbox)
+                if ret:
+                    prev_frame_buffer.release()
 
                 if self.is_logging_checkbox.isChecked():
                     self.bboxes_container_after_corrections.update_bbox(disappeared_bbox)
@@ -2145,9 +2202,10 @@ class YoloTracker:
         self.name2class_idx = {val: key for key, val in self.tracker.names.items()}
 
 
-    def track(self, bboxes_container, *yolo_args, **yolo_kwargs):
+    def track(self, bboxes_container, *yolo_args, id_offset=0, **yolo_kwargs):
         '''
         target_class_name - имя класса, который мы собираемся детектировать
+        id_offset - сдвиг индексов объектов, присвоенных трекером
         Return: 
             bboxes_container - словарь, который хранит 
         '''
@@ -2157,7 +2215,7 @@ class YoloTracker:
         # получение координат рамок
         bboxes = results.boxes.xyxy.long().numpy()
         # получение индексов объектов
-        ids = results.boxes.id.long().numpy()
+        ids = results.boxes.id.long().numpy() + id_offset
         
         # получение списка детектированных классов
         detected_classes = [self.tracker.names[cls_idx] for cls_idx in results.boxes.cls.long().numpy()]
@@ -2168,28 +2226,10 @@ class YoloTracker:
         # этот параметр нужен, чтобы рамка строилась не впритык объекту, а захватывала еще некоторую дополнительную область
         bbox_append_value = int(min(img_rows, img_cols)*0.025)
 
-        for bbox, id, class_name in zip(bboxes, ids, detected_classes):
-            x0,y0,x1,y1 = bbox
-            # добавляем несколько пикселей, чтобы рамка строилась не впритык к объекту
-            x0,y0,x1,y1 = x0 - bbox_append_value, y0 - bbox_append_value, x1 + bbox_append_value, y1 + bbox_append_value
-            # делаем так, чтобы рамка не выходила за пределы кадра
-            x0,y0,x1,y1 = process_box_coords(x0,y0,x1,y1, img_rows, img_cols)
-            # пока что оставляем всего лишь один цвет - черный
-            color = (0,0,0)
-
-            bbox = Bbox(
-                x0, y0, x1, y1,
-                img_rows, img_cols,
-                class_name=class_name,
-                auto_idx=id,
-                registered_idx=-1,
-                object_description='',
-                color=color,
-                displaying_type='auto',
-                tracker_type='auto'
-                )            
-
-            bboxes_container.update_bbox(bbox)
+        # добавляем все рамки кадра в контейнер одним пакетом: расширение, обрезка по границам кадра
+        # и сопоставление с зарегистрированными рамками выполняются внутри контейнера
+        bboxes_container.ingest_detections(
+            bboxes, ids, detected_classes, img_rows, img_cols, bbox_append_value=bbox_append_value)
 
         return bboxes_container
 
@@ -2214,6 +2254,8 @@ class ImshowThread(QThread):
 
     def run(self):
         self.init_showing_window()
+        # версия отображаемого состояния, для которой кадр был отрисован последний раз
+        shown_render_version = None
         # почему-то работает только это условие...
         # потом надо переписать,
         while self.frame_with_boxes.img is not None:
@@ -2229,8 +2271,12 @@ class ImshowThread(QThread):
                 self.new_bbox_create_signal.emit()
                 self.frame_with_boxes.is_bbox_created = False
 
-            img_with_boxes = self.frame_with_boxes.render_boxes()
-            cv2.imshow(self.window_name, img_with_boxes)
+            # перерисовываем кадр только если что-то изменилось, иначе в окне остается последний отрисованный кадр
+            render_version = self.frame_with_boxes.render_version
+            if render_version != shown_render_version:
+                img_with_boxes = self.frame_with_boxes.render_boxes()
+                cv2.imshow(self.window_name, img_with_boxes)
+                shown_render_version = render_version
             
             key = cv2.waitKey(20)
 
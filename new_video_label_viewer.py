@@ -11,16 +11,131 @@ import json
 
 
 import time
+import threading
 
-from new_opencv_frames import BboxFrame, Bbox, BboxFrameTracker, compute_iou
+from new_opencv_frames import Bbox, BboxFrameTracker, BboxesContainer, RegisteredObjectsDB
 
 from new_video_label_tracker import ImshowThread, SetFrameIdxDialog
+from new_video_source import open_video_source, get_proxy_path, is_proxy_fresh, transcode_proxy
+
+class ProxyTranscodeThread(QThread):
+    '''
+    Перекодирование видео в прокси-видео в отдельном потоке.
+    Прогресс (в процентах) передается сигналом progress_signal, результат - сигналом transcode_finished_signal
+    '''
+    progress_signal = pyqtSignal(int)
+    transcode_finished_signal = pyqtSignal(bool)
+
+    def __init__(self, path_to_video, proxy_path, max_width, max_height, parent=None):
+        super().__init__(parent)
+        self.path_to_video = path_to_video
+        self.proxy_path = proxy_path
+        self.max_width = max_width
+        self.max_height = max_height
+        self.stop_event = threading.Event()
+
+    def run(self):
+        is_completed = transcode_proxy(
+            self.path_to_video, self.proxy_path, self.max_width, self.max_height,
+            progress_callback=self.progress_signal.emit, stop_event=self.stop_event)
+        self.transcode_finished_signal.emit(is_completed)
+
+    def stop(self):
+        self.stop_event.set()
+        self.wait()
+
+class SeekSchedulerThread(QThread):
+    '''
+    Планировщик переходов по кадрам. Запросы (например, от слайдера) не выполняются по очереди: поток всегда
+    читает последний запрошенный кадр, а запросы, которые устарели до начала чтения, пропускаются.
+    Кадр, который устарел, пока декодировался, не передается. Пока нужный кадр декодируется,
+    сигналом preview_ready_signal передается ближайший уже прочитанный кадр (из кэша, хранилища или упреждающего чтения).
+    Все чтения источника кадров выполняются под блокировкой, поэтому источник можно читать и напрямую через read_now
+    '''
+    # (номер запроса, индекс кадра, буфер кадра)
+    frame_ready_signal = pyqtSignal(int, int, object)
+    preview_ready_signal = pyqtSignal(int, int, object)
+
+    def __init__(self, video_source, parent=None):
+        super().__init__(parent)
+        self.video_source = video_source
+        self._condition = threading.Condition()
+        self._source_lock = threading.Lock()
+        # последний запрошенный и еще не взятый в работу кадр
+        self._requested_frame_idx = None
+        # номер последнего запроса; результаты более ранних запросов устарели
+        self._request_version = 0
+        self._is_stopped = False
+
+    def request(self, frame_idx):
+        '''
+        Асинхронный запрос кадра: заменяет запрос, который еще не взят в работу
+        '''
+        with self._condition:
+            self._requested_frame_idx = frame_idx
+            self._request_version += 1
+            self._condition.notify_all()
+
+    def is_latest(self, request_version):
+        with self._condition:
+            return request_version == self._request_version
+
+    def read_now(self, frame_idx):
+        '''
+        Синхронное чтение кадра (шаги вперед-назад и переход на заданный кадр). Отменяет асинхронные запросы
+        '''
+        with self._condition:
+            self._requested_frame_idx = None
+            self._request_version += 1
+        with self._source_lock:
+            return self.video_source.read_buffer(frame_idx)
+
+    def run(self):
+        while True:
+            with self._condition:
+                while not self._is_stopped and self._requested_frame_idx is None:
+                    self._condition.wait()
+                if self._is_stopped:
+                    return
+                frame_idx = self._requested_frame_idx
+                request_version = self._request_version
+                self._requested_frame_idx = None
+
+            with self._source_lock:
+                preview_idx, preview_buffer = self.video_source.peek_nearest(frame_idx)
+                if preview_idx == frame_idx:
+                    ret, frame_buffer = True, preview_buffer
+                else:
+                    if preview_buffer is not None:
+                        self.preview_ready_signal.emit(request_version, preview_idx, preview_buffer)
+                    ret, frame_buffer = self.video_source.read_buffer(frame_idx)
+
+            if not ret:
+                continue
+            if not self.is_latest(request_version):
+                # пока кадр декодировался, пришел новый запрос
+                frame_buffer.release()
+                continue
+            self.frame_ready_signal.emit(request_version, frame_idx, frame_buffer)
+
+    def stop(self):
+        with self._condition:
+            self._is_stopped = True
+            self._request_version += 1
+            self._condition.notify_all()
+        self.wait()
 
 class LabelViewerWindow(QMainWindow):
     def __init__(self, screen_width, screen_height):
         super().__init__()       
 
-        self.video_capture = None
+        self.video_source = None
+        # поток, создающий прокси-видео для быстрой навигации
+        self.proxy_thread = None
+        # поток, выполняющий переходы по кадрам
+        self.seek_scheduler = None
+        # кадр, рамки которого загружены в self.frame_with_boxes (при переходе слайдером он отстает от self.current_frame_idx)
+        self.displayed_frame_idx = None
         self.path_to_labelling_folder = None
         self.paths_to_labels_list = []
         self.path_to_video = None
@@ -56,6 +171,11 @@ class LabelViewerWindow(QMainWindow):
             self.settings_dict = json.load(fd)
 
         self.class_names_list = self.settings_dict['classes']
+
+        # список рамок видео ("имя класса,индекс объекта"); выделенные рамки отображаются
+        self.visible_classes_list_widget = QListWidget()
+        self.visible_classes_list_widget.setSelectionMode(QAbstractItemView.MultiSelection)
+        self.visible_classes_list_widget.itemSelectionChanged.connect(self.update_visible_classes_list)
         
         self.frame_display = QLCDNumber()
         go_to_frame_button = QPushButton('Go to Frame')
@@ -133,7 +253,7 @@ class LabelViewerWindow(QMainWindow):
         self.show()
 
     def set_frame(self):
-        if self.video_capture is None:
+        if self.video_source is None:
             return
         
         set_frame_dialog = SetFrameIdxDialog(self.frame_number)
@@ -204,26 +324,29 @@ class LabelViewerWindow(QMainWindow):
         self.show_or_hide(is_selected=False)
 
     def show_or_hide(self, is_selected):
-        # определяем количество элементов в списке
-        qlist_len = self.visible_classes_list_widget.count()
-        for item_idx in range(qlist_len):
-            class_name = self.visible_classes_list_widget.item(item_idx).data(0)
-            for bbox_name, bbox in self.frame_with_boxes.bboxes_dict.items():
-                if bbox_name == class_name:
-                    self.frame_with_boxes.bboxes_dict[bbox_name].is_visible = is_selected
-                    self.visible_classes_list_widget.item(item_idx).setSelected(is_selected)
-                    break
+        # выделение меняется без сигналов, а рамки обновляются один раз в конце
+        self.visible_classes_list_widget.blockSignals(True)
+        for item_idx in range(self.visible_classes_list_widget.count()):
+            self.visible_classes_list_widget.item(item_idx).setSelected(is_selected)
+        self.visible_classes_list_widget.blockSignals(False)
+        self.update_visible_classes_list()
 
 
     def display_frame_position(self, current_frame_idx):
-        if self.video_capture is None or self.frame_with_boxes is None:
+        if self.video_source is None or self.frame_with_boxes is None:
             if self.imshow_thread.isRunning():
-                self.stop_imshow_thread()
+                self.close_imshow_thread()
             return
         
         self.frame_display.display(current_frame_idx)
+        if current_frame_idx == self.current_frame_idx:
+            return
+        if current_frame_idx != self.current_frame_idx + 1:
+            # переход слайдером: прочитанные заранее кадры больше не нужны
+            self.video_source.invalidate(current_frame_idx)
         self.current_frame_idx = current_frame_idx
-        self.read_frame()
+        # при перетаскивании слайдера запросы объединяются: читается только последний запрошенный кадр
+        self.seek_scheduler.request(current_frame_idx)
 
     def autosave_current_checkbox_slot(self):
         '''
@@ -239,50 +362,52 @@ class LabelViewerWindow(QMainWindow):
         self.imshow_thread = ImshowThread()
         self.imshow_thread.bboxes_update_signal.connect(self.update_visible_classes_list)
 
-    def load_labels_from_file(self):
+    def load_labels_from_file(self, frame_idx):
         '''
-        Загружаем из txt-файлов координаты рамок и информацию о классах. 
-        Информация загружается в self.frame_with_boxes, 
+        Загружаем из json-файла кадра frame_idx координаты рамок и информацию о классах. 
+        Рамки предыдущего кадра заменяются новыми, скрытые в self.visible_classes_list_widget рамки не отображаются.
         self.visible_classes_list_widget не изменяется
         '''
-        path_to_to_loading_labels = os.path.join(self.path_to_labelling_folder, f'{self.current_frame_idx:06d}.json')
-        
+        path_to_to_loading_labels = os.path.join(self.path_to_labelling_folder, f'{frame_idx:06d}.json')
+
+        # контейнер заполняется целиком и только потом подменяется, чтобы поток отображения не застал его наполовину заполненным
+        bboxes_container = BboxesContainer(self.frame_with_boxes.bboxes_container.registered_objects_store)
         if os.path.isfile(path_to_to_loading_labels):
             with open(path_to_to_loading_labels, 'r', encoding='utf-8') as fd:
                 bboxes_dict = json.load(fd)
 
-            #new_bboxes_dict = {}
+            hidden_bboxes_names = self.get_hidden_bboxes_names()
             for bbox_name, (x0,y0,x1,y1) in bboxes_dict.items():
                 class_name,id = bbox_name.split(',')
-                bbox = Bbox(x0, y0, x1, y1, self.img_rows, self.img_cols, class_name, -1, int(id), '', (0,255,0), 'registered')
-                self.frame_with_boxes.bboxes_container.update_bbox(bbox)
+                displaying_type = 'no' if bbox_name in hidden_bboxes_names else 'registered'
+                bbox = Bbox(x0, y0, x1, y1, self.img_rows, self.img_cols, class_name, -1, int(id), '', (0,255,0), displaying_type)
+                bboxes_container.update_bbox(bbox)
+        self.frame_with_boxes.update_bboxes_container(bboxes_container)
+
+    def get_hidden_bboxes_names(self):
+        '''
+        Имена рамок ("имя класса,индекс объекта"), выделение с которых в списке снято
+        '''
+        hidden_bboxes_names = set()
+        for item_idx in range(self.visible_classes_list_widget.count()):
+            item = self.visible_classes_list_widget.item(item_idx)
+            if not item.isSelected():
+                hidden_bboxes_names.add(item.data(0))
+        return hidden_bboxes_names
     
     def update_visible_classes_list(self):
         '''
-        обновление списка рамок. 
-        Информация о рамках берется из списка рамок, хранящегося в self.frame_with_boxes
+        Обновление видимости рамок по выделению в списке рамок. 
+        Рамки берутся из контейнера, хранящегося в self.frame_with_boxes
         '''
-
-        # определяем количество элементов в списке
-        qlist_len = self.visible_classes_list_widget.count()
-
-        #new_list = []
-        for bbox_name, bbox in self.frame_with_boxes.bboxes_dict.items():
-            #class_name = bbox.class_name
-            #sample_idx = bbox.id
-            is_selected = bbox.is_visible
-
-            #displayed_name = f'{class_name},{sample_idx}'
-            #item = QListWidgetItem(displayed_name)
-            
-            for item_idx in range(qlist_len):
-                item = self.visible_classes_list_widget.item(item_idx)
-
-                class_name_in_list = item.data(0)
-                if class_name_in_list == bbox_name:
-                    #self.visible_classes_list_widget.item(item_idx).setSelected(bbox.is_visible)
-                    self.frame_with_boxes.bboxes_dict[bbox_name].is_visible = item.isSelected()
-                    #self.visible_classes_list_widget.item(item_idx).setSelected(bbox.is_visible)
+        if self.frame_with_boxes is None:
+            return
+        hidden_bboxes_names = self.get_hidden_bboxes_names()
+        bboxes_container = self.frame_with_boxes.bboxes_container
+        for bbox in bboxes_container.get_all_registered_bboxes_list():
+            displaying_type = 'no' if f'{bbox.class_name},{bbox.registered_idx}' in hidden_bboxes_names else 'registered'
+            if bbox.displaying_type != displaying_type:
+                bboxes_container.change_bbox_displaying_type(bbox, displaying_type)
 
     
             
@@ -319,9 +444,23 @@ class LabelViewerWindow(QMainWindow):
             pass
             #self.save_labels_to_txt()
         self.close_imshow_thread()
+        self.close_video_source()
         self.frame_with_boxes = None
         self.reset_slider_display()
 
+    def close_video_source(self):
+        '''
+        Закрытие источника кадров видео и остановка потоков упреждающего чтения и создания прокси-видео
+        '''
+        if self.proxy_thread is not None:
+            self.proxy_thread.stop()
+            self.proxy_thread = None
+        self.close_seek_scheduler()
+        self.displayed_frame_idx = None
+        if self.video_source is not None:
+            self.video_source.release()
+            self.video_source = None
+
     def keyPressEvent(self, event):
         if event.text() == '.' or event.text().lower() == 'ю':
             self.next_frame_button_handling()
@@ -333,6 +472,7 @@ class LabelViewerWindow(QMainWindow):
         
     def open_file(self):
         self.close_imshow_thread()
+        self.close_video_source()
         # обнуляем список классов в видео, когда загружаем новое
         self.visible_classes_list_widget.clear()
         # получаем абсолютный путь до файла
@@ -387,15 +527,22 @@ class LabelViewerWindow(QMainWindow):
 
 
         # открытие файла
-        self.video_capture = cv2.VideoCapture(path)
+        self.video_source = open_video_source(
+            path,
+            prefetch_depth=self.settings_dict.get('prefetch_depth', 0),
+            history_cache_mb=self.settings_dict.get('history_cache_mb', 0),
+            use_frame_index=self.settings_dict.get('use_frame_index', False),
+            frame_store_mb=self.settings_dict.get('frame_store_mb', 0),
+            frame_store_scale=self.settings_dict.get('frame_store_scale', 1.0))
         # и чтение кадра
-        ret, frame = self.video_capture.read()
+        ret, frame_buffer = self.video_source.read_buffer(0)
         if not ret:
             raise RuntimeError(f'Can not read {path} video')
         
         # получение доп. параметров -количесва кадров и размера кадра
-        self.frame_number = int(self.video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
-        self.img_rows, self.img_cols = frame.shape[:2]
+        self.frame_number = self.video_source.frame_number
+        # размер берется у видео, а не у кадра: кадры хранилища могут быть уменьшены
+        self.img_rows, self.img_cols = self.video_source.source_shape
 
         if len(self.paths_to_labels_list) > 0:
             self.current_frame_idx = len(self.paths_to_labels_list) - 1
@@ -412,7 +559,15 @@ class LabelViewerWindow(QMainWindow):
         # инициализация первого кадра
         # ЗОЧЕМ? Разве не лучше
         #self.frame_with_boxes = BboxFrame(img=frame, class_names_list=self.class_names_list, current_class_name=self.class_names_list[0])
-        self.frame_with_boxes = BboxFrameTracker(img=frame)
+        # рамки берутся из файлов разметки, отслеживаемые объекты в просмотрщике не регистрируются, поэтому БД пустая
+        renderer_backend = self.settings_dict.get('renderer_backend', 'pil')
+        self.frame_with_boxes = BboxFrameTracker(
+            img=frame_buffer, registered_objects_db=RegisteredObjectsDB(), renderer_backend=renderer_backend)
+        # кадры, которые больше экрана, отображаются в разрешении экрана
+        self.frame_with_boxes.set_max_display_size(self.screen_width, self.screen_height)
+
+        # запуск потока, выполняющего переходы по кадрам
+        self.setup_seek_scheduler()
 
         # инициализация потока, отвечающего за показ кадров
         self.setup_imshow_thread()
@@ -426,6 +581,98 @@ class LabelViewerWindow(QMainWindow):
         # сразу открываем видео
         self.read_frame()
 
+        # навигация и отображение могут выполняться по прокси-видео в разрешении экрана (задается в settings.json)
+        if self.settings_dict.get('use_proxy', False):
+            self.setup_proxy_video(path)
+
+    def setup_proxy_video(self, path):
+        '''
+        Переход на прокси-видео: готовое прокси-видео открывается сразу, иначе оно создается в отдельном потоке.
+        Рамки при этом остаются в пикселях исходного видео
+        '''
+        proxy_path = get_proxy_path(path)
+        if is_proxy_fresh(proxy_path, path):
+            self.switch_to_proxy_video(proxy_path)
+            return
+        self.proxy_thread = ProxyTranscodeThread(path, proxy_path, self.screen_width, self.screen_height)
+        self.proxy_thread.progress_signal.connect(self.proxy_progress_slot)
+        self.proxy_thread.transcode_finished_signal.connect(self.proxy_finished_slot)
+        self.proxy_thread.start()
+
+    def proxy_progress_slot(self, progress):
+        self.statusBar().showMessage(f'Создание прокси-видео: {progress}%')
+
+    def proxy_finished_slot(self, is_completed):
+        if self.proxy_thread is None or self.sender() is not self.proxy_thread:
+            # видео было закрыто, пока создавалось прокси-видео
+            return
+        proxy_path = self.proxy_thread.proxy_path
+        self.proxy_thread = None
+        if is_completed:
+            self.statusBar().showMessage('Прокси-видео создано', 3000)
+            self.switch_to_proxy_video(proxy_path)
+        else:
+            self.statusBar().showMessage('Не удалось создать прокси-видео', 3000)
+
+    def switch_to_proxy_video(self, proxy_path):
+        '''
+        Замена источника кадров на прокси-видео. Прокси-видео с другим количеством кадров не используется
+        '''
+        proxy_source = open_video_source(
+            proxy_path,
+            prefetch_depth=self.settings_dict.get('prefetch_depth', 0),
+            history_cache_mb=self.settings_dict.get('history_cache_mb', 0))
+        if proxy_source.frame_number != self.frame_number:
+            proxy_source.release()
+            return
+        # источник кадров меняется, когда планировщик переходов остановлен
+        self.close_seek_scheduler()
+        source_video = self.video_source
+        self.video_source = proxy_source
+        source_video.release()
+        self.setup_seek_scheduler()
+        # показываем текущий кадр из прокси-видео
+        self.read_frame()
+
+    def setup_seek_scheduler(self):
+        self.seek_scheduler = SeekSchedulerThread(self.video_source)
+        self.seek_scheduler.frame_ready_signal.connect(self.frame_ready_slot)
+        self.seek_scheduler.preview_ready_signal.connect(self.preview_ready_slot)
+        self.seek_scheduler.start()
+
+    def close_seek_scheduler(self):
+        if self.seek_scheduler is not None:
+            self.seek_scheduler.stop()
+            self.seek_scheduler = None
+
+    def frame_ready_slot(self, request_version, frame_idx, frame_buffer):
+        '''
+        Прием кадра от планировщика переходов. Кадры устаревших запросов отбрасываются
+        '''
+        if self.seek_scheduler is None or self.frame_with_boxes is None or not self.seek_scheduler.is_latest(request_version):
+            frame_buffer.release()
+            return
+        self.show_frame(frame_idx, frame_buffer)
+
+    def preview_ready_slot(self, request_version, preview_idx, preview_buffer):
+        '''
+        Предпросмотр: пока нужный кадр декодируется, показывается ближайший прочитанный кадр.
+        Рамки при этом не меняются, они загружаются вместе с нужным кадром
+        '''
+        if self.seek_scheduler is None or self.frame_with_boxes is None or not self.seek_scheduler.is_latest(request_version):
+            preview_buffer.release()
+            return
+        self.frame_with_boxes.update_img(preview_buffer, source_shape=(self.img_rows, self.img_cols))
+
+    def show_frame(self, frame_idx, frame_buffer):
+        # обновляем кадр в потоке, отображающем кадр (без копирования, ссылку на буфер кадра забирает
+        # BboxFrameTracker). Кадр прокси-видео меньше исходного,
+        # поэтому передаем размер исходного кадра, в пикселях которого заданы рамки
+        self.frame_with_boxes.update_img(frame_buffer, source_shape=(self.img_rows, self.img_cols))
+        self.displayed_frame_idx = frame_idx
+        # загружаем рамки из файлов 
+        self.load_labels_from_file(frame_idx)
+
     def close_imshow_thread(self):
         if self.imshow_thread.isRunning():
             self.frame_with_boxes.delete_img()            
@@ -436,8 +683,11 @@ class LabelViewerWindow(QMainWindow):
         Сохранение координат рамок и классов в txt-файл, имя которого совпадает с номером кадра
         СОХРАНЕНИЕ ВЫПОЛНЯЕТСЯ АВТОМАТИЧЕСКИ ПРИ ПЕРЕХОДЕ НА СЛЕДУЮЩИЙ КАДР.
         '''
+        if self.displayed_frame_idx is None:
+            return
+        # рамки сохраняются для показанного кадра: после перехода слайдером нужный кадр может быть еще не прочитан
         path_to_target_json_label = os.path.join(
-            self.path_to_labelling_folder, f'{self.current_frame_idx:06d}.json')
+            self.path_to_labelling_folder, f'{self.displayed_frame_idx:06d}.json')
         '''        
 
         '''
@@ -445,7 +695,8 @@ class LabelViewerWindow(QMainWindow):
         
         # обновляем словарь новыми рамками
         labels_json_dict.update(
-            {bbox_name:[int(coord) for coord in bbox.coords] for bbox_name, bbox in self.frame_with_boxes.bboxes_dict.items()})
+            {f'{bbox.class_name},{bbox.registered_idx}':[int(coord) for coord in bbox.coords]
+             for bbox in self.frame_with_boxes.bboxes_container.get_all_registered_bboxes_list()})
         
         # Сохраняем разметку
         with open(path_to_target_json_label, 'w', encoding='utf-8') as fd:
@@ -468,9 +719,9 @@ class LabelViewerWindow(QMainWindow):
 
 
     def previous_frame_button_handling(self):
-        if self.video_capture is None or self.frame_with_boxes is None:
+        if self.video_source is None or self.frame_with_boxes is None:
             if self.imshow_thread.isRunning():
-                self.stop_imshow_thread()
+                self.close_imshow_thread()
             return
         #print('BEFORE SAVE')
         #print(self.frame_with_boxes.bboxes_dict)
@@ -482,9 +733,9 @@ class LabelViewerWindow(QMainWindow):
 
 
     def next_frame_button_handling(self):
-        if self.video_capture is None or self.frame_with_boxes is None:
+        if self.video_source is None or self.frame_with_boxes is None:
             if self.imshow_thread.isRunning():
-                self.stop_imshow_thread()
+                self.close_imshow_thread()
             return
         
         # сохраняем все рамки
@@ -503,7 +754,7 @@ class LabelViewerWindow(QMainWindow):
 
     def read_frame(self):
         '''Чтение кадра видео'''
-        if self.video_capture is None or self.current_frame_idx >= self.frame_number:
+        if self.video_source is None or self.current_frame_idx >= self.frame_number:
             return
         if self.current_frame_idx < 0:
             self.current_frame_idx = 0
@@ -512,19 +763,12 @@ class LabelViewerWindow(QMainWindow):
         # устанавливаем слайдер кадров в текущее положение
         self.set_slider_display_value(self.current_frame_idx)
         
-        # устанавливаем позицию позицию текущего кадра.
-        # это необходимо, т.к. мы можем двигаться как назад, так и вперед
-        self.video_capture.set(cv2.CAP_PROP_POS_FRAMES, self.current_frame_idx)
-
-        ret, frame = self.video_capture.read()
+        # читаем текущий кадр. Источник кадров сам выполняет перемотку,
+        # если мы двигаемся назад или перескакиваем через кадры. Незавершенные переходы слайдером отменяются
+        ret, frame_buffer = self.seek_scheduler.read_now(self.current_frame_idx)
         
         if ret:
-            # обновляем кадр в потоке, отображающем кадр
-            self.frame_with_boxes.update_img(frame)
-            # загружаем рамки из файлов 
-            self.load_labels_from_file()
-            # обновляем список видимых кадров
-            self.update_visible_classes_list()
+            self.show_frame(self.current_frame_idx, frame_buffer)
             
 
     def stop_showing(self):
@@ -0,0 +1,861 @@
+'''
+Чтение кадров видео для окон разметки и просмотра
+'''
+import os
+import bisect
+import threading
+from collections import deque, namedtuple, OrderedDict
+
+import cv2
+import numpy as np
+import pandas as pd
+
+def get_frame_index_path(path_to_video):
+    '''
+    Путь до файла индекса кадров: лежит рядом с папкой _labels и называется по имени видео
+    '''
+    path_to_folder, name = os.path.split(path_to_video)
+    return os.path.join(path_to_folder, '.'.join(name.split('.')[:-1]) + '_frame_index.csv')
+
+def get_proxy_path(path_to_video):
+    '''
+    Путь до прокси-видео: лежит рядом с папкой _labels и называется по имени видео
+    '''
+    path_to_folder, name = os.path.split(path_to_video)
+    return os.path.join(path_to_folder, '.'.join(name.split('.')[:-1]) + '_proxy.avi')
+
+def is_proxy_fresh(proxy_path, path_to_video):
+    '''
+    Прокси-видео можно использовать, если оно существует и создано после изменения исходного видео
+    '''
+    return os.path.isfile(proxy_path) and os.path.getmtime(proxy_path) >= os.path.getmtime(path_to_video)
+
+def transcode_proxy(path_to_video, proxy_path, max_width, max_height, progress_callback=None, stop_event=None, jpeg_quality=90):
+    '''
+    Перекодирование видео в прокси-видео MJPEG (каждый кадр - ключевой, поэтому перемотка не требует
+    декодирования соседних кадров) в разрешении отображения: кадры уменьшаются так, чтобы поместиться в
+    max_width x max_height. Количество и порядок кадров совпадают с исходным видео.
+    progress_callback(percent) вызывается при изменении прогресса в процентах, stop_event прерывает перекодирование.
+    Видео пишется во временный файл, который переименовывается только после успешного завершения.
+    Возвращает True, если прокси-видео создано
+    '''
+    video_capture = cv2.VideoCapture(path_to_video)
+    if not video_capture.isOpened():
+        return False
+    frame_number = max(int(video_capture.get(cv2.CAP_PROP_FRAME_COUNT)), 1)
+    fps = video_capture.get(cv2.CAP_PROP_FPS) or 25
+    cols = int(video_capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+    rows = int(video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    scale = min(1.0, max_width/cols, max_height/rows)
+    proxy_size = (max(int(round(cols*scale)), 1), max(int(round(rows*scale)), 1))
+
+    tmp_proxy_path = proxy_path[:-len('.avi')] + '.tmp.avi'
+    video_writer = cv2.VideoWriter(tmp_proxy_path, cv2.VideoWriter_fourcc(*'MJPG'), fps, proxy_size)
+    video_writer.set(cv2.VIDEOWRITER_PROP_QUALITY, jpeg_quality)
+    is_completed = video_writer.isOpened()
+    progress = -1
+    frame_idx = 0
+    while is_completed:
+        if stop_event is not None and stop_event.is_set():
+            is_completed = False
+            break
+        ret, frame = video_capture.read()
+        if not ret:
+            break
+        if proxy_size != (cols, rows):
+            frame = cv2.resize(frame, proxy_size, interpolation=cv2.INTER_AREA)
+        video_writer.write(frame)
+        frame_idx += 1
+        if progress_callback is not None and min(100*frame_idx//frame_number, 99) != progress:
+            progress = min(100*frame_idx//frame_number, 99)
+            progress_callback(progress)
+    video_writer.release()
+    video_capture.release()
+
+    is_completed = is_completed and frame_idx > 0
+    if is_completed:
+        os.replace(tmp_proxy_path, proxy_path)
+        if progress_callback is not None:
+            progress_callback(100)
+    elif os.path.isfile(tmp_proxy_path):
+        os.remove(tmp_proxy_path)
+    return is_completed
+
+class FrameIndex:
+    '''
+    Индекс кадров видео: время показа (PTS, мс) каждого кадра в порядке показа и номера ключевых кадров.
+    Строится один раз сканированием пакетов видео без декодирования и сохраняется в csv файл рядом с папкой _labels
+    '''
+    # при перемотке cv2 (FFmpeg) отступает на 16 кадров назад от нужного кадра, переходит на предшествующий им
+    # ключевой кадр и декодирует видео вперед
+    CV2_SEEK_BACK_FRAMES = 16
+
+    def __init__(self, pts_ms, keyframes):
+        self.pts_ms = np.asarray(pts_ms, dtype=np.float64)
+        self.keyframes = np.asarray(keyframes, dtype=np.int64)
+        if len(self.keyframes) == 0 or self.keyframes[0] != 0:
+            # первый кадр всегда можно получить перемоткой в начало видео
+            self.keyframes = np.concatenate([[0], self.keyframes])
+        # допуск при сопоставлении времени кадра с индексом - половина длительности кадра
+        frame_durations = np.diff(self.pts_ms)
+        self.pts_tolerance_ms = np.median(frame_durations)/2 if len(frame_durations) > 0 else 0.5
+
+    def __len__(self):
+        return len(self.pts_ms)
+
+    @classmethod
+    def scan(cls, path, stop_event=None):
+        '''
+        Построение индекса по пакетам видео (cv2 в режиме чтения пакетов без декодирования).
+        Возвращает None, если бэкенд cv2 не поддерживает чтение пакетов или сканирование было остановлено
+        '''
+        video_capture = cv2.VideoCapture(path)
+        try:
+            if not video_capture.isOpened() or not video_capture.set(cv2.CAP_PROP_FORMAT, -1):
+                return None
+            pts_ms = []
+            is_keyframe = []
+            while video_capture.grab():
+                if stop_event is not None and stop_event.is_set():
+                    return None
+                pts_ms.append(video_capture.get(cv2.CAP_PROP_POS_MSEC))
+                is_keyframe.append(bool(video_capture.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME)))
+        finally:
+            video_capture.release()
+        if len(pts_ms) == 0:
+            return None
+
+        # пакеты идут в порядке декодирования, а кадры нумеруются в порядке показа (важно для B-кадров)
+        pts_ms = np.array(pts_ms)
+        is_keyframe = np.array(is_keyframe)
+        order = np.argsort(pts_ms, kind='stable')
+        keyframes = np.flatnonzero(is_keyframe[order])
+        return cls(pts_ms[order], keyframes)
+
+    @classmethod
+    def read_csv(cls, path):
+        index_df = pd.read_csv(path)
+        return cls(index_df['pts_ms'].to_numpy(), np.flatnonzero(index_df['is_keyframe'].to_numpy()))
+
+    def to_csv(self, path):
+        is_keyframe = np.zeros(len(self.pts_ms), dtype=np.int8)
+        is_keyframe[self.keyframes] = 1
+        index_df = pd.DataFrame({'pts_ms': self.pts_ms, 'is_keyframe': is_keyframe})
+        index_df.to_csv(path, index_label='frame_idx')
+
+    @classmethod
+    def load_or_none(cls, path, path_to_video):
+        '''
+        Чтение сохраненного индекса. Индекс, который старше видео или не читается, не используется
+        '''
+        if not os.path.isfile(path) or os.path.getmtime(path) < os.path.getmtime(path_to_video):
+            return None
+        try:
+            frame_index = cls.read_csv(path)
+        except (OSError, ValueError, KeyError, pd.errors.ParserError):
+            return None
+        return frame_index if len(frame_index) > 0 else None
+
+    def keyframe_before(self, frame_idx):
+        '''
+        Ближайший ключевой кадр, не превышающий frame_idx
+        '''
+        return int(self.keyframes[bisect.bisect_right(self.keyframes, frame_idx) - 1])
+
+    def seek_cost(self, frame_idx):
+        '''
+        Количество кадров, которое декодирует cv2 при перемотке на кадр frame_idx
+        '''
+        return frame_idx - self.keyframe_before(max(frame_idx - self.CV2_SEEK_BACK_FRAMES, 0))
+
+    def frame_idx_from_pts(self, pts_ms):
+        '''
+        Индекс кадра по времени показа. None, если такого кадра в индексе нет
+        '''
+        i = bisect.bisect_left(self.pts_ms, pts_ms)
+        nearest_idx = min((j for j in (i - 1, i) if 0 <= j < len(self.pts_ms)), key=lambda j: abs(self.pts_ms[j] - pts_ms))
+        if abs(self.pts_ms[nearest_idx] - pts_ms) > self.pts_tolerance_ms:
+            return None
+        return nearest_idx
+
+# счетчики ссылок всех буферов кадров изменяются под одной блокировкой
+_FRAME_BUFFER_LOCK = threading.Lock()
+
+class FrameBuffer:
+    '''
+    Кадр видео со счетчиком ссылок. Кадр передается от источника кадров трекеру, альтернативному трекеру,
+    потоку отображения и кэшу кадров без копирования: каждый владелец получает ссылку через acquire
+    и отдает ее через release. Заполненный кадр доступен только для чтения.
+    Когда ссылок не остается, массив кадра возвращается в пул и переиспользуется для декодирования следующих кадров
+    '''
+    __slots__ = ('array', '_pool', '_refcount')
+
+    def __init__(self, array=None, pool=None):
+        self.array = array
+        self._pool = pool
+        self._refcount = 1
+
+    @classmethod
+    def wrap(cls, array):
+        '''
+        Буфер для внешнего массива (без пула): кадр доступен через представление только для чтения, без копирования
+        '''
+        array = array.view()
+        array.flags.writeable = False
+        return cls(array)
+
+    def set_frame(self, frame):
+        '''
+        Запись декодированного кадра. После нее кадр доступен только для чтения
+        '''
+        frame.flags.writeable = False
+        self.array = frame
+
+    def acquire(self):
+        with _FRAME_BUFFER_LOCK:
+            self._refcount += 1
+        return self
+
+    def release(self):
+        with _FRAME_BUFFER_LOCK:
+            self._refcount -= 1
+            is_free = self._refcount == 0
+        if is_free:
+            array = self.array
+            self.array = None
+            if self._pool is not None:
+                self._pool.recycle(array)
+
+class FrameBufferPool:
+    '''
+    Пул массивов кадров: освобожденные массивы переиспользуются декодером вместо выделения новой памяти.
+    Свободных массивов хранится не больше max_free_arrays
+    '''
+    def __init__(self, max_free_arrays=8):
+        self.max_free_arrays = max_free_arrays
+        self._free_arrays = []
+        self._lock = threading.Lock()
+
+    def get_buffer(self):
+        '''
+        Буфер для декодирования кадра: свободный массив из пула (доступный для записи) или пустой буфер
+        '''
+        with self._lock:
+            array = self._free_arrays.pop() if self._free_arrays else None
+        if array is not None:
+            array.flags.writeable = True
+        return FrameBuffer(array, self)
+
+    def recycle(self, array):
+        if array is None or array.base is not None:
+            return
+        with self._lock:
+            if len(self._free_arrays) < self.max_free_arrays:
+                self._free_arrays.append(array)
+
+    def __len__(self):
+        return len(self._free_arrays)
+
+class FrameSource:
+    '''
+    Общий интерфейс источников кадров. read_buffer возвращает кадр со счетчиком ссылок (FrameBuffer),
+    владельцем которого становится вызывающий код. read возвращает массив кадра, как cv2.VideoCapture.read;
+    такой кадр остается неизменным до следующего вызова read
+    '''
+    _last_read_buffer = None
+
+    def read_buffer(self, frame_idx):
+        raise NotImplementedError
+
+    def peek_nearest(self, frame_idx):
+        '''
+        Ближайший к frame_idx кадр, который уже прочитан и доступен без декодирования (для быстрого предпросмотра).
+        Возвращает (индекс кадра, frame_buffer) или (None, None)
+        '''
+        return None, None
+
+    def read(self, frame_idx):
+        '''
+        Чтение кадра с индексом frame_idx. Возвращает (ret, frame), как cv2.VideoCapture.read
+        '''
+        ret, frame_buffer = self.read_buffer(frame_idx)
+        self._release_last_read_buffer()
+        if not ret:
+            return False, None
+        self._last_read_buffer = frame_buffer
+        return True, frame_buffer.array
+
+    def _release_last_read_buffer(self):
+        if self._last_read_buffer is not None:
+            self._last_read_buffer.release()
+            self._last_read_buffer = None
+
+class VideoFrameSource(FrameSource):
+    '''
+    Источник кадров видео - обертка над cv2.VideoCapture, которая помнит позицию декодера
+    (индекс кадра, который вернет следующий вызов cv2.VideoCapture.read).
+    Если запрошен следующий по порядку кадр, он читается последовательно. Перемотка (CAP_PROP_POS_FRAMES)
+    выполняется только при настоящих переходах: на H.264 она возвращается к предыдущему ключевому кадру
+    и декодирует видео вперед до нужного кадра.
+    С индексом кадров (FrameIndex) источник при переходе вперед выбирает, что дешевле: декодировать кадры
+    от текущей позиции или выполнить перемотку, а после перемотки сверяет время показа кадра с индексом,
+    что исправляет неточную перемотку cv2 на видео с переменной частотой кадров
+    '''
+    READ_SEQUENTIAL = 'sequential'
+    READ_FORWARD = 'forward'
+    READ_SEEK = 'seek'
+    # количество попыток перемотки, если cv2 перемотал дальше нужного кадра
+    SEEK_ATTEMPTS = 3
+
+    def __init__(self, path):
+        self.path = path
+        self.video_capture = cv2.VideoCapture(path)
+        self.frame_number = int(self.video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        # размер исходного кадра (строки, столбцы)
+        self.source_shape = (
+            int(self.video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(self.video_capture.get(cv2.CAP_PROP_FRAME_WIDTH)))
+        # индекс кадра, который декодер вернет при следующем чтении; -1 - позиция неизвестна
+        self.position = 0
+        # способ, которым был прочитан последний кадр: READ_SEQUENTIAL, READ_FORWARD или READ_SEEK
+        self.last_read_path = None
+        # счетчики чтений для отладки и замеров
+        self.sequential_reads_num = 0
+        self.forward_reads_num = 0
+        self.seeks_num = 0
+        # массивы кадров переиспользуются после того, как все владельцы кадра его отпустили
+        self.frame_pool = FrameBufferPool()
+        # индекс кадров; появляется после загрузки из файла или фонового сканирования видео
+        self.frame_index = None
+        self._index_builder = None
+        self._index_builder_stop_event = threading.Event()
+
+    def attach_frame_index(self, index_path):
+        '''
+        Подключение индекса кадров: сохраненный индекс читается сразу,
+        иначе индекс строится в фоновом потоке и сохраняется в index_path
+        '''
+        self.frame_index = FrameIndex.load_or_none(index_path, self.path)
+        if self.frame_index is not None:
+            return
+        self._index_builder = threading.Thread(target=self._build_frame_index, args=(index_path,), daemon=True)
+        self._index_builder.start()
+
+    def _build_frame_index(self, index_path):
+        frame_index = FrameIndex.scan(self.path, self._index_builder_stop_event)
+        if frame_index is None:
+            return
+        try:
+            frame_index.to_csv(index_path)
+        except OSError:
+            pass
+        self.frame_index = frame_index
+
+    def isOpened(self):
+        return self.video_capture.isOpened()
+
+    def get(self, prop_id):
+        return self.video_capture.get(prop_id)
+
+    def read_buffer(self, frame_idx):
+        '''
+        Чтение кадра с индексом frame_idx. Возвращает (ret, frame_buffer). Кадр декодируется в массив из пула
+        '''
+        if frame_idx < 0 or frame_idx >= self.frame_number:
+            self.last_read_path = None
+            return False, None
+
+        frame_buffer = self.frame_pool.get_buffer()
+        image = frame_buffer.array
+        frame_index = self.frame_index
+        if frame_idx == self.position:
+            self.last_read_path = self.READ_SEQUENTIAL
+            self.sequential_reads_num += 1
+            ret, frame = self.video_capture.read(image)
+        elif frame_index is None or frame_idx >= len(frame_index):
+            self.video_capture.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+            self.last_read_path = self.READ_SEEK
+            self.seeks_num += 1
+            ret, frame = self.video_capture.read(image)
+        elif 0 <= self.position < frame_idx and frame_idx - self.position <= frame_index.seek_cost(frame_idx):
+            # кадров до нужного меньше, чем придется декодировать при перемотке
+            self.last_read_path = self.READ_FORWARD
+            self.forward_reads_num += 1
+            ret, frame = self._decode_forward(frame_idx - self.position, image)
+        else:
+            self.last_read_path = self.READ_SEEK
+            self.seeks_num += 1
+            ret, frame = self._seek_with_index(frame_index, frame_idx, image)
+
+        if not ret:
+            # после неудачного чтения позиция декодера неизвестна, следующее чтение выполнит перемотку
+            self.position = -1
+            frame_buffer.release()
+            return False, None
+        self.position = frame_idx + 1
+        frame_buffer.set_frame(frame)
+        return True, frame_buffer
+
+    def _decode_forward(self, skipped_frames_num, image=None):
+        '''
+        Пропуск skipped_frames_num кадров (декодирование без преобразования цвета) и чтение следующего кадра
+        '''
+        for _ in range(skipped_frames_num):
+            if not self.video_capture.grab():
+                return False, None
+        return self.video_capture.read(image)
+
+    def _seek_with_index(self, frame_index, frame_idx, image=None):
+        '''
+        Перемотка на кадр frame_idx с проверкой по времени показа: если cv2 перемотал не на тот кадр,
+        недостающие кадры декодируются вперед, а при перемотке дальше нужного она повторяется с поправкой
+        '''
+        request_idx = frame_idx
+        for _ in range(self.SEEK_ATTEMPTS):
+            self.video_capture.set(cv2.CAP_PROP_POS_FRAMES, request_idx)
+            if not self.video_capture.grab():
+                return False, None
+            landed_idx = frame_index.frame_idx_from_pts(self.video_capture.get(cv2.CAP_PROP_POS_MSEC))
+            if landed_idx is None:
+                # время кадра не найдено в индексе, доверяем перемотке cv2
+                landed_idx = request_idx
+            if landed_idx <= frame_idx:
+                break
+            request_idx = max(request_idx - (landed_idx - frame_idx), 0)
+        else:
+            # перемотка так и не попала на кадр перед нужным, читаем видео с начала
+            self.video_capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            if not self.video_capture.grab():
+                return False, None
+            landed_idx = 0
+
+        for _ in range(frame_idx - landed_idx):
+            if not self.video_capture.grab():
+                return False, None
+        return self.video_capture.retrieve(image)
+
+    def invalidate(self, frame_idx=None):
+        '''
+        Переход к другому кадру. Источник без упреждающего чтения ничего не хранит, поэтому сбрасывать нечего
+        '''
+        pass
+
+    def release(self):
+        self._release_last_read_buffer()
+        self._index_builder_stop_event.set()
+        if self._index_builder is not None:
+            self._index_builder.join()
+        self.video_capture.release()
+        self.position = -1
+
+# прочитанный заранее кадр: индекс кадра, буфер кадра (None, если кадр не прочитан) и способ чтения
+PrefetchedFrame = namedtuple('PrefetchedFrame', ['frame_idx', 'frame_buffer', 'read_path'])
+
+class FramePrefetcher(FrameSource):
+    '''
+    Упреждающее чтение кадров. Фоновый поток декодирует кадры idx+1 ... idx+depth вперед от текущей позиции
+    в ограниченную очередь, read_buffer забирает готовый кадр из очереди. Массивы кадров переиспользуются
+    через пул буферов источника: массив возвращается в пул, когда все владельцы кадра его отпустили.
+    При переходе назад или через несколько кадров очередь сбрасывается и чтение начинается с новой позиции.
+    Интерфейс совпадает с VideoFrameSource
+    '''
+    READ_PREFETCHED = 'prefetched'
+
+    def __init__(self, video_source, depth=4):
+        if depth < 1:
+            raise ValueError(f'Prefetch depth must be positive, got {depth}')
+        self.video_source = video_source
+        self.depth = depth
+        self.frame_number = video_source.frame_number
+        self.source_shape = video_source.source_shape
+        # способ, которым был получен последний кадр: READ_PREFETCHED или способ чтения VideoFrameSource
+        self.last_read_path = None
+        self.prefetched_reads_num = 0
+
+        # готовые кадры в порядке возрастания индексов, не больше depth
+        self._ready = deque()
+        # индекс кадра, который поток чтения декодирует следующим; None - поток простаивает
+        self._next_idx = None
+        # номер поколения очереди увеличивается при каждом сбросе, устаревшие кадры потока чтения отбрасываются
+        self._generation = 0
+        self._is_stopped = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def position(self):
+        return self.video_source.position
+
+    def _drop_ready_frame(self):
+        frame_buffer = self._ready.popleft().frame_buffer
+        if frame_buffer is not None:
+            frame_buffer.release()
+
+    def _reset(self, frame_idx):
+        '''
+        Сброс очереди и перезапуск чтения с кадра frame_idx. Вызывается под self._condition
+        '''
+        while self._ready:
+            self._drop_ready_frame()
+        self._generation += 1
+        self._next_idx = frame_idx
+        self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._is_stopped and (
+                    self._next_idx is None or self._next_idx >= self.frame_number or len(self._ready) >= self.depth):
+                    self._condition.wait()
+                if self._is_stopped:
+                    return
+                frame_idx = self._next_idx
+                generation = self._generation
+
+            # декодирование выполняется без блокировки, чтобы read_buffer мог забирать уже готовые кадры
+            ret, frame_buffer = self.video_source.read_buffer(frame_idx)
+            read_path = self.video_source.last_read_path
+
+            with self._condition:
+                if generation != self._generation:
+                    # пока кадр декодировался, очередь была сброшена
+                    if ret:
+                        frame_buffer.release()
+                    continue
+                self._ready.append(PrefetchedFrame(frame_idx, frame_buffer if ret else None, read_path))
+                self._next_idx = frame_idx + 1 if ret else None
+                self._condition.notify_all()
+
+    def read_buffer(self, frame_idx):
+        '''
+        Чтение кадра с индексом frame_idx. Возвращает (ret, frame_buffer)
+        '''
+        with self._condition:
+            if frame_idx < 0 or frame_idx >= self.frame_number:
+                self.last_read_path = None
+                return False, None
+            # пропускаем кадры, через которые перешли вперед
+            while self._ready and self._ready[0].frame_idx < frame_idx:
+                self._drop_ready_frame()
+
+            if self._ready and self._ready[0].frame_idx == frame_idx:
+                is_prefetched = True
+            elif not self._ready and self._next_idx == frame_idx:
+                # нужный кадр декодируется прямо сейчас или будет декодирован следующим
+                is_prefetched = False
+            else:
+                is_prefetched = False
+                self._reset(frame_idx)
+            self._condition.notify_all()
+
+            while not self._ready:
+                self._condition.wait()
+            prefetched_frame = self._ready.popleft()
+            # освободившееся в очереди место позволяет потоку чтения декодировать следующий кадр
+            self._condition.notify_all()
+
+            self.last_read_path = self.READ_PREFETCHED if is_prefetched else prefetched_frame.read_path
+            if is_prefetched:
+                self.prefetched_reads_num += 1
+            if prefetched_frame.frame_buffer is None:
+                return False, None
+            return True, prefetched_frame.frame_buffer
+
+    def peek_nearest(self, frame_idx):
+        with self._condition:
+            if not self._ready:
+                return None, None
+            prefetched_frame = min(
+                (prefetched_frame for prefetched_frame in self._ready if prefetched_frame.frame_buffer is not None),
+                key=lambda prefetched_frame: abs(prefetched_frame.frame_idx - frame_idx), default=None)
+            if prefetched_frame is None:
+                return None, None
+            return prefetched_frame.frame_idx, prefetched_frame.frame_buffer.acquire()
+
+    def invalidate(self, frame_idx=None):
+        '''
+        Сброс прочитанных заранее кадров при переходе к другому кадру.
+        frame_idx - кадр, с которого надо начать упреждающее чтение (None - не читать до следующего вызова read)
+        '''
+        with self._condition:
+            self._reset(frame_idx)
+
+    def release(self):
+        with self._condition:
+            self._is_stopped = True
+            self._condition.notify_all()
+        self._thread.join()
+        with self._condition:
+            while self._ready:
+                self._drop_ready_frame()
+        self._release_last_read_buffer()
+        self.video_source.release()
+
+class FrameHistoryCache(FrameSource):
+    '''
+    LRU кэш недавно показанных кадров, ограниченный объемом памяти. Шаг назад и повторное чтение
+    предыдущего кадра обслуживаются из кэша без перемотки и декодирования.
+    Кэш хранит ссылки на буферы кадров, а не их копии. Интерфейс совпадает с VideoFrameSource
+    '''
+    READ_HISTORY = 'history'
+
+    def __init__(self, video_source, memory_budget_mb=512):
+        self.video_source = video_source
+        self.frame_number = video_source.frame_number
+        self.source_shape = video_source.source_shape
+        self.memory_budget = int(memory_budget_mb*1024*1024)
+        self.memory_used = 0
+        self.last_read_path = None
+        self.history_reads_num = 0
+        # индекс кадра -> буфер кадра, в порядке от давно прочитанных к недавно прочитанным
+        self._frames = OrderedDict()
+
+    @property
+    def position(self):
+        return self.video_source.position
+
+    def __contains__(self, frame_idx):
+        return frame_idx in self._frames
+
+    def _put(self, frame_idx, frame_buffer):
+        if frame_buffer.array.nbytes > self.memory_budget:
+            return
+        self._frames[frame_idx] = frame_buffer.acquire()
+        self.memory_used += frame_buffer.array.nbytes
+        while self.memory_used > self.memory_budget:
+            _, evicted_frame_buffer = self._frames.popitem(last=False)
+            self.memory_used -= evicted_frame_buffer.array.nbytes
+            evicted_frame_buffer.release()
+
+    def read_buffer(self, frame_idx):
+        '''
+        Чтение кадра с индексом frame_idx. Возвращает (ret, frame_buffer)
+        '''
+        frame_buffer = self._frames.get(frame_idx)
+        if frame_buffer is not None:
+            self._frames.move_to_end(frame_idx)
+            self.last_read_path = self.READ_HISTORY
+            self.history_reads_num += 1
+            return True, frame_buffer.acquire()
+
+        ret, frame_buffer = self.video_source.read_buffer(frame_idx)
+        self.last_read_path = self.video_source.last_read_path
+        if ret:
+            self._put(frame_idx, frame_buffer)
+        return ret, frame_buffer
+
+    def peek_nearest(self, frame_idx):
+        nearest_idx, nearest_frame_buffer = self.video_source.peek_nearest(frame_idx)
+        cached_idx = min(self._frames, key=lambda cached_idx: abs(cached_idx - frame_idx), default=None)
+        if cached_idx is None or (nearest_idx is not None and abs(nearest_idx - frame_idx) <= abs(cached_idx - frame_idx)):
+            return nearest_idx, nearest_frame_buffer
+        if nearest_frame_buffer is not None:
+            nearest_frame_buffer.release()
+        return cached_idx, self._frames[cached_idx].acquire()
+
+    def invalidate(self, frame_idx=None):
+        # уже прочитанные кадры не меняются, сбрасывается только упреждающее чтение
+        self.video_source.invalidate(frame_idx)
+
+    def clear(self):
+        for frame_buffer in self._frames.values():
+            frame_buffer.release()
+        self._frames.clear()
+        self.memory_used = 0
+
+    def release(self):
+        self._release_last_read_buffer()
+        self.clear()
+        self.video_source.release()
+
+def get_frame_store_path(path_to_video, scale=1.0):
+    '''
+    Путь до хранилища декодированных кадров: лежит рядом с папкой _labels, в имени указан масштаб кадров
+    '''
+    path_to_folder, name = os.path.split(path_to_video)
+    suffix = '_frames.npy' if scale == 1.0 else f'_frames_x{scale:.2f}.npy'
+    return os.path.join(path_to_folder, '.'.join(name.split('.')[:-1]) + suffix)
+
+class FrameStore:
+    '''
+    Хранилище декодированных кадров на диске - массив NumPy (кадры, строки, столбцы, каналы),
+    отображаемый в память, и массив флагов заполненных кадров. Кадры читаются из страничного кэша ОС без
+    декодирования и копирования, поэтому хранилище одного видео могут одновременно использовать окна разметки и просмотра.
+    Объем ограничен max_size_mb: в хранилище помещаются только первые capacity кадров видео
+    '''
+    def __init__(self, path, path_to_video, frame_number, frame_shape, max_size_mb):
+        self.path = path
+        self.filled_path = path[:-len('.npy')] + '_filled.npy'
+        frame_bytes = int(np.prod(frame_shape))
+        self.capacity = min(frame_number, int(max_size_mb*1024*1024)//frame_bytes)
+        self.frames = None
+        self.filled = None
+        if self.capacity <= 0:
+            return
+        shape = (self.capacity,) + tuple(frame_shape)
+        if not self._open_existing(path_to_video, shape):
+            self._create(shape)
+
+    def _open_existing(self, path_to_video, shape):
+        '''
+        Открытие ранее созданного хранилища. Хранилище, которое старше видео или имеет другой размер, не используется
+        '''
+        if not os.path.isfile(self.path) or not os.path.isfile(self.filled_path):
+            return False
+        if os.path.getmtime(self.path) < os.path.getmtime(path_to_video):
+            return False
+        try:
+            frames = np.load(self.path, mmap_mode='r+')
+            filled = np.load(self.filled_path, mmap_mode='r+')
+        except (OSError, ValueError):
+            return False
+        if frames.shape != shape or frames.dtype != np.uint8 or filled.shape != shape[:1]:
+            return False
+        self.frames = frames
+        self.filled = filled
+        return True
+
+    def _create(self, shape):
+        # файлы создаются под временными именами, чтобы другое окно не открыло недописанный заголовок
+        for path, array_shape in ((self.filled_path, shape[:1]), (self.path, shape)):
+            tmp_path = path[:-len('.npy')] + '.tmp.npy'
+            array = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8, shape=array_shape)
+            del array
+            os.replace(tmp_path, path)
+        self.frames = np.load(self.path, mmap_mode='r+')
+        self.filled = np.load(self.filled_path, mmap_mode='r+')
+
+    def __contains__(self, frame_idx):
+        return 0 <= frame_idx < self.capacity and bool(self.filled[frame_idx])
+
+    def find_nearest(self, frame_idx, max_distance=256):
+        '''
+        Ближайший к frame_idx кадр хранилища не дальше max_distance кадров или None
+        '''
+        start_idx = max(frame_idx - max_distance, 0)
+        stored_idxs = np.flatnonzero(self.filled[start_idx:min(frame_idx + max_distance + 1, self.capacity)]) + start_idx
+        if len(stored_idxs) == 0:
+            return None
+        return int(stored_idxs[np.argmin(np.abs(stored_idxs - frame_idx))])
+
+    def get(self, frame_idx):
+        '''
+        Кадр из хранилища - представление отображаемого в память файла, доступное только для чтения
+        '''
+        frame = self.frames[frame_idx]
+        frame.flags.writeable = False
+        return frame
+
+    def put(self, frame_idx, frame):
+        '''
+        Запись кадра в хранилище. Возвращает записанный кадр или None, если кадр не помещается в хранилище
+        '''
+        if not 0 <= frame_idx < self.capacity or frame.shape != self.frames.shape[1:]:
+            return None
+        self.frames[frame_idx] = frame
+        # флаг выставляется после записи кадра, чтобы другое окно не прочитало недописанный кадр
+        self.filled[frame_idx] = 1
+        return self.get(frame_idx)
+
+    def close(self):
+        if self.frames is not None:
+            self.frames.flush()
+            self.filled.flush()
+        self.frames = None
+        self.filled = None
+        self.capacity = 0
+
+class StoredFrameSource(FrameSource):
+    '''
+    Источник кадров, который читает кадры из хранилища FrameStore, а недостающие декодирует и записывает в него.
+    При scale < 1 кадры уменьшаются перед записью, такие кадры пригодны только для отображения.
+    Интерфейс совпадает с VideoFrameSource
+    '''
+    READ_STORED = 'stored'
+
+    def __init__(self, video_source, frame_store, frame_size=None):
+        self.video_source = video_source
+        self.frame_store = frame_store
+        # размер кадров хранилища (ширина, высота); None - кадры хранятся в исходном размере
+        self.frame_size = frame_size
+        self.frame_number = video_source.frame_number
+        self.source_shape = video_source.source_shape
+        self.last_read_path = None
+        self.stored_reads_num = 0
+
+    @property
+    def position(self):
+        return self.video_source.position
+
+    def read_buffer(self, frame_idx):
+        '''
+        Чтение кадра с индексом frame_idx. Возвращает (ret, frame_buffer)
+        '''
+        if frame_idx in self.frame_store:
+            self.last_read_path = self.READ_STORED
+            self.stored_reads_num += 1
+            return True, FrameBuffer(self.frame_store.get(frame_idx))
+
+        ret, frame_buffer = self.video_source.read_buffer(frame_idx)
+        self.last_read_path = self.video_source.last_read_path
+        if not ret:
+            return ret, frame_buffer
+        frame = frame_buffer.array
+        if self.frame_size is not None:
+            frame = cv2.resize(frame, self.frame_size, interpolation=cv2.INTER_AREA)
+        stored_frame = self.frame_store.put(frame_idx, frame)
+        if stored_frame is not None:
+            frame_buffer.release()
+            return True, FrameBuffer(stored_frame)
+        if self.frame_size is not None:
+            frame_buffer.release()
+            return True, FrameBuffer.wrap(frame)
+        return True, frame_buffer
+
+    def peek_nearest(self, frame_idx):
+        stored_idx = self.frame_store.find_nearest(frame_idx) if self.frame_store.capacity > 0 else None
+        if stored_idx == frame_idx:
+            return stored_idx, FrameBuffer(self.frame_store.get(stored_idx))
+        # кадры внутренних источников имеют исходный размер, а кадры хранилища могут быть уменьшены
+        nearest_idx, nearest_frame_buffer = self.video_source.peek_nearest(frame_idx)
+        if stored_idx is None or (nearest_idx is not None and abs(nearest_idx - frame_idx) < abs(stored_idx - frame_idx)):
+            return nearest_idx, nearest_frame_buffer
+        if nearest_frame_buffer is not None:
+            nearest_frame_buffer.release()
+        return stored_idx, FrameBuffer(self.frame_store.get(stored_idx))
+
+    def invalidate(self, frame_idx=None):
+        self.video_source.invalidate(frame_idx)
+
+    def release(self):
+        self._release_last_read_buffer()
+        self.frame_store.close()
+        self.video_source.release()
+
+def open_video_source(
+        path, prefetch_depth=0, history_cache_mb=0, use_frame_index=False, frame_store_mb=0, frame_store_scale=1.0):
+    '''
+    Открытие источника кадров видео. При prefetch_depth > 0 кадры читаются заранее в фоновом потоке,
+    при history_cache_mb > 0 недавно показанные кадры хранятся в LRU кэше заданного объема (МБ),
+    при use_frame_index переходы между кадрами выполняются по индексу ключевых кадров,
+    при frame_store_mb > 0 декодированные кадры сохраняются в хранилище на диске заданного объема (МБ),
+    frame_store_scale - масштаб кадров в хранилище
+    '''
+    video_source = VideoFrameSource(path)
+    if use_frame_index:
+        video_source.attach_frame_index(get_frame_index_path(path))
+    rows, cols = video_source.source_shape
+    if prefetch_depth > 0:
+        video_source = FramePrefetcher(video_source, prefetch_depth)
+    if history_cache_mb > 0:
+        video_source = FrameHistoryCache(video_source, history_cache_mb)
+    if frame_store_mb > 0 and rows > 0 and cols > 0:
+        frame_size = None
+        if frame_store_scale != 1.0:
+            frame_size = (max(int(round(cols*frame_store_scale)), 1), max(int(round(rows*frame_store_scale)), 1))
+            cols, rows = frame_size
+        frame_store = FrameStore(
+            get_frame_store_path(path, frame_store_scale), path, video_source.frame_number, (rows, cols, 3), frame_store_mb)
+        if frame_store.capacity > 0:
+            video_source = StoredFrameSource(video_source, frame_store, frame_size)
+    return video_source